@@ -1,17 +1,39 @@
 from figure_report.report import Report
-from figure_report.html_report import HtmlReport
+from figure_report.metadata_index import MetadataIndex, Prefix
 from figure_report.patterns import (
     pattern_to_metadata_table,
     pattern_set_to_metadata_table,
+    iter_pattern_matches,
+    sel_expand,
+    iter_sel_expand,
+    sel_expand_to_metadata_table,
     copy_report_files_to_report_dir,
     convert_metadata_table_to_report_json,
+    get_paths,
 )
 
 __all__ = [
     "Report",
     "HtmlReport",
+    "MetadataIndex",
+    "Prefix",
     "pattern_to_metadata_table",
     "pattern_set_to_metadata_table",
+    "iter_pattern_matches",
+    "sel_expand",
+    "iter_sel_expand",
+    "sel_expand_to_metadata_table",
     "copy_report_files_to_report_dir",
     "convert_metadata_table_to_report_json",
+    "get_paths",
 ]
+
+
+def __getattr__(name):
+    # HtmlReport pulls in matplotlib, seaborn, plotnine and IPython; import it
+    # lazily so that the command line interface starts quickly
+    if name == "HtmlReport":
+        from figure_report.html_report import HtmlReport
+
+        return HtmlReport
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,351 @@
+"""Size and cost analysis of generated reports, with budgets
+
+analyze_report parses the html pages of a report directory (from
+Report.generate or HtmlReport.save) and collects, per page and per section
+(the content between two headings):
+
+- html bytes
+- assets loaded by the page: images, scripts, stylesheets, CSS backgrounds
+  (e.g. grid atlases) and the panels of interactive grids
+- linked files, e.g. download links, which are only fetched on click
+- number of Vega specs and tables
+
+Local assets are resolved relative to the page, and their sizes are read from
+disk; URLs are counted but have no size.
+
+Budgets map the keys of BUDGET_KEYS to limits. check_budgets raises
+BudgetExceededError, listing all violations, if any limit is exceeded.
+"""
+import json
+import os
+import re
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import unquote, urlsplit
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+CSS_URL_REGEX = re.compile(r'url\(\s*["\']?([^"\')]+)["\']?\s*\)')
+# sections shown in the summary, per page
+N_LARGEST_SECTIONS = 5
+BUDGET_KEYS = {
+    'report_bytes': 'total bytes of all pages and their assets',
+    'page_html_bytes': 'html bytes per page',
+    'page_assets': 'number of assets loaded per page',
+    'page_asset_bytes': 'bytes of assets loaded per page',
+    'asset_bytes': 'bytes of a single asset',
+    'section_asset_bytes': 'bytes of assets loaded per section',
+    'page_vega_specs': 'number of Vega specs per page',
+    'page_tables': 'number of tables per page',
+}
+
+
+class BudgetExceededError(ValueError):
+    """Raised by check_budgets, the message lists all violations"""
+
+
+class SectionStats:
+    """Content of one section: html bytes, assets, Vega specs and tables
+
+    assets and linked map paths (relative to the report directory, or URLs)
+    to sizes in bytes, None for URLs and missing files.
+    """
+    __slots__ = ('name', 'html_bytes', 'assets', 'linked', 'n_vega_specs', 'n_tables')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.html_bytes = 0
+        self.assets: Dict[str, Optional[int]] = {}
+        self.linked: Dict[str, Optional[int]] = {}
+        self.n_vega_specs = 0
+        self.n_tables = 0
+
+    @property
+    def asset_bytes(self) -> int:
+        return sum(x or 0 for x in self.assets.values())
+
+    @property
+    def linked_bytes(self) -> int:
+        return sum(x or 0 for x in self.linked.values())
+
+
+class PageStats(NamedTuple):
+    name: str
+    sections: List[SectionStats]
+
+    def _merged(self, attr: str) -> Dict[str, Optional[int]]:
+        merged = {}
+        for section in self.sections:
+            merged.update(getattr(section, attr))
+        return merged
+
+    @property
+    def html_bytes(self) -> int:
+        return sum(x.html_bytes for x in self.sections)
+
+    @property
+    def assets(self) -> Dict[str, Optional[int]]:
+        return self._merged('assets')
+
+    @property
+    def linked(self) -> Dict[str, Optional[int]]:
+        return self._merged('linked')
+
+    @property
+    def asset_bytes(self) -> int:
+        return sum(x or 0 for x in self.assets.values())
+
+    @property
+    def n_vega_specs(self) -> int:
+        return sum(x.n_vega_specs for x in self.sections)
+
+    @property
+    def n_tables(self) -> int:
+        return sum(x.n_tables for x in self.sections)
+
+
+class ReportAnalysis(NamedTuple):
+    report_dir: str
+    pages: List[PageStats]
+
+    @property
+    def total_bytes(self) -> int:
+        """Bytes of all pages and of all local files they load or link, counted once"""
+        files = {}
+        for page in self.pages:
+            files.update(page.assets)
+            files.update(page.linked)
+        return sum(x.html_bytes for x in self.pages) + sum(x or 0 for x in files.values())
+
+    @property
+    def assets(self) -> Dict[str, Optional[int]]:
+        """Assets loaded by any page"""
+        assets = {}
+        for page in self.pages:
+            assets.update(page.assets)
+        return assets
+
+    def largest_assets(self, n: int = 10) -> List[Tuple[str, int]]:
+        return sorted(((path, size) for path, size in self.assets.items() if size),
+                      key=lambda x: -x[1])[:n]
+
+    def summary(self, n_largest: int = 10) -> str:
+        """Readable table of pages, their largest sections and the largest assets"""
+        lines = [f'Report {self.report_dir}: {len(self.pages)} pages, '
+                 f'{_format_bytes(self.total_bytes)} total',
+                 f'{"page / section":<40} {"html":>10} {"assets":>7} {"asset size":>11} '
+                 f'{"linked":>11} {"vega":>5} {"tables":>6}']
+
+        def row(name, stats, n_assets, linked_bytes):
+            return (f'{name[:40]:<40} {_format_bytes(stats.html_bytes):>10} {n_assets:>7} '
+                    f'{_format_bytes(stats.asset_bytes):>11} {_format_bytes(linked_bytes):>11} '
+                    f'{stats.n_vega_specs:>5} {stats.n_tables:>6}')
+
+        for page in sorted(self.pages, key=lambda x: -(x.html_bytes + x.asset_bytes)):
+            page_linked_bytes = sum(x or 0 for x in page.linked.values())
+            lines.append(row(page.name, page, len(page.assets), page_linked_bytes))
+            sections = sorted(page.sections, key=lambda x: -(x.html_bytes + x.asset_bytes))
+            for section in sections[:N_LARGEST_SECTIONS]:
+                lines.append(row('  ' + section.name, section, len(section.assets),
+                                 section.linked_bytes))
+        lines.append('Largest assets:')
+        lines += [f'  {_format_bytes(size):>10} {path}'
+                  for path, size in self.largest_assets(n_largest)]
+        return '\n'.join(lines)
+
+    def budget_violations(self, budgets: Dict[str, float]) -> List[str]:
+        """Readable description of each exceeded budget, see BUDGET_KEYS"""
+        validate_budgets(budgets)
+        violations = []
+
+        def check(key, name, value, format_fn=_format_bytes):
+            if key in budgets and value > budgets[key]:
+                violations.append(f'{name}: {BUDGET_KEYS[key]} is {format_fn(value)}, '
+                                  f'budget {format_fn(budgets[key])} ({key})')
+
+        check('report_bytes', 'report', self.total_bytes)
+        for page in self.pages:
+            check('page_html_bytes', page.name, page.html_bytes)
+            check('page_assets', page.name, len(page.assets), str)
+            check('page_asset_bytes', page.name, page.asset_bytes)
+            check('page_vega_specs', page.name, page.n_vega_specs, str)
+            check('page_tables', page.name, page.n_tables, str)
+            for section in page.sections:
+                check('section_asset_bytes', f'{page.name} / {section.name}',
+                      section.asset_bytes)
+        if 'asset_bytes' in budgets:
+            for path, size in sorted(self.assets.items()):
+                check('asset_bytes', path, size or 0)
+        return violations
+
+
+def validate_budgets(budgets: Dict[str, float]):
+    """Raise ValueError for unknown budget keys and non-numeric limits"""
+    unknown_keys = set(budgets) - set(BUDGET_KEYS)
+    if unknown_keys:
+        raise ValueError(f'Unknown budget keys: {sorted(unknown_keys)}, '
+                         f'expected some of {sorted(BUDGET_KEYS)}')
+    for key, limit in budgets.items():
+        if isinstance(limit, bool) or not isinstance(limit, (int, float)):
+            raise ValueError(f'Budget {key} must be a number, got {limit!r}')
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ['B', 'kB', 'MB']:
+        if abs(n) < 1000:
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1000
+    return f'{n:.1f} GB'
+
+
+class _PageParser(HTMLParser):
+    """Split a page into sections at headings, collect references per section"""
+
+    def __init__(self, page_text: str, page_dir: Path, report_dir: Path):
+        super().__init__(convert_charrefs=True)
+        self.page_text = page_text
+        self.page_dir = page_dir
+        self.report_dir = report_dir
+        # char offset of the start of each line, to convert getpos to offsets
+        self.line_offsets = [0] + [m.end() for m in re.finditer('\n', page_text)]
+        self.sections = [SectionStats('(before first heading)')]
+        self.section_offsets = [0]
+        self.heading_stack: List[Tuple[int, str]] = []
+        self.heading_tag: Optional[str] = None
+        self.heading_text: List[str] = []
+        self.script_type: Optional[str] = None
+        self.script_text: List[str] = []
+        self.in_style = False
+        self.in_interactive_grid = False
+        self._sizes: Dict[str, Optional[int]] = {}
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def _resolve(self, ref: str) -> Optional[Tuple[str, Optional[int]]]:
+        ref = ref.strip()
+        if not ref or ref.startswith(('#', 'data:', 'javascript:', 'mailto:')):
+            return None
+        parts = urlsplit(ref)
+        if parts.scheme or parts.netloc:
+            return ref, None
+        full_path = os.path.normpath(self.page_dir / unquote(parts.path))
+        key = os.path.relpath(full_path, self.report_dir)
+        if key not in self._sizes:
+            try:
+                self._sizes[key] = os.path.getsize(full_path)
+            except OSError:
+                self._sizes[key] = None
+        return key, self._sizes[key]
+
+    def _add(self, ref: str, linked: bool = False):
+        resolved = self._resolve(ref)
+        if resolved is not None:
+            section = self.sections[-1]
+            (section.linked if linked else section.assets)[resolved[0]] = resolved[1]
+
+    def _add_css(self, css: str):
+        for ref in CSS_URL_REGEX.findall(css):
+            self._add(ref)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in HEADING_TAGS or (tag == 'strong' and 'id' in attrs):
+            self.heading_tag = tag
+            self.heading_text = []
+            self.section_offsets.append(self._offset())
+            self.sections.append(SectionStats(''))
+        elif tag == 'img' and attrs.get('src'):
+            self._add(attrs['src'])
+        elif tag == 'script':
+            self.script_type = attrs.get('type') or 'text/javascript'
+            self.script_text = []
+            if attrs.get('src'):
+                self._add(attrs['src'])
+        elif tag == 'link' and attrs.get('href'):
+            self._add(attrs['href'])
+        elif tag == 'a' and attrs.get('href'):
+            self._add(attrs['href'], linked=True)
+        elif tag == 'table':
+            self.sections[-1].n_tables += 1
+        elif tag == 'style':
+            self.in_style = True
+        if tag == 'div' and 'interactive-grid' in (attrs.get('class') or '').split():
+            self.in_interactive_grid = True
+        if attrs.get('style'):
+            self._add_css(attrs['style'])
+
+    def handle_endtag(self, tag):
+        if tag == self.heading_tag:
+            self.heading_tag = None
+            text = ' '.join(''.join(self.heading_text).split())
+            level = int(tag[1]) if tag in HEADING_TAGS else 7
+            while self.heading_stack and self.heading_stack[-1][0] >= level:
+                self.heading_stack.pop()
+            self.heading_stack.append((level, text))
+            self.sections[-1].name = ' > '.join(x[1] for x in self.heading_stack)
+        elif tag == 'script' and self.script_type is not None:
+            self._handle_script(''.join(self.script_text))
+            self.script_type = None
+        elif tag == 'style':
+            self.in_style = False
+
+    def _handle_script(self, text: str):
+        if self.script_type == 'application/json' and self.in_interactive_grid:
+            panels = json.loads(text)
+            for path in panels['paths']:
+                self._add(panels['prefix'] + path)
+            self.in_interactive_grid = False
+        elif 'vegaEmbed(' in text:
+            self.sections[-1].n_vega_specs += 1
+            spec = re.search(r'var spec = "([^"]+)"', text)
+            if spec is not None:
+                self._add(spec.group(1))
+
+    def handle_data(self, data):
+        if self.heading_tag is not None:
+            self.heading_text.append(data)
+        elif self.script_type is not None:
+            self.script_text.append(data)
+        elif self.in_style:
+            self._add_css(data)
+
+    def parse(self) -> List[SectionStats]:
+        self.feed(self.page_text)
+        self.close()
+        offsets = self.section_offsets + [len(self.page_text)]
+        for section, start, stop in zip(self.sections, offsets[:-1], offsets[1:]):
+            section.html_bytes = len(self.page_text[start:stop].encode())
+        return [x for x in self.sections if x.html_bytes or x.assets or x.linked]
+
+
+def analyze_page(page_path: Union[str, os.PathLike],
+                 report_dir: Optional[Union[str, os.PathLike]] = None) -> PageStats:
+    """Stats of one html page, asset paths relative to report_dir (default: page dir)"""
+    page_path = Path(page_path)
+    report_dir = Path(report_dir) if report_dir is not None else page_path.parent
+    sections = _PageParser(page_path.read_text(errors='replace'),
+                           page_path.parent, report_dir).parse()
+    return PageStats(page_path.stem, sections)
+
+
+def analyze_report(report_dir: Union[str, os.PathLike],
+                   pages: Optional[Iterable[str]] = None) -> ReportAnalysis:
+    """Stats of all pages (*.html directly in report_dir) or the given page names"""
+    report_dir = Path(report_dir)
+    if pages is None:
+        page_paths = sorted(report_dir.glob('*.html'))
+    else:
+        page_paths = [report_dir / f'{x}.html' for x in pages]
+    return ReportAnalysis(str(report_dir), [analyze_page(x, report_dir) for x in page_paths])
+
+
+def check_budgets(analysis: ReportAnalysis, budgets: Dict[str, float]):
+    """Raise BudgetExceededError with all violations and the summary if budgets are exceeded"""
+    violations = analysis.budget_violations(budgets)
+    if violations:
+        raise BudgetExceededError(
+                f'{len(violations)} budget(s) exceeded:\n'
+                + '\n'.join(f'  {x}' for x in violations)
+                + '\n\n' + analysis.summary())
@@ -0,0 +1,100 @@
+"""Content-addressed asset store for staged figures
+
+Files are stored once per content hash below report_dir/assets, e.g.
+assets/3f/3f2a...c1.png, so that figures which are referenced from several
+sections or pages, or which are byte-identical (e.g. empty QC plots), are
+stored and synced only once.
+
+Download links for other formats are derived from the figure path by
+replacing the suffix (see EmbeddedFigure). Therefore a figure and its sibling
+formats (e.g. the pdf for a png) are stored as a group under the hash of all
+their contents.
+"""
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from pathlib import Path
+from typing import List, Sequence, Union
+
+ASSETS_DIR_NAME = 'assets'
+ASSET_REFERENCE_REGEX = re.compile(ASSETS_DIR_NAME + r'/[0-9a-f]{2}/([0-9a-f]{64})\.\w+')
+
+
+def _update_hash(hasher, path: Path):
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            hasher.update(block)
+
+
+class AssetStore:
+    """Store files by content hash in report_dir/assets
+
+    Args:
+        report_dir: root directory of the report
+    """
+
+    def __init__(self, report_dir: Union[str, Path]):
+        self.report_dir = Path(report_dir)
+        self.assets_dir = self.report_dir / ASSETS_DIR_NAME
+
+    def put(self, path: Union[str, Path],
+            sibling_suffixes: Sequence[str] = ('.pdf', '.svg')) -> str:
+        """Store file and its existing siblings, return path relative to report_dir
+
+        Args:
+            path: file to store
+            sibling_suffixes: files with the same path but these suffixes are
+                stored next to the hashed file, if they exist
+        """
+        path = Path(path)
+        siblings = [path.with_suffix(x) for x in sibling_suffixes
+                    if x != path.suffix and path.with_suffix(x).exists()]
+        hasher = hashlib.sha256()
+        for curr_path in [path] + siblings:
+            hasher.update(curr_path.suffix.encode())
+            _update_hash(hasher, curr_path)
+        digest = hasher.hexdigest()
+        target_dir = self.assets_dir / digest[:2]
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for curr_path in [path] + siblings:
+            target = target_dir / (digest + curr_path.suffix)
+            if not target.exists():
+                tmp_target = target.with_name(f'.{target.name}.{uuid.uuid4().hex}.tmp')
+                shutil.copy(curr_path, tmp_target)
+                os.replace(tmp_target, target)
+        return f'{ASSETS_DIR_NAME}/{digest[:2]}/{digest}{path.suffix}'
+
+    def referenced_hashes(self) -> set:
+        """Hashes referenced from any html or json file in the report directory
+
+        Hidden files and directories (build state and caches, which may list
+        outdated assets) are skipped.
+        """
+        hashes = set()
+        for fp in self.report_dir.rglob('*'):
+            if (fp.suffix in ('.html', '.json') and fp.is_file()
+                    and self.assets_dir not in fp.parents
+                    and not any(part.startswith('.')
+                                for part in fp.relative_to(self.report_dir).parts)):
+                hashes.update(ASSET_REFERENCE_REGEX.findall(fp.read_text(errors='ignore')))
+        return hashes
+
+    def gc(self, dry_run: bool = False) -> List[Path]:
+        """Remove assets which are not referenced by any report page
+
+        Returns:
+            removed (or, with dry_run, removable) asset paths
+        """
+        if not self.assets_dir.exists():
+            return []
+        referenced_hashes = self.referenced_hashes()
+        removed = []
+        for fp in sorted(self.assets_dir.glob('*/*')):
+            # precompressed siblings (.svg.gz) share the stem up to the first dot
+            if fp.name.split('.', 1)[0] not in referenced_hashes:
+                removed.append(fp)
+                if not dry_run:
+                    fp.unlink()
+        return removed
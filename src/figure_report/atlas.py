@@ -0,0 +1,236 @@
+"""Sprite-sheet atlases for grids of many small figures
+
+A grid figure ({'grid': [path, ...], 'tile_width': 128, 'tile_height': 128})
+shows many small rasters, e.g. one QC plot per sample. Instead of one request
+and one decode per image, the members are scaled into fixed-size cells of a
+few atlas images (at most ATLAS_MAX_SIZE px wide and high), and each member
+is displayed as a CSS-positioned tile of its atlas which links to the original.
+
+Atlases are built in worker processes and named by the hash of the cell size
+and the path, size and mtime of all members; an atlas is only rebuilt if one
+of its members changes. Atlases which are no longer referenced by any page
+are removed with gc_atlases (figure-report gc). Building requires the
+optional Pillow package (extra 'atlas'); without it, grid members are shown
+as individual images.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import re
+import uuid
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from figure_report.siblings import is_url
+
+GRID_STR = 'grid'
+ATLAS_DIR = 'atlases'
+DEFAULT_TILE_SIZE = 128
+ATLAS_MAX_SIZE = 2048
+ATLAS_REFERENCE_REGEX = re.compile(ATLAS_DIR + r'/([0-9a-f]{20})\.png')
+
+
+class AtlasJob(NamedTuple):
+    """One atlas image: members are placed row by row in cells of tile size"""
+    atlas_path: str  # relative to the output dir
+    member_paths: Tuple[str, ...]  # as given in the grid config
+    tile_width: int
+    tile_height: int
+    columns: int
+
+
+class AtlasTile(NamedTuple):
+    member_path: str
+    atlas_path: str
+    x: int
+    y: int
+
+
+def _member_stamp(full_path: str) -> Tuple[int, int]:
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        return -1, -1
+    return stat.st_size, stat.st_mtime_ns
+
+
+def atlases_available() -> bool:
+    """Whether atlases can be built, i.e. Pillow is installed"""
+    return Image is not None
+
+
+def build_atlas(job: AtlasJob, output_dir: Union[str, os.PathLike]) -> str:
+    """Write the atlas image of job, missing members leave their cell empty"""
+    if Image is None:
+        raise ImportError('Building image atlases requires Pillow')
+    rows = -(-len(job.member_paths) // job.columns)
+    columns = min(job.columns, len(job.member_paths))
+    atlas = Image.new('RGBA', (columns * job.tile_width, rows * job.tile_height))
+    for i, member_path in enumerate(job.member_paths):
+        try:
+            with Image.open(os.path.join(output_dir, member_path)) as tile:
+                tile.thumbnail((job.tile_width, job.tile_height), Image.LANCZOS)
+                tile = tile.convert('RGBA')
+        except OSError:
+            continue
+        row, column = divmod(i, job.columns)
+        # center the scaled image in its cell
+        atlas.paste(tile, (column * job.tile_width + (job.tile_width - tile.width) // 2,
+                           row * job.tile_height + (job.tile_height - tile.height) // 2))
+    atlas_fp = Path(output_dir) / job.atlas_path
+    atlas_fp.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fp = atlas_fp.with_name(f'.{atlas_fp.name}.{uuid.uuid4().hex}.tmp')
+    atlas.save(tmp_fp, format='PNG')
+    os.replace(tmp_fp, atlas_fp)
+    return job.atlas_path
+
+
+class AtlasResolver:
+    """Plan atlases for grid figures and build the missing ones
+
+    Args:
+        output_dir: report output directory; member paths are relative to it
+            (or absolute), atlases are written to output_dir/ATLAS_DIR
+        n_jobs: number of worker processes for building atlases
+    """
+
+    def __init__(self, output_dir: Union[str, os.PathLike], n_jobs: int = 1):
+        self.output_dir = str(output_dir)
+        self.n_jobs = n_jobs
+        # grid config json -> tiles
+        self._tiles: Dict[str, Tuple[AtlasTile, ...]] = {}
+
+    @staticmethod
+    def _config_key(grid_config: dict) -> str:
+        return json.dumps([grid_config[GRID_STR],
+                           grid_config.get('tile_width', DEFAULT_TILE_SIZE),
+                           grid_config.get('tile_height', DEFAULT_TILE_SIZE)])
+
+    def plan(self, grid_config: dict) -> List[AtlasJob]:
+        """Atlas jobs for the members of a grid figure"""
+        member_paths = tuple(grid_config[GRID_STR])
+        if any(is_url(x) for x in member_paths):
+            raise ValueError('Grid members must be local files')
+        tile_width = int(grid_config.get('tile_width', DEFAULT_TILE_SIZE))
+        tile_height = int(grid_config.get('tile_height', DEFAULT_TILE_SIZE))
+        columns = max(1, ATLAS_MAX_SIZE // tile_width)
+        tiles_per_atlas = columns * max(1, ATLAS_MAX_SIZE // tile_height)
+        jobs = []
+        for start in range(0, len(member_paths), tiles_per_atlas):
+            chunk = member_paths[start:start + tiles_per_atlas]
+            key = json.dumps([tile_width, tile_height, columns] + [
+                (x, *_member_stamp(os.path.join(self.output_dir, x))) for x in chunk])
+            atlas_name = hashlib.sha256(key.encode()).hexdigest()[:20] + '.png'
+            jobs.append(AtlasJob(f'{ATLAS_DIR}/{atlas_name}', chunk,
+                                 tile_width, tile_height, columns))
+        return jobs
+
+    def prefetch(self, grid_configs: Iterable[dict]) -> int:
+        """Plan all grids, build missing atlases in parallel, return number built"""
+        missing_jobs = {}
+        for grid_config in grid_configs:
+            config_key = self._config_key(grid_config)
+            if config_key in self._tiles:
+                continue
+            jobs = self.plan(grid_config)
+            self._tiles[config_key] = self._layout(jobs)
+            for job in jobs:
+                if not os.path.exists(os.path.join(self.output_dir, job.atlas_path)):
+                    missing_jobs[job.atlas_path] = job
+        jobs = list(missing_jobs.values())
+        if self.n_jobs > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+                list(executor.map(build_atlas, jobs, [self.output_dir] * len(jobs)))
+        else:
+            for job in jobs:
+                build_atlas(job, self.output_dir)
+        return len(jobs)
+
+    @staticmethod
+    def _layout(jobs: List[AtlasJob]) -> Tuple[AtlasTile, ...]:
+        tiles = []
+        for job in jobs:
+            for i, member_path in enumerate(job.member_paths):
+                row, column = divmod(i, job.columns)
+                tiles.append(AtlasTile(member_path, job.atlas_path,
+                                       column * job.tile_width, row * job.tile_height))
+        return tuple(tiles)
+
+    def get(self, grid_config: dict) -> Tuple[AtlasTile, ...]:
+        """Tiles of a grid figure, building its atlases if necessary"""
+        config_key = self._config_key(grid_config)
+        if config_key not in self._tiles:
+            self.prefetch([grid_config])
+        return self._tiles[config_key]
+
+
+def gc_atlases(report_dir: Union[str, os.PathLike], dry_run: bool = False) -> List[Path]:
+    """Remove atlases which are not referenced by any html page in report_dir
+
+    Atlases are replaced, not updated, when grid members change, see module
+    docstring.
+
+    Returns:
+        removed (or, with dry_run, removable) atlas paths
+    """
+    report_dir = Path(report_dir)
+    atlas_dir = report_dir / ATLAS_DIR
+    if not atlas_dir.exists():
+        return []
+    referenced = set()
+    for fp in report_dir.rglob('*.html'):
+        if fp.is_file():
+            referenced.update(ATLAS_REFERENCE_REGEX.findall(fp.read_text(errors='ignore')))
+    removed = []
+    for fp in sorted(atlas_dir.glob('*.png')):
+        if fp.stem not in referenced:
+            removed.append(fp)
+            if not dry_run:
+                fp.unlink()
+    return removed
+
+
+class AtlasGrid:
+    """HTML for a grid figure: one linked tile per member, cut out of its atlas
+
+    Args:
+        fig_id: id of the grid div, used to scope the tile styles
+        tiles: from AtlasResolver.get
+    """
+
+    def __init__(self, fig_id: str, tiles: Iterable[AtlasTile],
+                 tile_width: int = DEFAULT_TILE_SIZE, tile_height: int = DEFAULT_TILE_SIZE,
+                 title: Optional[str] = None, description: Optional[str] = None):
+        self.fig_id = fig_id
+        self.tiles = list(tiles)
+        self.tile_width = int(tile_width)
+        self.tile_height = int(tile_height)
+        self.title = title
+        self.description = description
+
+    def get_html(self) -> str:
+        title_line = f'<strong>{self.title}</strong><br>' if self.title else ''
+        description_line = f'<p>{self.description}</p>' if self.description else ''
+        atlas_classes = {atlas_path: f'a{i}' for i, atlas_path
+                         in enumerate(dict.fromkeys(x.atlas_path for x in self.tiles))}
+        # one rule per atlas instead of repeating its url for every tile
+        style_rules = [f'#{self.fig_id} a{{width:{self.tile_width}px;'
+                       f'height:{self.tile_height}px}}']
+        style_rules += [f'#{self.fig_id} .{css_class}{{background-image:url("{atlas_path}")}}'
+                        for atlas_path, css_class in atlas_classes.items()]
+        tile_lines = [f'<a href="{x.member_path}" title="{x.member_path}" '
+                      f'class="{atlas_classes[x.atlas_path]}" '
+                      f'style="background-position:-{x.x}px -{x.y}px"></a>'
+                      for x in self.tiles]
+        return '\n'.join([title_line,
+                          f'<style>{"".join(style_rules)}</style>',
+                          f'<div id="{self.fig_id}" class="atlas-grid">',
+                          *tile_lines,
+                          '</div>',
+                          description_line])
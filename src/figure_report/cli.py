@@ -0,0 +1,300 @@
+"""Command line interface
+
+figure-report build CONFIG [-j N] [--incremental] [--dry-run] [--shard]
+                           [--stale-after SECONDS] [--preview N]
+figure-report gc REPORT_DIR [--dry-run]
+figure-report analyze REPORT_DIR [--budget KEY=LIMIT] [-n N]
+
+The build config (YAML or JSON) describes the whole pattern -> metadata
+table -> report config -> html pipeline:
+
+    output_dir: /path/to/report
+    patterns:                     # list or dict, see pattern_set_to_metadata_table
+      qc: /data/{sample}/qc/{plot}.png
+      results: /data/{sample}/results/{plot}.png
+    names: [pattern_name]         # optional
+    wildcard_constraints: {}      # optional
+    root_dir: /data               # optional: copy figures to output_dir
+    deduplicate: false            # optional: copy to content-addressed asset store
+    precompress: false            # optional
+    optimize_images: false        # optional
+    download_formats: [png, pdf, svg]  # optional: linked if they exist
+    service_worker: false         # optional: cache assets in the browser
+    budgets:                      # optional: fail the build if exceeded,
+      page_asset_bytes: 200.0e+6  # see figure_report.analyze.BUDGET_KEYS
+    pages:
+      QC:
+        query: {pattern_name: qc} # optional: field -> value or list of values
+        section_cols: [sample, plot]
+        facet_cols: [condition]   # optional: client-side filter by these fields
+        toc_headings: h1, h2      # optional
+        autocollapse_depth: 2     # optional
+
+build --preview N writes preview pages with at most N figures per section to
+'<output_dir>_preview' within seconds, to check the section structure.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from figure_report.analyze import (BUDGET_KEYS, BudgetExceededError, analyze_report,
+                                   validate_budgets)
+from figure_report.assets import AssetStore
+from figure_report.atlas import gc_atlases
+from figure_report.patterns import (pattern_set_to_metadata_table, get_paths,
+                                    copy_report_files_to_report_dir,
+                                    convert_metadata_table_to_report_json)
+from figure_report.preview import PREVIEW_DIR_SUFFIX
+from figure_report.report import Report, BUILD_STATE_NAME, page_config_hash
+from figure_report.shard import DEFAULT_STALE_AFTER, run_once, sharded_generate
+from figure_report.siblings import DEFAULT_DOWNLOAD_FORMATS
+
+
+def load_config(config_path: str) -> dict:
+    text = Path(config_path).read_text()
+    if config_path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('Reading YAML configs requires the pyyaml package')
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def select_rows(metadata_table: pd.DataFrame, query: Optional[Dict]) -> pd.DataFrame:
+    """Select rows where each field equals the value or is in the list of values"""
+    if not query:
+        return metadata_table
+    mask = pd.Series(True, index=metadata_table.index)
+    for field, value in query.items():
+        values = value if isinstance(value, list) else [value]
+        mask &= metadata_table[field].isin(values)
+    return metadata_table.loc[mask]
+
+
+def build_report_config(metadata_table: pd.DataFrame, pages_config: Dict,
+                        max_figures_per_section: Optional[int] = None) -> Dict:
+    report_config = {}
+    for page_name, page_spec in pages_config.items():
+        page_table = select_rows(metadata_table, page_spec.get('query'))
+        report_config[page_name] = {
+            **convert_metadata_table_to_report_json(
+                    page_table, page_spec['section_cols'],
+                    facet_cols=page_spec.get('facet_cols'),
+                    max_figures_per_section=max_figures_per_section),
+            'toc_headings': page_spec.get('toc_headings', 'h1, h2, h3'),
+            'autocollapse_depth': page_spec.get('autocollapse_depth', 2),
+        }
+    return report_config
+
+
+class Timer:
+    """Collect wall times of named build stages"""
+    def __init__(self):
+        self.timings: List = []
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.timings.append((name, time.perf_counter() - start))
+
+    def summary(self) -> str:
+        lines = [f'{name:<12} {seconds:8.2f} s' for name, seconds in self.timings]
+        lines.append(f'{"total":<12} {sum(x[1] for x in self.timings):8.2f} s')
+        return '\n'.join(lines)
+
+
+def build(config: dict, n_jobs: int = 1, incremental: bool = False,
+          dry_run: bool = False, shard: bool = False,
+          preview: Optional[int] = None,
+          stale_after: Optional[float] = DEFAULT_STALE_AFTER) -> List[str]:
+    """Run the build described by config, return the names of the (re)built pages
+
+    With shard, this is one of several workers sharing the output directory,
+    see figure_report.shard. Steps locked by a worker that did not renew its
+    lock for stale_after seconds (e.g. because it was killed) are taken over.
+
+    With preview (max. figures per section), preview pages are written to
+    '<output_dir>_preview', linking the original files instead of staging
+    them, see figure_report.preview. The build state is not updated.
+    """
+    timer = Timer()
+    output_dir = Path(config['output_dir'])
+    if preview is not None:
+        output_dir = output_dir.with_name(output_dir.name + PREVIEW_DIR_SUFFIX)
+
+    with timer.stage('discovery'):
+        metadata_table = pattern_set_to_metadata_table(
+                config['patterns'], names=config.get('names'),
+                wildcard_constraints=config.get('wildcard_constraints'))
+    print(f'Found {len(metadata_table)} files')
+
+    if config.get('root_dir') and not dry_run and preview is None:
+        def stage():
+            summary = copy_report_files_to_report_dir(
+                    metadata_table, config['root_dir'], str(output_dir),
+                    optimize_images=config.get('optimize_images', False),
+                    deduplicate=config.get('deduplicate', False),
+                    skip_unchanged=incremental)
+            return {'rel_report_dir_path': metadata_table['rel_report_dir_path'].tolist(),
+                    'summary': str(summary) if summary is not None else None}
+
+        with timer.stage('staging'):
+            if shard:
+                # staged files are shared, only one of the workers stages them;
+                # changed files (size, mtime) are staged again in the next build
+                paths = get_paths(metadata_table).tolist()
+                step_id = 'staging-' + page_config_hash(
+                        {'config': config, 'paths': paths,
+                         'stats': [(x.st_size, x.st_mtime_ns) for x in map(os.stat, paths)]}
+                )[:16]
+                result = run_once(stage, output_dir, step_id, stale_after=stale_after)
+                metadata_table['rel_report_dir_path'] = result['rel_report_dir_path']
+            else:
+                result = stage()
+        if result['summary'] is not None:
+            print(result['summary'])
+
+    with timer.stage('conversion'):
+        report_config = build_report_config(metadata_table, config['pages'],
+                                            max_figures_per_section=preview)
+        page_hashes = {page_name: page_config_hash(page_config)
+                       for page_name, page_config in report_config.items()}
+
+    download_formats = config.get('download_formats', DEFAULT_DOWNLOAD_FORMATS)
+    state_fp = output_dir / BUILD_STATE_NAME
+    pages = list(report_config)
+    if incremental and state_fp.exists():
+        old_page_hashes = json.loads(state_fp.read_text())
+        pages = [page_name for page_name in pages
+                 if old_page_hashes.get(page_name) != page_hashes[page_name]
+                 or not output_dir.joinpath(page_name + '.html').exists()]
+
+    if dry_run:
+        for page_name in pages:
+            n_figures = len(select_rows(metadata_table,
+                                        config['pages'][page_name].get('query')))
+            print(f'would build {page_name} ({n_figures} figures)')
+    elif preview is not None:
+        with timer.stage('generation'):
+            Report(report_config).generate(output_dir, pages=pages, n_jobs=n_jobs,
+                                           preview=preview)
+        print(f'Built {len(pages)} preview pages in {output_dir}')
+    elif shard:
+        with timer.stage('generation'):
+            pages = sharded_generate(report_config, output_dir,
+                                     precompress=config.get('precompress', False),
+                                     download_formats=download_formats,
+                                     service_worker=config.get('service_worker', False),
+                                     budgets=config.get('budgets'),
+                                     stale_after=stale_after)
+        print(f'Built {len(pages)} of {len(report_config)} pages in this shard')
+    else:
+        with timer.stage('generation'):
+            Report(report_config).generate(output_dir, pages=pages,
+                                           precompress=config.get('precompress', False),
+                                           n_jobs=n_jobs, download_formats=download_formats,
+                                           service_worker=config.get('service_worker', False),
+                                           budgets=config.get('budgets'))
+            state_fp.write_text(json.dumps(page_hashes))
+        print(f'Built {len(pages)} of {len(report_config)} pages')
+
+    print(timer.summary())
+    return pages
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='figure-report')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='build report from a config file')
+    build_parser.add_argument('config', help='YAML or JSON build config')
+    build_parser.add_argument('-j', '--jobs', type=int, default=1,
+                              help='number of processes for page generation')
+    build_parser.add_argument('--incremental', action='store_true',
+                              help='only rebuild pages whose config changed and only '
+                                   'stage figures whose size or mtime changed')
+    build_parser.add_argument('--dry-run', action='store_true',
+                              help='show which pages would be built, write nothing')
+    build_parser.add_argument('--shard', action='store_true',
+                              help='run as one of several workers sharing the output directory')
+    build_parser.add_argument('--preview', type=int, metavar='N',
+                              help='quick preview with at most N figures per section, '
+                                   'written next to the output directory')
+    build_parser.add_argument('--stale-after', type=float, default=DEFAULT_STALE_AFTER,
+                              metavar='SECONDS',
+                              help='with --shard, take over the work of workers which '
+                                   'did not report progress for this long '
+                                   f'(default: {DEFAULT_STALE_AFTER:g})')
+    gc_parser = subparsers.add_parser(
+            'gc', help='remove assets and atlases no report page references any more')
+    gc_parser.add_argument('report_dir')
+    gc_parser.add_argument('--dry-run', action='store_true',
+                           help='only list the assets which would be removed')
+    analyze_parser = subparsers.add_parser(
+            'analyze', help='show html and asset sizes per page and section')
+    analyze_parser.add_argument('report_dir')
+    analyze_parser.add_argument('--budget', action='append', default=[], metavar='KEY=LIMIT',
+                                help='fail if exceeded, keys: ' + ', '.join(BUDGET_KEYS))
+    analyze_parser.add_argument('-n', type=int, default=10, help='number of largest assets')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if args.shard and args.incremental:
+            parser.error('--shard and --incremental can not be combined')
+        if args.shard and args.jobs != 1:
+            parser.error('--shard and -j can not be combined, start more workers instead')
+        if args.preview is not None and (args.shard or args.incremental):
+            parser.error('--preview can not be combined with --shard or --incremental')
+        if args.stale_after <= 0:
+            parser.error('--stale-after must be positive')
+        if args.preview is not None and args.preview < 1:
+            parser.error('--preview expects at least 1 figure per section')
+        config = load_config(args.config)
+        try:
+            validate_budgets(config.get('budgets') or {})
+        except ValueError as e:
+            parser.error(f'{args.config}: {e}')
+        try:
+            build(config, n_jobs=args.jobs,
+                  incremental=args.incremental, dry_run=args.dry_run, shard=args.shard,
+                  preview=args.preview, stale_after=args.stale_after)
+        except BudgetExceededError as e:
+            print(e, file=sys.stderr)
+            return 1
+    elif args.command == 'gc':
+        removed = (AssetStore(args.report_dir).gc(dry_run=args.dry_run)
+                   + gc_atlases(args.report_dir, dry_run=args.dry_run))
+        for fp in removed:
+            print(fp)
+        print(f'{"Would remove" if args.dry_run else "Removed"} {len(removed)} assets')
+    elif args.command == 'analyze':
+        budgets = {}
+        for budget in args.budget:
+            key, unused_sep, limit = budget.partition('=')
+            try:
+                budgets[key] = float(limit)
+            except ValueError:
+                parser.error(f'--budget expects KEY=LIMIT with a numeric LIMIT, got {budget}')
+        try:
+            validate_budgets(budgets)
+        except ValueError as e:
+            parser.error(str(e))
+        analysis = analyze_report(args.report_dir)
+        print(analysis.summary(n_largest=args.n))
+        violations = analysis.budget_violations(budgets)
+        if violations:
+            print(f'\n{len(violations)} budget(s) exceeded:')
+            print('\n'.join(f'  {x}' for x in violations))
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
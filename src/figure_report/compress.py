@@ -0,0 +1,74 @@
+"""Write precompressed siblings of text assets for static serving
+
+For each text asset (html, css, js, json, svg), a .gz sibling and, if the
+optional brotli package is installed, a .br sibling is written, as expected by
+nginx gzip_static/brotli_static. Compression runs in a thread pool (zlib and
+brotli release the GIL) and files whose compressed siblings are newer than the
+source are skipped.
+"""
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Union
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEXT_ASSET_SUFFIXES = ('.html', '.css', '.js', '.json', '.svg')
+
+
+def _compressors():
+    compressors = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append(('.br', lambda data: brotli.compress(data)))
+    return compressors
+
+
+def _is_up_to_date(source: Path, target: Path) -> bool:
+    return target.exists() and target.stat().st_mtime >= source.stat().st_mtime
+
+
+def _compress_file(path: Path) -> List[Path]:
+    written = []
+    data = None
+    for suffix, compress in _compressors():
+        target = path.with_name(path.name + suffix)
+        if _is_up_to_date(path, target):
+            continue
+        if data is None:
+            data = path.read_bytes()
+        # write to temporary file first, so that a server never sees partial files
+        tmp_target = target.with_name(target.name + '.tmp')
+        tmp_target.write_bytes(compress(data))
+        os.replace(tmp_target, target)
+        written.append(target)
+    return written
+
+
+def precompress_files(paths: Iterable[Union[str, Path]],
+                      n_jobs: Optional[int] = None) -> List[Path]:
+    """Write compressed siblings for the given files, skip up-to-date files
+
+    Returns:
+        paths of the compressed files which were (re)written
+    """
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        results = executor.map(_compress_file, [Path(x) for x in paths])
+        return [target for written in results for target in written]
+
+
+def precompress_dir(output_dir: Union[str, Path],
+                    suffixes: Sequence[str] = TEXT_ASSET_SUFFIXES,
+                    n_jobs: Optional[int] = None) -> List[Path]:
+    """Precompress all text assets below output_dir, see precompress_files
+
+    Files in hidden directories (e.g. caches) are skipped.
+    """
+    output_dir = Path(output_dir)
+    paths = [x for x in output_dir.rglob('*')
+             if x.suffix in suffixes and x.is_file()
+             and not any(part.startswith('.') for part in x.relative_to(output_dir).parts)]
+    return precompress_files(paths, n_jobs=n_jobs)
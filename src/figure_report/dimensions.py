@@ -0,0 +1,188 @@
+"""Intrinsic image sizes read from file headers
+
+Without width and height (or an aspect ratio) on each img tag, the browser
+re-flows the page whenever an image arrives, and cannot reserve space for
+images which are not loaded yet. read_image_size reads only the header of
+PNG, JPEG and SVG files: the IHDR chunk of PNGs, the markers up to the first
+SOF segment of JPEGs and the root element of SVGs (converted to CSS px).
+
+ImageSizeResolver reads the headers of many figures in a thread pool and
+caches the results by (path, file size, mtime), optionally in a JSON file,
+so that unchanged figures are not read again in later builds.
+"""
+import json
+import os
+import re
+import struct
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, NamedTuple, Optional, Union
+
+from figure_report.siblings import is_url
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# start of frame markers, which hold the image size; C4, C8 and CC are not SOF
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+                    0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+# markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xd0, 0xda)}
+# number of bytes searched for the root element of SVGs
+SVG_HEADER_SIZE = 64 * 1024
+# CSS px per unit
+SVG_UNITS = {'': 1, 'px': 1, 'pt': 4 / 3, 'pc': 16, 'in': 96,
+             'cm': 96 / 2.54, 'mm': 96 / 25.4}
+IMAGE_SIZE_CACHE_NAME = '.figure_report_image_sizes.json'
+
+
+class ImageSize(NamedTuple):
+    width: float
+    height: float
+
+
+def _read_png_size(fin: BinaryIO) -> Optional[ImageSize]:
+    header = fin.read(24)
+    if not header.startswith(PNG_SIGNATURE) or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return ImageSize(width, height)
+
+
+def _read_jpeg_size(fin: BinaryIO) -> Optional[ImageSize]:
+    if fin.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        byte = fin.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = fin.read(1)
+        # fill bytes
+        while marker == b'\xff':
+            marker = fin.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        segment_length, = struct.unpack('>H', fin.read(2))
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', fin.read(5))
+            return ImageSize(width, height)
+        fin.seek(segment_length - 2, os.SEEK_CUR)
+
+
+def _parse_svg_length(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    m = re.fullmatch(r'\s*([0-9.eE+-]+)\s*([a-z]*)\s*', value)
+    if m is None or m.group(2) not in SVG_UNITS:
+        return None
+    try:
+        return float(m.group(1)) * SVG_UNITS[m.group(2)]
+    except ValueError:
+        return None
+
+
+def _read_svg_size(fin: BinaryIO) -> Optional[ImageSize]:
+    header = fin.read(SVG_HEADER_SIZE).decode('utf-8', errors='replace')
+    m = re.search(r'<svg\b([^>]*)>', header)
+    if m is None:
+        return None
+    attributes = dict(re.findall(r'([\w:-]+)\s*=\s*["\']([^"\']*)["\']', m.group(1)))
+    width = _parse_svg_length(attributes.get('width'))
+    height = _parse_svg_length(attributes.get('height'))
+    view_box = attributes.get('viewBox', '').replace(',', ' ').split()
+    if len(view_box) == 4:
+        try:
+            box_width, box_height = float(view_box[2]), float(view_box[3])
+        except ValueError:
+            box_width = box_height = 0
+        if box_width > 0 and box_height > 0:
+            if width is None and height is None:
+                width, height = box_width, box_height
+            elif height is None:
+                height = width * box_height / box_width
+            elif width is None:
+                width = height * box_width / box_height
+    if not width or not height:
+        return None
+    return ImageSize(width, height)
+
+
+def read_image_size(path: Union[str, os.PathLike]) -> Optional[ImageSize]:
+    """Width and height (CSS px for SVGs) from the file header, None if unknown"""
+    readers = {'.png': _read_png_size, '.jpeg': _read_jpeg_size,
+               '.jpg': _read_jpeg_size, '.svg': _read_svg_size}
+    reader = readers.get(Path(path).suffix.lower())
+    if reader is None:
+        return None
+    try:
+        with open(path, 'rb') as fin:
+            return reader(fin)
+    except (OSError, struct.error):
+        return None
+
+
+class ImageSizeResolver:
+    """Intrinsic sizes of many figures, cached by (path, size, mtime)
+
+    Args:
+        base_dir: relative paths are interpreted relative to this directory,
+            e.g. the report output directory
+        cache_path: JSON file to load the cache from and save it to, optional
+        n_jobs: number of threads for prefetch
+    """
+
+    def __init__(self, base_dir: Optional[Union[str, os.PathLike]] = None,
+                 cache_path: Optional[Union[str, os.PathLike]] = None,
+                 n_jobs: int = 8):
+        self.base_dir = str(base_dir) if base_dir is not None else None
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self.n_jobs = n_jobs
+        # full path -> [file size, mtime_ns, width, height]
+        self._cache: Dict[str, list] = {}
+        if self.cache_path is not None and self.cache_path.exists():
+            try:
+                self._cache = json.loads(self.cache_path.read_text())
+            except ValueError:
+                pass
+
+    def _full_path(self, path: str) -> Optional[str]:
+        if is_url(path):
+            return None
+        if self.base_dir is not None and not os.path.isabs(path):
+            return os.path.join(self.base_dir, path)
+        return path
+
+    def _lookup(self, full_path: str) -> Optional[ImageSize]:
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        entry = self._cache.get(full_path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            size = read_image_size(full_path)
+            entry = [stat.st_size, stat.st_mtime_ns, *(size or (None, None))]
+            self._cache[full_path] = entry
+        return ImageSize(*entry[2:]) if entry[2] is not None else None
+
+    def prefetch(self, paths: Iterable[str]):
+        """Read the headers of all paths in parallel"""
+        full_paths = {self._full_path(x) for x in paths} - {None}
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            list(executor.map(self._lookup, full_paths))
+
+    def get(self, path: str) -> Optional[ImageSize]:
+        """Intrinsic size of path, None for URLs, missing and unknown files"""
+        full_path = self._full_path(path)
+        return self._lookup(full_path) if full_path is not None else None
+
+    def save(self):
+        """Write the cache to cache_path, if given"""
+        if self.cache_path is None:
+            return
+        tmp_path = self.cache_path.with_name(f'.{self.cache_path.name}.{uuid.uuid4().hex}.tmp')
+        tmp_path.write_text(json.dumps(self._cache))
+        os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,125 @@
+// Client-side facet filter, the index is built by figure_report/facets.py
+(function () {
+    // the script is included before the figures, wait until they are parsed
+    function init() {
+        var indexElem = document.getElementById('facet-index');
+        if (!indexElem) {
+            return;
+        }
+        var index = JSON.parse(indexElem.textContent);
+        var nBytes = (index.n_figures + 7) >> 3;
+        // figure i is the element with data-fig="i", in document order
+        var figures = document.querySelectorAll('.main [data-fig]');
+
+        function decode(b64) {
+            var s = atob(b64);
+            var bytes = new Uint8Array(s.length);
+            for (var i = 0; i < s.length; i++) {
+                bytes[i] = s.charCodeAt(i);
+            }
+            return bytes;
+        }
+
+        var facets = index.facets.map(function (facet) {
+            var bitsets = facet.bitsets.map(decode);
+            // figures without a value for this facet are never filtered by it
+            var missing = new Uint8Array(nBytes).fill(255);
+            bitsets.forEach(function (bitset) {
+                for (var i = 0; i < nBytes; i++) {
+                    missing[i] &= ~bitset[i];
+                }
+            });
+            return {
+                name: facet.name, values: facet.values, counts: facet.counts,
+                bitsets: bitsets, missing: missing,
+                selected: facet.values.map(function () { return true; })
+            };
+        });
+
+        var visible = new Uint8Array(nBytes).fill(255);
+        var updateScheduled = false;
+
+        function update() {
+            updateScheduled = false;
+            var mask = new Uint8Array(nBytes).fill(255);
+            facets.forEach(function (facet) {
+                var facetMask = facet.missing.slice();
+                facet.bitsets.forEach(function (bitset, code) {
+                    if (facet.selected[code]) {
+                        for (var i = 0; i < nBytes; i++) {
+                            facetMask[i] |= bitset[i];
+                        }
+                    }
+                });
+                for (var i = 0; i < nBytes; i++) {
+                    mask[i] &= facetMask[i];
+                }
+            });
+            for (var i = 0; i < nBytes; i++) {
+                var changed = mask[i] ^ visible[i];
+                // most bytes are unchanged, skip their 8 figures at once
+                if (!changed) {
+                    continue;
+                }
+                for (var bit = 0; bit < 8; bit++) {
+                    var fig = figures[(i << 3) + bit];
+                    if (fig && (changed >> bit) & 1) {
+                        fig.hidden = !((mask[i] >> bit) & 1);
+                    }
+                }
+            }
+            visible = mask;
+        }
+
+        function scheduleUpdate() {
+            if (!updateScheduled) {
+                updateScheduled = true;
+                window.requestAnimationFrame(update);
+            }
+        }
+
+        var container = document.getElementById('facet-filter');
+        facets.forEach(function (facet) {
+            var fieldset = document.createElement('fieldset');
+            var legend = document.createElement('legend');
+            legend.textContent = facet.name + ' ';
+            var checkboxes = [];
+            [['all', true], ['none', false]].forEach(function (item) {
+                var button = document.createElement('button');
+                button.type = 'button';
+                button.textContent = item[0];
+                button.onclick = function () {
+                    checkboxes.forEach(function (checkbox, code) {
+                        checkbox.checked = item[1];
+                        facet.selected[code] = item[1];
+                    });
+                    scheduleUpdate();
+                };
+                legend.appendChild(button);
+            });
+            fieldset.appendChild(legend);
+            facet.values.forEach(function (value, code) {
+                var label = document.createElement('label');
+                var checkbox = document.createElement('input');
+                checkbox.type = 'checkbox';
+                checkbox.checked = true;
+                checkbox.onchange = function () {
+                    facet.selected[code] = checkbox.checked;
+                    scheduleUpdate();
+                };
+                checkboxes.push(checkbox);
+                label.appendChild(checkbox);
+                label.appendChild(document.createTextNode(
+                    value + ' (' + facet.counts[code] + ')'));
+                fieldset.appendChild(label);
+            });
+            container.appendChild(fieldset);
+        });
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();
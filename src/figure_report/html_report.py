@@ -1,6 +1,10 @@
 # TODO: avoid import of rpy2 if not necessary
 # TODO: remove hard-coding to currywurst links
+import copy
+import json
 import shutil
+import threading
+import uuid
 from pathlib import Path
 from typing import Union
 import textwrap
@@ -20,11 +24,17 @@ import matplotlib as mpl
 import seaborn as sns
 import plotnine as pn
 import matplotlib.pyplot as plt
-from IPython.display import Markdown, HTML
+from IPython.display import Markdown, HTML, Javascript
 
 
 import mouse_hema_meth.paths as mhpaths
 
+from figure_report.analyze import ReportAnalysis, analyze_page, check_budgets
+from figure_report.compress import precompress_files, precompress_dir
+from figure_report.offline import REGISTER_SERVICE_WORKER_HTML, install_service_worker
+from figure_report.optimize import optimize_report_images
+from figure_report.siblings import SiblingResolver
+
 
 def pdf(s):
     return s.replace(".png", ".pdf")
@@ -34,7 +44,14 @@ def svg(s):
     return s.replace(".png", ".svg")
 
 
+def with_format(s, fmt):
+    return s.replace(".png", f".{fmt}")
+
+
 class HtmlReport:
+    # seconds between automatic snapshots of the live display while elements
+    # are added, None: only snapshot on save() and snapshot(), see live_display
+    live_snapshot_interval = None
     template = """
 <!DOCTYPE html>
 <html>
@@ -139,6 +156,7 @@ class HtmlReport:
         // onClick: false
     }});
 </script>
+{service_worker_html}
 </body>
 </html>
 """
@@ -150,6 +168,7 @@ class HtmlReport:
         toc_headings="h1, h2, h3, h4",
         autocollapse_depth=2,
         link_fn=mhpaths.get_currywurst_link,
+        download_formats=("png", "pdf", "svg"),
     ):
         """Iteratively build a html document and save or display
 
@@ -174,8 +193,23 @@ class HtmlReport:
             default: currywurst link; alternatively any function taking a png_path
             as single argument; or None. If None, relative links (to the report path)
             are used
+        download_formats
+            candidate formats for the download links of images added with image();
+            only formats which exist next to the image are linked, with one cached
+            directory listing per image directory (see SiblingResolver)
         """
+        # html strings, or slots (see reserve)
         self.lines = []
+        # set by live_display: (container div id, update DisplayHandle, n lines sent)
+        self._live_display = None
+        # set by live_display: (container DisplayHandle, time of last snapshot)
+        self._live_snapshot = None
+        # slots are copies of the report, this is the report they belong to
+        self._root = self
+        # guards lines and the live display; shared with slots
+        self._lock = threading.RLock()
+        self._slot_counter = incremental_counter()
+        self.sibling_resolver = SiblingResolver(download_formats)
         self.toc_headings = toc_headings
         self.autocollapse_depth = autocollapse_depth
         self.counter = incremental_counter()
@@ -203,22 +237,22 @@ class HtmlReport:
         Path(files_dir).mkdir(exist_ok=True, parents=True)
 
     def h1(self, s: str):
-        self.lines.append(f"<h1 id={self.heading_counter()}>{s}</h1>\n")
+        self._append(f"<h1 id={self.heading_counter()}>{s}</h1>\n")
 
     def h2(self, s: str):
-        self.lines.append(f"<h2 id={self.heading_counter()}>{s}</h2>\n")
+        self._append(f"<h2 id={self.heading_counter()}>{s}</h2>\n")
 
     def h3(self, s: str):
-        self.lines.append(f"<h3 id={self.heading_counter()}>{s}</h3>\n")
+        self._append(f"<h3 id={self.heading_counter()}>{s}</h3>\n")
 
     def h4(self, s: str):
-        self.lines.append(f"<h4>{s}</h4>\n")
+        self._append(f"<h4>{s}</h4>\n")
 
     def h5(self, s: str):
-        self.lines.append(f"<h5>{s}</h5>\n")
+        self._append(f"<h5>{s}</h5>\n")
 
     def h6(self, s: str):
-        self.lines.append(f"<h6>{s}</h6>\n")
+        self._append(f"<h6>{s}</h6>\n")
 
     def table(self, df: pd.DataFrame):
         """Add HTML representation of dataframe"""
@@ -232,9 +266,9 @@ class HtmlReport:
         #      - see also: https://github.com/jupyter/help/issues/283
 
         # add whitespace before and after table
-        self.lines.append("<br><br>")
-        self.lines.append(df.to_html())
-        self.lines.append("<br><br>")
+        self._append("<br><br>")
+        self._append(df.to_html())
+        self._append("<br><br>")
 
     def figure(self, fig, do_display=False, **kwargs):
         """Add <img> with download links for png, pdf and svg
@@ -257,7 +291,7 @@ class HtmlReport:
         else:
             png_path = self.png_base_path
             counter = self.counter
-        self.lines.append(
+        self._append(
             save_and_display(
                 fig,
                 png_path=png_path,
@@ -270,51 +304,264 @@ class HtmlReport:
         )
 
     def image(self, png_path: str, link_fn, **kwargs):
-        self.lines.append(
+        """Add existing image, with download links for its existing sibling formats"""
+        if "sibling_resolver" not in kwargs:
+            # images are often saved one after another into the same directory,
+            # a listing cached for an earlier image misses newer images and
+            # their siblings; check only these instead of re-listing
+            if not self.sibling_resolver.exists(str(png_path)):
+                self.sibling_resolver.refresh(str(png_path))
+            kwargs["sibling_resolver"] = self.sibling_resolver
+        self._append(
             display_file_html(
                 png_path=png_path, do_display=False, link_fn=link_fn, **kwargs
             )
         )
 
     def text(self, s):
-        self.lines.append("<br>" + s + "<br>")
+        self._append("<br>" + s + "<br>")
 
     @property
     def html_code(self):
+        return self.get_html_code()
+
+    def get_html_code(self, service_worker=False):
+        """Html document, optionally registering the service worker, see save"""
         # note that the \n-join is just to get a visually pleasing html source document
         # when you add new elements, remember to add <div> or <br> where necessary
-        html_body = "\n".join(self.lines)
+        html_body = self._body_html()
         return self.template.format(
             html_body=html_body,
             toc_headings=self.toc_headings,
             autocollapse_depth=self.autocollapse_depth,
+            service_worker_html=REGISTER_SERVICE_WORKER_HTML if service_worker else "",
         )
 
-    def save(self):
-        """Save to file, overwrite existing file"""
+    def save(
+        self, precompress=False, optimize_images=False, service_worker=False, budgets=None
+    ):
+        """Save to file, overwrite existing file
+
+        Parameters
+        ----------
+        precompress
+            write .gz (and .br, if brotli is installed) siblings for the report,
+            the css/js files and the text assets in files_dir,
+            see figure_report.compress
+        optimize_images
+            losslessly recompress PNGs and minify SVGs in files_dir before saving,
+            see figure_report.optimize
+        service_worker
+            register a service worker which caches the report, the css/js files
+            and the files in files_dir in the browser, so that repeat visits only
+            fetch changed files, see figure_report.offline. The manifest is shared
+            with other reports saved to the same directory.
+        budgets
+            size and cost limits for the saved report, e.g. {"page_asset_bytes": 200e6},
+            see figure_report.analyze
+
+        Returns
+        -------
+        ImageOptimizationSummary if optimize_images, else None
+
+        Raises
+        ------
+        BudgetExceededError
+            if the saved report exceeds the budgets
+        """
+        self.snapshot()
+        summary = None
+        if optimize_images:
+            summary = optimize_report_images(self.files_dir)
 
+        output_dir = Path(self.report_path).parent
         for curr_file in ["tocbot.css", "viewer.css", "tocbot.min.js"]:
             curr_file_fp = Path(__file__).parent.joinpath(curr_file)
-            output_dir = Path(self.report_path).parent
             target_file_path = output_dir / curr_file
             if not target_file_path.exists():
                 shutil.copy(curr_file_fp, target_file_path)
-        Path(self.report_path).write_text(self.html_code)
+        Path(self.report_path).write_text(self.get_html_code(service_worker))
+        if service_worker:
+            files_dir = Path(self.files_dir)
+            cached_files = [Path(self.report_path)] + [
+                output_dir / x for x in ["tocbot.css", "viewer.css", "tocbot.min.js"]
+            ]
+            # only files within the scope of the service worker can be cached
+            if files_dir.resolve().is_relative_to(output_dir.resolve()):
+                cached_files += list(files_dir.rglob("*"))
+            install_service_worker(output_dir, cached_files)
+        if precompress:
+            precompress_files(
+                [self.report_path]
+                + [output_dir / x for x in ["tocbot.css", "viewer.css", "tocbot.min.js"]]
+            )
+            precompress_dir(self.files_dir)
+        if budgets is not None:
+            page_stats = analyze_page(self.report_path)
+            check_budgets(ReportAnalysis(str(output_dir), [page_stats]), budgets)
+        return summary
 
     def display(self):
         """Display with IPython.display"""
         display(HTML(self.html_code))
 
+    def live_display(self):
+        """Display the report body and keep it updated as elements are added
+
+        Displays the elements added so far in a container div, then sends only
+        each newly added element through a single display handle, which appends
+        it to the container. In contrast to calling display() repeatedly, the
+        frontend never re-renders the full report and the full html is never
+        re-serialized.
+
+        The update handle uses a Javascript output, which requires a trusted
+        notebook.
+
+        Javascript updates are not stored in the notebook: a saved notebook
+        contains the container as of the last snapshot, see snapshot. Snapshots
+        are taken on save() and when calling snapshot(); set
+        live_snapshot_interval to also take them periodically while elements
+        are added (each snapshot re-renders the full report).
+        """
+        container_id = f"figure-report-{uuid.uuid4().hex}"
+        with self._lock:
+            # slots reserved earlier get placeholder divs, their later additions are sent
+            slots = self._all_slots()
+            for slot in slots:
+                slot._live_display = (
+                    f"{container_id}-slot{self._slot_counter()}", None, len(slot.lines)
+                )
+            container_handle = display(
+                HTML(self._live_container_html(container_id)), display_id=True
+            )
+            handle = display(Javascript(""), display_id=True)
+            for slot in slots:
+                slot_div_id, unused_handle, n_sent = slot._live_display
+                slot._live_display = (slot_div_id, handle, n_sent)
+            self._live_display = (container_id, handle, len(self.lines))
+            self._live_snapshot = (container_handle, time.monotonic())
+
+    def _all_slots(self):
+        """All slots of the report, including slots reserved in slots"""
+        slots = []
+        for line in self.lines:
+            if not isinstance(line, str):
+                slots.append(line)
+                slots.extend(line._all_slots())
+        return slots
+
+    def _live_container_html(self, container_id):
+        return f'<div id="{container_id}">' + self._body_html() + "</div>"
+
+    def snapshot(self):
+        """Replace the live display container by the full report body
+
+        Call this before saving the notebook, so that it contains all elements
+        added so far. No-op without live_display.
+        """
+        with self._lock:
+            if self._live_snapshot is None:
+                return
+            container_handle, unused_time = self._live_snapshot
+            container_id, handle, n_sent = self._live_display
+            container_handle.update(HTML(self._live_container_html(container_id)))
+            # the snapshot contains all increments, do not replay them on reopening
+            handle.update(Javascript(""))
+            self._live_snapshot = (container_handle, time.monotonic())
+
+    def reserve(self) -> "HtmlReport":
+        """Reserve a slot at the current position of the document
+
+        Returns a slot which has the same methods for adding elements as the
+        report (h1, table, figure, ...). Whatever is added to the slot appears
+        at the reserved position, regardless of when it is added. Together with
+        the thread-safe id and path allocation, this allows several threads to
+        produce figures concurrently, while the document follows the order of
+        the reserve() calls::
+
+            slots = [report.reserve() for sample in samples]
+            with ThreadPoolExecutor() as executor:
+                executor.map(plot_sample, slots, samples)
+            report.save()
+
+        Slots share the counters, paths and link function of the report. Do
+        not call save or display on a slot.
+        """
+        slot = copy.copy(self)
+        slot.lines = []
+        slot._live_display = None
+        slot._live_snapshot = None
+        with self._lock:
+            if self._live_display is not None:
+                # in live mode, slot contents are appended to a placeholder div
+                container_id, handle, unused_n_sent = self._live_display
+                slot_div_id = f"{container_id}-slot{self._slot_counter()}"
+                self._append(f'<div id="{slot_div_id}"></div>')
+                slot._live_display = (slot_div_id, handle, 0)
+                self.lines[-1] = slot
+            else:
+                self.lines.append(slot)
+        return slot
+
+    def _body_html(self):
+        # note that the \n-join is just to get a visually pleasing html source document
+        # when you add new elements, remember to add <div> or <br> where necessary
+        with self._lock:
+            lines = list(self.lines)
+        return "\n".join(
+            line if isinstance(line, str) else line._slot_html() for line in lines
+        )
+
+    def _slot_html(self):
+        if self._live_display is None:
+            return self._body_html()
+        # live slots keep their placeholder div, which later increments target
+        return f'<div id="{self._live_display[0]}">{self._body_html()}</div>'
+
+    def _append(self, line: str):
+        with self._lock:
+            self.lines.append(line)
+            if self._live_display is not None:
+                container_id, handle, n_sent = self._live_display
+                new_html = "\n".join(self.lines[n_sent:])
+                handle.update(
+                    Javascript(
+                        f"document.getElementById({json.dumps(container_id)})"
+                        f".insertAdjacentHTML('beforeend', {json.dumps(new_html)});"
+                    )
+                )
+                self._live_display = (container_id, handle, len(self.lines))
+                root = self._root
+                if (
+                    root._live_snapshot is not None
+                    and root.live_snapshot_interval is not None
+                    and time.monotonic() - root._live_snapshot[1]
+                    >= root.live_snapshot_interval
+                ):
+                    root.snapshot()
+
 
 def incremental_counter(start=0):
+    """Thread-safe counter, each call returns the next integer"""
+    lock = threading.Lock()
+
     def wrapped():
         nonlocal start
-        start += 1
-        return start - 1
+        with lock:
+            start += 1
+            return start - 1
 
     return wrapped
 
 
+def _close_pyplot_figure(fig):
+    """Close the matplotlib figure of fig, if it has one"""
+    if isinstance(fig, Figure):
+        plt.close(fig)
+    elif isinstance(fig, (sns.FacetGrid, sns.matrix.ClusterGrid, sns.PairGrid)):
+        plt.close(fig.fig)
+
+
 def save_and_display(
     fig,
     link_fn,
@@ -367,7 +614,9 @@ def save_and_display(
 
     """
 
-    plt.close()
+    # close only this figure (prevents a second inline display); pyplot's
+    # current figure may belong to another thread adding figures concurrently
+    _close_pyplot_figure(fig)
 
     assert png_path is not None or trunk_path is not None
 
@@ -378,6 +627,8 @@ def save_and_display(
     if counter is not None:
         png_path = re.sub("\.png$", f"_{counter()}.png", png_path)
 
+    # formats which are actually written, only these are linked
+    saved_formats = ["png"] + [x for x in ("pdf", "svg") if x in additional_formats]
     if isinstance(
         fig, (mpl.figure.Figure, sns.FacetGrid, sns.matrix.ClusterGrid, sns.PairGrid)
     ):
@@ -386,7 +637,7 @@ def save_and_display(
             fig.savefig(pdf(png_path))
         if "svg" in additional_formats:
             fig.savefig(svg(png_path))
-        plt.close()
+        _close_pyplot_figure(fig)
     elif isinstance(fig, pn.ggplot):
         size_kwargs = dict(height=height, width=width, units="in")
         fig.save(png_path, **size_kwargs)
@@ -411,6 +662,7 @@ def save_and_display(
             # saving ggplot as svg seems buggy (Feb 2020)
             # if 'svg' in additional_formats:
             #     fig.save(svg(png_path), **size_kwargs)
+            saved_formats = [x for x in saved_formats if x != "svg"]
 
     if output == "md":
         image_link = server_markdown_link_get_str(
@@ -420,9 +672,8 @@ def save_and_display(
             display_width=display_width,
         )
         download_links = [
-            server_markdown_link_get_str(png_path),
-            server_markdown_link_get_str(pdf(png_path)),
-            server_markdown_link_get_str(svg(png_path)),
+            server_markdown_link_get_str(with_format(png_path, fmt))
+            for fmt in saved_formats
         ]
         markdown_elements = []  # lines or table columns
         if name is not None:
@@ -469,6 +720,7 @@ def save_and_display(
             display_height=display_height,
             display_width=display_width,
             link_fn=link_fn,
+            download_formats=saved_formats,
         )
     else:
         raise ValueError(f"Unknown output format {output}")
@@ -486,6 +738,8 @@ def display_file_html(
     display_height=None,
     display_width=None,
     units="px",
+    download_formats=("png", "pdf", "svg"),
+    sibling_resolver=None,
 ):
     """
 
@@ -501,6 +755,11 @@ def display_file_html(
     display_height
     display_width
     units
+    download_formats
+        formats to link, without checking whether they exist
+    sibling_resolver
+        if given, link only the formats of the SiblingResolver which exist
+        next to png_path (download_formats is ignored)
 
     Returns
     -------
@@ -514,10 +773,12 @@ def display_file_html(
         units=units,
         link_fn=link_fn,
     )
+    if sibling_resolver is not None:
+        download_paths = [path for fmt, path in sibling_resolver.resolve(str(png_path))]
+    else:
+        download_paths = [with_format(png_path, fmt) for fmt in download_formats]
     download_links = [
-        server_html_link_get_str(png_path, link_fn=link_fn),
-        server_html_link_get_str(pdf(png_path), link_fn=link_fn),
-        server_html_link_get_str(svg(png_path), link_fn=link_fn),
+        server_html_link_get_str(path, link_fn=link_fn) for path in download_paths
     ]
     elements = []  # lines or table columns
     if name is not None:
@@ -0,0 +1,204 @@
+// Virtualized interactive grids, see figure_report/interactive_grid.py
+//
+// Only the panels in the rows in or near the viewport exist in the DOM; on
+// scroll, panels leaving this range are removed and entering panels added.
+(function () {
+    // the script is included once per grid, initialize all grids only once
+    if (window.figureReportInteractiveGrids) {
+        return;
+    }
+    window.figureReportInteractiveGrids = true;
+    // rows rendered above and below the visible rows
+    var OVERSCAN_ROWS = 3;
+    var PAGE_SIZES = [0, 100, 500, 1000, 5000];
+
+    function element(tag, text) {
+        var elem = document.createElement(tag);
+        if (text !== undefined) {
+            elem.textContent = text;
+        }
+        return elem;
+    }
+
+    function select(options, onchange) {
+        var elem = element('select');
+        options.forEach(function (option) {
+            var optionElem = element('option', option[1]);
+            optionElem.value = option[0];
+            elem.appendChild(optionElem);
+        });
+        elem.onchange = onchange;
+        return elem;
+    }
+
+    function init(root) {
+        var data = JSON.parse(root.querySelector('script[type="application/json"]').textContent);
+        var panelWidth = Number(root.dataset.panelWidth);
+        var panelHeight = Number(root.dataset.panelHeight);
+        var nPanels = data.paths.length;
+        var order = [];
+        for (var i = 0; i < nPanels; i++) {
+            order.push(i);
+        }
+        var page = 0;
+        var pageSize = 0;  // 0: all panels on one page
+        var columns = 1;
+        var rendered = new Map();  // panel index -> element
+        var renderScheduled = false;
+
+        function label(panel) {
+            return data.fields.map(function (field) {
+                var code = field.codes[panel];
+                return code < 0 ? null : field.name + ': ' + field.values[code];
+            }).filter(function (x) { return x !== null; }).join(', ') || data.paths[panel];
+        }
+
+        function pageRange() {
+            if (!pageSize) {
+                return [0, nPanels];
+            }
+            return [page * pageSize, Math.min(nPanels, (page + 1) * pageSize)];
+        }
+
+        // controls: sorting and paging
+        var controls = element('div');
+        controls.className = 'interactive-grid-controls';
+        var sortField = select([['', 'original order']].concat(data.fields.map(function (field, i) {
+            return [String(i), field.name];
+        })), sort);
+        var sortDirection = select([['1', 'ascending'], ['-1', 'descending']], sort);
+        var pageSizeSelect = select(PAGE_SIZES.map(function (size) {
+            return [String(size), size ? size + ' per page' : 'all'];
+        }), function () {
+            pageSize = Number(pageSizeSelect.value);
+            page = 0;
+            layout(true);
+        });
+        var previousButton = element('button', '<');
+        var nextButton = element('button', '>');
+        var pageLabel = element('span');
+        previousButton.type = nextButton.type = 'button';
+        previousButton.onclick = function () {
+            if (page > 0) {
+                page -= 1;
+                layout(true);
+            }
+        };
+        nextButton.onclick = function () {
+            if (pageSize && (page + 1) * pageSize < nPanels) {
+                page += 1;
+                layout(true);
+            }
+        };
+        [element('span', 'sort by '), sortField, sortDirection, pageSizeSelect,
+         previousButton, pageLabel, nextButton].forEach(function (elem) {
+            controls.appendChild(elem);
+        });
+
+        var viewport = element('div');
+        viewport.className = 'interactive-grid-viewport';
+        var canvas = element('div');
+        canvas.style.position = 'relative';
+        viewport.appendChild(canvas);
+        root.appendChild(controls);
+        root.appendChild(viewport);
+
+        function sort() {
+            var field = sortField.value === '' ? null : data.fields[Number(sortField.value)];
+            var direction = Number(sortDirection.value);
+            order.sort(function (a, b) {
+                if (field !== null && field.codes[a] !== field.codes[b]) {
+                    return direction * (field.codes[a] - field.codes[b]);
+                }
+                return field === null ? direction * (a - b) : a - b;
+            });
+            page = 0;
+            layout(true);
+        }
+
+        function layout(reset) {
+            var range = pageRange();
+            columns = Math.max(1, Math.floor(viewport.clientWidth / panelWidth));
+            var rows = Math.ceil((range[1] - range[0]) / columns);
+            canvas.style.height = rows * panelHeight + 'px';
+            pageLabel.textContent = ' ' + (range[0] + 1) + '-' + range[1] + ' of ' + nPanels + ' ';
+            if (reset) {
+                viewport.scrollTop = 0;
+                rendered.forEach(function (elem) {
+                    canvas.removeChild(elem);
+                });
+                rendered.clear();
+            }
+            render();
+        }
+
+        function panelElement(panel) {
+            var link = element('a');
+            var path = data.prefix + data.paths[panel];
+            link.href = path;
+            link.title = label(panel);
+            link.style.position = 'absolute';
+            link.style.width = panelWidth + 'px';
+            link.style.height = panelHeight + 'px';
+            var img = element('img');
+            img.src = path;
+            img.alt = link.title;
+            img.loading = 'lazy';
+            link.appendChild(img);
+            return link;
+        }
+
+        function render() {
+            renderScheduled = false;
+            var range = pageRange();
+            var firstRow = Math.max(0, Math.floor(viewport.scrollTop / panelHeight) - OVERSCAN_ROWS);
+            var lastRow = Math.ceil((viewport.scrollTop + viewport.clientHeight) / panelHeight)
+                + OVERSCAN_ROWS;
+            var start = range[0] + firstRow * columns;
+            var stop = Math.min(range[1], range[0] + lastRow * columns);
+            var visible = new Map();
+            for (var i = start; i < stop; i++) {
+                var panel = order[i];
+                var elem = rendered.get(panel) || panelElement(panel);
+                var position = i - range[0];
+                elem.style.left = (position % columns) * panelWidth + 'px';
+                elem.style.top = Math.floor(position / columns) * panelHeight + 'px';
+                if (!rendered.has(panel)) {
+                    canvas.appendChild(elem);
+                }
+                visible.set(panel, elem);
+            }
+            rendered.forEach(function (elem, panel) {
+                if (!visible.has(panel)) {
+                    canvas.removeChild(elem);
+                }
+            });
+            rendered = visible;
+        }
+
+        function scheduleRender() {
+            if (!renderScheduled) {
+                renderScheduled = true;
+                window.requestAnimationFrame(render);
+            }
+        }
+
+        viewport.addEventListener('scroll', scheduleRender);
+        if (window.ResizeObserver) {
+            new ResizeObserver(function () { layout(false); }).observe(viewport);
+        } else {
+            window.addEventListener('resize', function () { layout(false); });
+        }
+        layout(true);
+    }
+
+    function initAll() {
+        document.querySelectorAll('.interactive-grid').forEach(init);
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', initAll);
+    } else {
+        initAll();
+    }
+})();
@@ -0,0 +1,77 @@
+"""Interactive grids: thousands of panels in one virtualized figure
+
+An interactive grid figure ({'interactive_grid': [panel, ...]}) holds one
+panel per plot; a panel is a path or a dict with 'path' and further fields,
+e.g. {'path': 'regions/chr1_100.png', 'chrom': 'chr1', 'start': 100}.
+
+The panel list is embedded in the page as compact, column-wise JSON: paths
+without their common directory prefix, and each field as the list of its
+sorted distinct values plus one integer code per panel, so that sorting by a
+field is sorting by integer codes. interactive_grid.js renders the panels
+into a scrollable viewport and keeps only the rows in or near view in the
+DOM; sorting and paging happen in the browser.
+"""
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Union
+
+from figure_report.facets import value_sort_key
+
+INTERACTIVE_GRID_STR = 'interactive_grid'
+DEFAULT_PANEL_SIZE = 200
+
+
+def encode_panels(panels: Sequence[Union[str, Dict]]) -> dict:
+    """Column-wise encoding of the panel list, see module docstring"""
+    panels = [{'path': x} if isinstance(x, str) else x for x in panels]
+    paths = [x['path'] for x in panels]
+    prefix = os.path.commonprefix(paths)
+    prefix = prefix[:prefix.rfind('/') + 1]
+    field_names: List[str] = list(dict.fromkeys(
+            name for panel in panels for name in panel if name != 'path'))
+    fields = []
+    for name in field_names:
+        values = sorted({panel[name] for panel in panels if name in panel}, key=value_sort_key)
+        value_to_code = {value: code for code, value in enumerate(values)}
+        fields.append({'name': name,
+                       'values': values,
+                       # -1: panel has no value for this field
+                       'codes': [value_to_code.get(panel.get(name), -1) for panel in panels]})
+    return {'prefix': prefix,
+            'paths': [x[len(prefix):] for x in paths],
+            'fields': fields}
+
+
+class InteractiveGrid:
+    """HTML for an interactive grid figure
+
+    Args:
+        fig_id: id of the grid div
+        interactive_grid: list of panels, see module docstring
+        panel_width, panel_height: size of each panel in px
+    """
+
+    def __init__(self, fig_id: str, interactive_grid: Sequence[Union[str, Dict]],
+                 panel_width: int = DEFAULT_PANEL_SIZE,
+                 panel_height: int = DEFAULT_PANEL_SIZE,
+                 title: Optional[str] = None, description: Optional[str] = None):
+        self.fig_id = fig_id
+        self.panels = interactive_grid
+        self.panel_width = int(panel_width)
+        self.panel_height = int(panel_height)
+        self.title = title
+        self.description = description
+
+    def get_html(self) -> str:
+        title_line = f'<strong>{self.title}</strong><br>' if self.title else ''
+        description_line = f'<p>{self.description}</p>' if self.description else ''
+        panels_json = json.dumps(encode_panels(self.panels), separators=(',', ':'),
+                                 default=str).replace('</', '<\\/')
+        return '\n'.join([
+            title_line,
+            f'<div id="{self.fig_id}" class="interactive-grid" '
+            f'data-panel-width="{self.panel_width}" data-panel-height="{self.panel_height}">',
+            f'<script type="application/json">{panels_json}</script>',
+            '</div>',
+            '<script src="./interactive_grid.js"></script>',
+            description_line])
@@ -0,0 +1,113 @@
+"""Indexed queries over metadata tables from pattern discovery
+
+MetadataIndex builds one inverted index per wildcard field: the row positions
+sorted by field value (one integer array per field) plus offsets into this
+array for each distinct value, so that the rows for a value are a contiguous,
+sorted slice. For prefix queries, the distinct values are sorted as strings.
+
+Equality and set lookups cost a dict lookup per value, prefix lookups a
+binary search over the distinct values; multi-field queries intersect the
+sorted row positions, starting with the smallest. None of this scans the table.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from figure_report.patterns import convert_metadata_table_to_report_json
+
+
+class Prefix(str):
+    """Query value matching all field values which start with this string"""
+
+
+class _FieldIndex:
+    __slots__ = ('uniques', 'value_to_code', 'row_positions', 'offsets',
+                 '_prefix_order', '_prefix_keys')
+
+    def __init__(self, col: pd.Series):
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            codes = col.cat.codes.to_numpy()
+            uniques = col.cat.categories.to_numpy()
+        else:
+            codes, uniques = pd.factorize(col.to_numpy())
+        self.uniques = uniques
+        self.value_to_code = {value: code for code, value in enumerate(uniques)}
+        self.row_positions = np.argsort(codes, kind='stable')
+        sorted_codes = codes[self.row_positions]
+        # rows with missing values (code -1) come first and are never returned
+        self.offsets = np.searchsorted(sorted_codes, np.arange(len(uniques) + 1))
+        # distinct values as sorted strings, built on the first prefix query
+        self._prefix_order = None
+        self._prefix_keys = None
+
+    def _rows_for_codes(self, codes) -> np.ndarray:
+        if len(codes) == 0:
+            return np.array([], dtype=np.int64)
+        if len(codes) == 1:
+            return self.row_positions[self.offsets[codes[0]]:self.offsets[codes[0] + 1]]
+        return np.sort(np.concatenate(
+                [self.row_positions[self.offsets[c]:self.offsets[c + 1]] for c in codes]))
+
+    def lookup(self, value) -> np.ndarray:
+        """Sorted row positions matching value, a collection of values or a Prefix"""
+        if isinstance(value, Prefix):
+            if self._prefix_order is None:
+                string_uniques = self.uniques.astype(str)
+                self._prefix_order = np.argsort(string_uniques)
+                self._prefix_keys = string_uniques[self._prefix_order]
+            start = np.searchsorted(self._prefix_keys, str(value), side='left')
+            stop = np.searchsorted(self._prefix_keys, str(value) + '\U0010ffff', side='left')
+            return self._rows_for_codes(sorted(self._prefix_order[start:stop]))
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return self._rows_for_codes(sorted(self.value_to_code[x] for x in value
+                                               if x in self.value_to_code))
+        code = self.value_to_code.get(value)
+        return self._rows_for_codes([] if code is None else [code])
+
+
+class MetadataIndex:
+    """Index over a metadata table for fast selection of rows by field values
+
+    Args:
+        metadata_table: e.g. from pattern_set_to_metadata_table
+        fields: fields to index, default: all columns except paths
+    """
+
+    def __init__(self, metadata_table: pd.DataFrame, fields: Optional[List[str]] = None):
+        self.metadata_table = metadata_table
+        if fields is None:
+            fields = [x for x in metadata_table.columns
+                      if x not in ('path', 'basename', 'rel_report_dir_path')]
+        self.field_indices: Dict[str, _FieldIndex] = {
+            field: _FieldIndex(metadata_table[field]) for field in fields}
+
+    def positions(self, conditions: Optional[Dict] = None, **kwargs) -> np.ndarray:
+        """Sorted row positions matching all conditions
+
+        Conditions map fields to a value (equality), a list or set of values
+        (membership) or a Prefix. They can be given as dict (for field names
+        which are not valid identifiers) or as keyword arguments.
+        """
+        conditions = {**(conditions or {}), **kwargs}
+        if not conditions:
+            return np.arange(len(self.metadata_table))
+        row_sets = sorted((self.field_indices[field].lookup(value)
+                           for field, value in conditions.items()), key=len)
+        positions = row_sets[0]
+        for rows in row_sets[1:]:
+            if len(positions) == 0:
+                break
+            positions = np.intersect1d(positions, rows, assume_unique=True)
+        return positions
+
+    def query(self, conditions: Optional[Dict] = None, **kwargs) -> pd.DataFrame:
+        """Rows of the metadata table matching all conditions, see positions"""
+        return self.metadata_table.iloc[self.positions(conditions, **kwargs)]
+
+    def to_report_json(self, section_cols: List[str],
+                       conditions: Optional[Dict] = None,
+                       facet_cols: Optional[List[str]] = None, **kwargs) -> dict:
+        """convert_metadata_table_to_report_json for the rows matching the conditions"""
+        return convert_metadata_table_to_report_json(self.query(conditions, **kwargs),
+                                                     section_cols, facet_cols=facet_cols)
@@ -0,0 +1,122 @@
+"""Service worker caching for repeat visits of reports
+
+install_service_worker copies a service worker (sw.js) into the report
+directory and writes a manifest with the content hash of each asset. Pages
+register the worker with REGISTER_SERVICE_WORKER_HTML.
+
+The worker fetches the (small) manifest on each page load and serves assets
+listed in it from the browser cache if the cached copy has the current hash;
+otherwise the asset is fetched and cached. Query strings (e.g. the
+cache-busting timestamps of HtmlReport links) are ignored for matching, so
+repeat visits only download changed assets. If the manifest can not be
+fetched, e.g. offline, the cached assets are used as they are.
+
+Hashes are cached by (path, size, mtime), so unchanged assets are not read
+again when the manifest is updated.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+SERVICE_WORKER_NAME = 'sw.js'
+PRECACHE_MANIFEST_NAME = 'precache-manifest.json'
+HASH_CACHE_NAME = '.figure_report_precache.json'
+# precompressed siblings are served by the web server, not listed separately
+SKIPPED_SUFFIXES = ('.gz', '.br', '.tmp')
+REGISTER_SERVICE_WORKER_HTML = f'''\
+<script>
+    if ('serviceWorker' in navigator) {{
+        navigator.serviceWorker.register('./{SERVICE_WORKER_NAME}');
+    }}
+</script>'''
+
+
+def _content_hash(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()[:16]
+
+
+def _is_cached_file(path: Path, output_dir: Path) -> bool:
+    rel_parts = path.resolve().relative_to(output_dir.resolve()).parts
+    return (path.is_file() and not any(x.startswith('.') for x in rel_parts)
+            and not path.name.endswith(SKIPPED_SUFFIXES)
+            and rel_parts not in ((SERVICE_WORKER_NAME,), (PRECACHE_MANIFEST_NAME,)))
+
+
+def write_precache_manifest(output_dir: Union[str, os.PathLike],
+                            paths: Optional[Iterable[Union[str, os.PathLike]]] = None,
+                            n_jobs: int = 8) -> Dict[str, str]:
+    """Write the manifest of asset hashes for the service worker
+
+    Args:
+        output_dir: report directory, the scope of the service worker
+        paths: add or update only these files (below output_dir) and keep the
+            other entries of an existing manifest whose files still exist, so
+            that several reports can share a directory. Default: all files
+            below output_dir. Hidden files and precompressed siblings are
+            always skipped.
+        n_jobs: number of threads for hashing
+
+    Returns:
+        relative path -> content hash
+    """
+    output_dir = Path(output_dir)
+    manifest_fp = output_dir / PRECACHE_MANIFEST_NAME
+    hash_cache_fp = output_dir / HASH_CACHE_NAME
+    assets = {}
+    if paths is None:
+        files = [x for x in output_dir.rglob('*') if _is_cached_file(x, output_dir)]
+    else:
+        files = [Path(x) for x in paths if _is_cached_file(Path(x), output_dir)]
+        if manifest_fp.exists():
+            assets = {rel_path: content_hash for rel_path, content_hash
+                      in json.loads(manifest_fp.read_text())['assets'].items()
+                      if output_dir.joinpath(rel_path).exists()}
+    # relative path -> [size, mtime_ns, hash]
+    hash_cache = json.loads(hash_cache_fp.read_text()) if hash_cache_fp.exists() else {}
+
+    def get_hash(path: Path):
+        rel_path = path.resolve().relative_to(output_dir.resolve()).as_posix()
+        stat = path.stat()
+        entry = hash_cache.get(rel_path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, _content_hash(path)]
+        return rel_path, entry
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for rel_path, entry in executor.map(get_hash, files):
+            hash_cache[rel_path] = entry
+            assets[rel_path] = entry[2]
+    hash_cache = {rel_path: entry for rel_path, entry in hash_cache.items()
+                  if rel_path in assets}
+    hash_cache_fp.write_text(json.dumps(hash_cache))
+    tmp_fp = output_dir / f'.{PRECACHE_MANIFEST_NAME}.{uuid.uuid4().hex}.tmp'
+    tmp_fp.write_text(json.dumps({'assets': dict(sorted(assets.items()))},
+                                 separators=(',', ':')))
+    os.replace(tmp_fp, manifest_fp)
+    return assets
+
+
+def install_service_worker(output_dir: Union[str, os.PathLike],
+                           paths: Optional[Iterable[Union[str, os.PathLike]]] = None
+                           ) -> Dict[str, str]:
+    """Copy the service worker to output_dir and update the manifest
+
+    Args:
+        output_dir: report directory, the scope of the service worker
+        paths: see write_precache_manifest
+
+    Returns:
+        relative path -> content hash, see write_precache_manifest
+    """
+    output_dir = Path(output_dir)
+    shutil.copy2(Path(__file__).parent / 'service_worker.js', output_dir / SERVICE_WORKER_NAME)
+    return write_precache_manifest(output_dir, paths)
@@ -0,0 +1,209 @@
+"""Lossless recompression of PNGs and minification of SVGs in report directories
+
+PNGs are recompressed by re-deflating the image data at the highest zlib level
+and dropping textual metadata chunks (tEXt, zTXt, iTXt, tIME); pixel data and
+color information are unchanged. SVGs are minified by removing comments and
+whitespace between tags (except within text elements and documents using
+xml:space="preserve", where it is significant), and optionally by rounding the numbers of geometry
+attributes (path data, points and coordinates) to a fixed number of decimals;
+text and transforms (e.g. the scale of glyphs) are never rounded.
+
+Files are processed in a process pool. Optimized versions are cached by the
+hash of the input content, so that unchanged files are never reprocessed, even
+if the original file is staged again.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Union
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_DROPPED_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+CACHE_INDEX_NAME = 'index.json'
+
+
+class ImageOptimizationSummary(NamedTuple):
+    n_files: int
+    n_optimized: int
+    bytes_before: int
+    bytes_after: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def __str__(self):
+        return (f'Optimized {self.n_optimized} of {self.n_files} images: '
+                f'{self.bytes_before:,} -> {self.bytes_after:,} bytes '
+                f'({self.bytes_saved:,} bytes saved)')
+
+
+def optimize_png(data: bytes) -> bytes:
+    """Losslessly recompress PNG, return original data if that is smaller"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError('Not a PNG file')
+    chunks = []
+    idat = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, = struct.unpack('>I', data[pos:pos + 4])
+        chunk_type = data[pos + 4:pos + 8]
+        chunk_data = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b'IDAT':
+            if not idat:
+                # placeholder for the position of the recompressed IDAT chunk
+                chunks.append((b'IDAT', None))
+            idat.append(chunk_data)
+        elif chunk_type not in PNG_DROPPED_CHUNKS:
+            chunks.append((chunk_type, chunk_data))
+    compressor = zlib.compressobj(level=9, memLevel=9)
+    idat_data = compressor.compress(zlib.decompress(b''.join(idat))) + compressor.flush()
+    out = [PNG_SIGNATURE]
+    for chunk_type, chunk_data in chunks:
+        if chunk_data is None:
+            chunk_data = idat_data
+        out.append(struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data
+                   + struct.pack('>I', zlib.crc32(chunk_type + chunk_data)))
+    optimized = b''.join(out)
+    return optimized if len(optimized) < len(data) else data
+
+
+# attributes whose numbers are rounded by minify_svg
+SVG_GEOMETRY_ATTRIBUTES = ('d', 'points', 'x', 'y', 'x1', 'y1', 'x2', 'y2',
+                           'cx', 'cy', 'r', 'rx', 'ry')
+_SVG_GEOMETRY_ATTRIBUTE_RE = re.compile(
+        r'(\s(?:{})\s*=\s*)(["\'])(.*?)\2'.format('|'.join(SVG_GEOMETRY_ATTRIBUTES)),
+        flags=re.DOTALL)
+# whitespace between the children of these elements (e.g. tspans) is text
+_SVG_INTER_TAG_WHITESPACE_RE = re.compile(
+        r'(<(text|foreignObject)\b.*?</\2\s*>)|(?<=>)\s+(?=<)', flags=re.DOTALL)
+
+
+def minify_svg(data: bytes, precision: Optional[int] = 3) -> bytes:
+    """Remove comments and inter-tag whitespace, round geometry to precision decimals
+
+    Whitespace within text elements, e.g. between tspans, and in documents
+    using xml:space="preserve" is kept.
+
+    Args:
+        precision: number of decimals to keep in the SVG_GEOMETRY_ATTRIBUTES,
+            None: do not round
+    """
+    text = data.decode('utf-8')
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.DOTALL)
+    if not re.search(r'xml:space\s*=\s*["\']preserve', text):
+        text = _SVG_INTER_TAG_WHITESPACE_RE.sub(lambda match: match.group(1) or '', text)
+    if precision is not None:
+        def round_number(match):
+            rounded = f'{float(match.group(0)):.{precision}f}'.rstrip('0').rstrip('.')
+            return '0' if rounded in ('-0', '') else rounded
+        number_re = re.compile(rf'-?\d*\.\d{{{precision + 1},}}')
+
+        def round_attribute(match):
+            name, quote, value = match.groups()
+            return f'{name}{quote}{number_re.sub(round_number, value)}{quote}'
+        text = _SVG_GEOMETRY_ATTRIBUTE_RE.sub(round_attribute, text)
+    minified = text.strip().encode('utf-8')
+    return minified if len(minified) < len(data) else data
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _optimize_file(path: str, cache_dir: str, svg_precision: Optional[int]):
+    """Optimize file in place, store result in cache; runs in worker process"""
+    data = Path(path).read_bytes()
+    if path.endswith('.png'):
+        optimized = optimize_png(data)
+    else:
+        optimized = minify_svg(data, precision=svg_precision)
+    input_hash = _hash(data)
+    cache_fp = Path(cache_dir) / (input_hash + Path(path).suffix)
+    cache_fp.write_bytes(optimized)
+    if optimized is not data:
+        tmp_path = path + '.tmp'
+        Path(tmp_path).write_bytes(optimized)
+        os.replace(tmp_path, path)
+    return input_hash, _hash(optimized), len(data), len(optimized)
+
+
+def optimize_images(paths: Iterable[Union[str, Path]],
+                    cache_dir: Union[str, Path],
+                    n_jobs: Optional[int] = None,
+                    svg_precision: Optional[int] = 3) -> ImageOptimizationSummary:
+    """Optimize PNG and SVG files in place, in a process pool
+
+    Args:
+        paths: files with other suffixes are ignored
+        cache_dir: optimized files are stored here by input content hash
+        n_jobs: number of worker processes, default: number of cpus
+        svg_precision: passed to minify_svg
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index_fp = cache_dir / CACHE_INDEX_NAME
+    # maps input hash -> output hash; output hashes identify optimized files
+    index = json.loads(index_fp.read_text()) if index_fp.exists() else {}
+    optimized_hashes = set(index.values())
+
+    n_files = n_optimized = bytes_before = bytes_after = 0
+    to_process = []
+    for path in paths:
+        path = Path(path)
+        if path.suffix not in ('.png', '.svg'):
+            continue
+        n_files += 1
+        data = path.read_bytes()
+        data_hash = _hash(data)
+        cache_fp = cache_dir / (data_hash + path.suffix)
+        if data_hash in optimized_hashes:
+            bytes_before += len(data)
+            bytes_after += len(data)
+        elif data_hash in index and cache_fp.exists():
+            shutil.copy(cache_fp, path)
+            n_optimized += 1
+            bytes_before += len(data)
+            bytes_after += cache_fp.stat().st_size
+        else:
+            to_process.append(str(path))
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(_optimize_file, to_process,
+                                    [str(cache_dir)] * len(to_process),
+                                    [svg_precision] * len(to_process)))
+    for input_hash, output_hash, size_before, size_after in results:
+        index[input_hash] = output_hash
+        n_optimized += 1
+        bytes_before += size_before
+        bytes_after += size_after
+    index_fp.write_text(json.dumps(index))
+
+    return ImageOptimizationSummary(n_files=n_files, n_optimized=n_optimized,
+                                    bytes_before=bytes_before, bytes_after=bytes_after)
+
+
+def optimize_report_images(report_dir: Union[str, Path],
+                           cache_dir: Optional[Union[str, Path]] = None,
+                           n_jobs: Optional[int] = None,
+                           svg_precision: Optional[int] = 3) -> ImageOptimizationSummary:
+    """Optimize all PNG and SVG files below report_dir, see optimize_images
+
+    Args:
+        cache_dir: default: report_dir/.image_cache
+    """
+    report_dir = Path(report_dir)
+    if cache_dir is None:
+        cache_dir = report_dir / '.image_cache'
+    paths: List[Path] = [x for x in report_dir.rglob('*')
+                         if x.suffix in ('.png', '.svg') and x.is_file()
+                         and Path(cache_dir) not in x.parents]
+    return optimize_images(paths, cache_dir=cache_dir, n_jobs=n_jobs,
+                           svg_precision=svg_precision)
@@ -1,23 +1,31 @@
 import glob
 import itertools
+import os
 import re
-import shutil
 from collections import defaultdict
-from pathlib import Path
-from typing import Optional, Dict, Union, List
+from typing import Optional, Dict, Union, List, Tuple, Iterator, Sequence
 
 import pandas as pd
 
+from figure_report.assets import AssetStore
+from figure_report.optimize import optimize_report_images
+from figure_report.siblings import SiblingResolver, sibling_path
+from figure_report.storage import Storage, LocalStorage, copy_many
+
+
+def _as_value_list(val):
+    """Scalars (incl. numpy scalars, e.g. from a DataFrame) -> [val], lists as is"""
+    return [val] if pd.api.types.is_scalar(val) else val
+
 
 def sel_expand(template, **kwargs):
     fields = kwargs.keys()
     values = [kwargs[f] for f in fields]
-    values = [[val] if isinstance(val, (int, str)) else val
-              for val in values]
+    values = [_as_value_list(val) for val in values]
     value_combinations = itertools.product(*values)
     def get_expanded_template(template, fields, comb):
         for field, value in zip(fields, comb):
-            template = template.replace('{' + field + '}', value)
+            template = template.replace('{' + field + '}', str(value))
         return template
     res = [get_expanded_template(template, fields, comb) for comb in value_combinations]
     if len(res) == 1:
@@ -25,22 +33,62 @@ def sel_expand(template, **kwargs):
     return res
 
 
-def pattern_to_metadata_table(wildcard_pattern: str, field_constraints: Optional[Dict] = None):
-    """Create metadata table for all files matching a snakemake-like pattern
+def iter_sel_expand(template: str, **kwargs) -> Iterator[Tuple[Dict, str]]:
+    """Lazily expand template for all combinations of the wildcard values
 
-    Output: metadata table with these columns:
-      - one column per wildcard field
-      - 'path' contains the full match for the snakemake-like pattern
-      - fields in the output table are in the order of appearance from the filepath pattern
+    Like sel_expand, but yields (field_values, path) tuples one at a time
+    instead of building the full list of expanded paths. Values may be
+    strings or numbers, or lists of them. All fields in the template
+    must be specified.
+    """
+    fields = list(kwargs.keys())
+    values = [_as_value_list(val) for val in kwargs.values()]
+    missing_fields = set(re.findall(r'{(.*?)}', template)) - set(fields)
+    if missing_fields:
+        raise ValueError(f'No values given for fields {missing_fields}')
+    for comb in itertools.product(*values):
+        field_values = dict(zip(fields, comb))
+        path = re.sub(r'{(.*?)}', lambda m: str(field_values[m.group(1)]), template)
+        yield field_values, path
 
-    Details:
-      - fields may occur multiple times in the pattern
-      - files are found by replacing each field with a '*' and using glob.glob
-      - metadata are extracted using a regex constructed as follows:
-        - the first occurence of each field is replaced with the default regex ('.+'),
-          or the regex supplied via field_constraints
-        - all following occurences of the field are replace with a backreference
-          to the first match for the field
+
+def sel_expand_to_metadata_table(template: str, **kwargs) -> pd.DataFrame:
+    """Expand template and return metadata table for the existing paths
+
+    Existence is checked with one directory listing per distinct parent
+    directory (instead of one stat call per expanded path), which is much
+    faster on network filesystems.
+
+    Returns:
+        metadata table in the same shape as pattern_to_metadata_table: 'path'
+        column followed by one column per field, in order of appearance in
+        the template. Field values are kept as passed (e.g. ints stay ints).
+    """
+    field_names_set = set()
+    field_names_in_order_of_appearance = [
+        x for x in re.findall(r'{(.*?)}', template)
+        if not (x in field_names_set or field_names_set.add(x))]
+    directory_listings = {}
+    records = []
+    for field_values, path in iter_sel_expand(template, **kwargs):
+        parent_dir, sep, basename = path.rpartition('/')
+        if parent_dir not in directory_listings:
+            try:
+                directory_listings[parent_dir] = set(os.listdir((parent_dir or sep) or '.'))
+            except (FileNotFoundError, NotADirectoryError):
+                directory_listings[parent_dir] = set()
+        if basename in directory_listings[parent_dir]:
+            records.append({'path': path,
+                            **{f: field_values[f] for f in field_names_in_order_of_appearance}})
+    return pd.DataFrame.from_records(records,
+                                     columns=['path'] + field_names_in_order_of_appearance)
+
+
+def _parse_wildcard_pattern(wildcard_pattern: str, field_constraints: Optional[Dict] = None
+                            ) -> Tuple[List[str], str, str]:
+    """Return field names in order of appearance, glob pattern and regex pattern
+
+    See pattern_to_metadata_table for details on the regex construction.
     """
     if field_constraints is None:
         field_constraints = {}
@@ -53,9 +101,6 @@ def pattern_to_metadata_table(wildcard_pattern: str, field_constraints: Optional
     assert set(field_constraints.keys()) <= field_names_set
 
     glob_pattern = re.sub(r'{(.+?)}', r'*', wildcard_pattern)
-    glob_results = glob.glob(glob_pattern)
-    if not glob_results:
-        raise ValueError(f'Could not find any file matching:\n{glob_pattern}')
 
     regex_pattern = wildcard_pattern
     for field_name in field_names_set:
@@ -69,6 +114,49 @@ def pattern_to_metadata_table(wildcard_pattern: str, field_constraints: Optional
             # replace following fields with named backreference, if there are any
             regex_pattern = regex_pattern.replace('{' + field_name + '}', f'(?P={field_name})')
 
+    return field_names_in_order_of_appearance, glob_pattern, regex_pattern
+
+
+def pattern_to_metadata_table(wildcard_pattern: str, field_constraints: Optional[Dict] = None,
+                              categorical: Union[bool, List[str]] = False,
+                              field_dtypes: Optional[Dict[str, Union[type, str]]] = None,
+                              path_representation: str = 'full',
+                              storage: Optional[Storage] = None):
+    """Create metadata table for all files matching a snakemake-like pattern
+
+    Output: metadata table with these columns:
+      - one column per wildcard field
+      - 'path' contains the full match for the snakemake-like pattern
+      - fields in the output table are in the order of appearance from the filepath pattern
+
+    Memory-efficient tables (see README for memory figures):
+      - field_dtypes: mapping field -> int, float or any dtype accepted by
+        pd.Series.astype; the field is coerced right after extraction
+      - categorical: True (all wildcard fields which are not coerced by field_dtypes)
+        or list of fields to return as categoricals
+      - path_representation: 'full' (default) keeps the 'path' column,
+        'split' replaces it by a categorical 'dirname' column (the directory table)
+        and a 'basename' column. Use get_paths to recover the full paths.
+
+    Details:
+      - fields may occur multiple times in the pattern
+      - files are found by replacing each field with a '*' and using glob.glob,
+        or the glob method of storage (see figure_report.storage) if given
+      - metadata are extracted using a regex constructed as follows:
+        - the first occurence of each field is replaced with the default regex ('.+'),
+          or the regex supplied via field_constraints
+        - all following occurences of the field are replace with a backreference
+          to the first match for the field
+    """
+    field_names_in_order_of_appearance, glob_pattern, regex_pattern = _parse_wildcard_pattern(
+            wildcard_pattern, field_constraints)
+    if storage is None:
+        glob_results = glob.glob(glob_pattern)
+    else:
+        glob_results = list(storage.glob(glob_pattern))
+    if not glob_results:
+        raise ValueError(f'Could not find any file matching:\n{glob_pattern}')
+
     glob_ser = pd.Series(glob_results)
     metadata_df = glob_ser.str.extract(regex_pattern)
     pattern_matched = glob_ser.str.match(regex_pattern)
@@ -80,12 +168,131 @@ def pattern_to_metadata_table(wildcard_pattern: str, field_constraints: Optional
     metadata_df['path'] = glob_ser.loc[pattern_matched]
     metadata_df = metadata_df[['path'] + field_names_in_order_of_appearance]
 
-    return metadata_df
+    return compact_metadata_table(metadata_df, field_names_in_order_of_appearance,
+                                  categorical=categorical, field_dtypes=field_dtypes,
+                                  path_representation=path_representation)
+
+
+def iter_pattern_matches(wildcard_pattern: str, field_constraints: Optional[Dict] = None,
+                         chunk_size: int = 10000,
+                         as_dataframe: bool = False,
+                         field_dtypes: Optional[Dict[str, type]] = None,
+                         storage: Optional[Storage] = None
+                         ) -> Iterator[Union[List[Dict], pd.DataFrame]]:
+    """Yield metadata for files matching a snakemake-like pattern in chunks
+
+    Streaming variant of pattern_to_metadata_table: the filesystem is walked
+    lazily with glob.iglob and chunks are yielded as soon as chunk_size matches
+    have been collected, so downstream processing can start immediately and
+    memory usage is bounded by the chunk size. The regex is compiled once and
+    each path is matched exactly once.
+
+    Args:
+        wildcard_pattern: see pattern_to_metadata_table
+        field_constraints: see pattern_to_metadata_table
+        chunk_size: maximum number of records per chunk
+        as_dataframe: yield DataFrames (same columns as pattern_to_metadata_table)
+            instead of lists of dicts
+        field_dtypes: mapping field -> callable (e.g. int, float) applied
+            to each extracted value
+        storage: list files with this Storage (paginated) instead of glob.iglob
+
+    Raises:
+        ValueError: if no file matches the glob pattern, or if a path does not
+            match the regex and no field_constraints were given
+    """
+    field_names_in_order_of_appearance, glob_pattern, regex_pattern = _parse_wildcard_pattern(
+            wildcard_pattern, field_constraints)
+    regex = re.compile(regex_pattern)
+    if field_dtypes is None:
+        field_dtypes = {}
+    columns = ['path'] + field_names_in_order_of_appearance
+
+    def make_chunk(records):
+        if as_dataframe:
+            return pd.DataFrame.from_records(records, columns=columns)
+        return records
+
+    found_any_file = False
+    records = []
+    paths = glob.iglob(glob_pattern) if storage is None else storage.glob(glob_pattern)
+    for path in paths:
+        found_any_file = True
+        match = regex.match(path)
+        if match is None:
+            if field_constraints:
+                continue
+            raise ValueError(f'Could not match the regex pattern to glob result {path}')
+        record = {'path': path}
+        for field_name in field_names_in_order_of_appearance:
+            value = match.group(field_name)
+            record[field_name] = (field_dtypes[field_name](value)
+                                  if field_name in field_dtypes else value)
+        records.append(record)
+        if len(records) == chunk_size:
+            yield make_chunk(records)
+            records = []
+    if not found_any_file:
+        raise ValueError(f'Could not find any file matching:\n{glob_pattern}')
+    if records:
+        yield make_chunk(records)
+
+
+def compact_metadata_table(metadata_table: pd.DataFrame, field_names: List[str],
+                           categorical: Union[bool, List[str]] = False,
+                           field_dtypes: Optional[Dict[str, Union[type, str]]] = None,
+                           path_representation: str = 'full') -> pd.DataFrame:
+    """Coerce field dtypes, convert fields to categoricals and split the path column
+
+    See pattern_to_metadata_table for the meaning of the arguments.
+    """
+    if field_dtypes is None:
+        field_dtypes = {}
+    assert set(field_dtypes.keys()) <= set(field_names)
+    if path_representation not in ('full', 'split'):
+        raise ValueError(f'Unknown path_representation {path_representation}')
+
+    metadata_table = metadata_table.copy()
+    for field_name, dtype in field_dtypes.items():
+        metadata_table[field_name] = metadata_table[field_name].astype(dtype)
+
+    if categorical is True:
+        categorical_fields = [x for x in field_names if x not in field_dtypes]
+    elif categorical is False:
+        categorical_fields = []
+    else:
+        categorical_fields = list(categorical)
+        assert set(categorical_fields) <= set(field_names)
+    for field_name in categorical_fields:
+        metadata_table[field_name] = metadata_table[field_name].astype('category')
+
+    if path_representation == 'split' and 'path' in metadata_table:
+        path_parts = metadata_table['path'].str.rpartition('/')
+        metadata_table.insert(0, 'basename', path_parts[2])
+        metadata_table.insert(0, 'dirname', path_parts[0].astype('category'))
+        metadata_table = metadata_table.drop(columns='path')
+
+    return metadata_table
+
+
+def get_paths(metadata_table: pd.DataFrame) -> pd.Series:
+    """Return full paths for metadata table with 'full' or 'split' path representation"""
+    if 'path' in metadata_table:
+        return metadata_table['path']
+    return metadata_table['dirname'].astype(str) + '/' + metadata_table['basename']
 
 def pattern_set_to_metadata_table(
         pattern_set: Union[List[str], Dict[str, str]],
         names: Optional[List[str]] = None,
-        wildcard_constraints: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        wildcard_constraints: Optional[Dict[str, str]] = None,
+        categorical: Union[bool, List[str]] = False,
+        field_dtypes: Optional[Dict[str, Union[type, str]]] = None,
+        path_representation: str = 'full') -> pd.DataFrame:
+    """Concatenate metadata tables for several patterns
+
+    categorical, field_dtypes and path_representation are applied to
+    the concatenated table, see pattern_to_metadata_table.
+    """
     if isinstance(pattern_set, List):
         patterns = pattern_set
         keys = None
@@ -94,9 +301,27 @@ def pattern_set_to_metadata_table(
         keys = pattern_set.keys()
     else:
         raise ValueError('pattern_set must be list or dict')
-    return pd.concat(
-            [pattern_to_metadata_table(pattern, wildcard_constraints) for pattern in patterns],
-            keys=keys, names=names, axis=0, sort=False).reset_index(0)
+    if field_dtypes is None:
+        field_dtypes = {}
+    metadata_tables = []
+    for pattern in patterns:
+        pattern_fields = set(re.findall(r'{(.*?)}', pattern))
+        metadata_tables.append(pattern_to_metadata_table(
+                pattern, wildcard_constraints,
+                field_dtypes={k: v for k, v in field_dtypes.items() if k in pattern_fields}))
+    metadata_table = pd.concat(metadata_tables, keys=keys, names=names,
+                               axis=0, sort=False).reset_index(0)
+    # the first column holds the pattern keys (or the original index)
+    field_names = [x for x in metadata_table.columns[1:] if x != 'path']
+    if categorical is True:
+        # as for single patterns, fields with a dtype are not made categorical
+        categorical = [x for x in field_names if x not in field_dtypes]
+    # fields missing from some patterns are kept as concatenated (e.g. int -> float)
+    complete_field_dtypes = {k: v for k, v in field_dtypes.items()
+                             if k in field_names and metadata_table[k].notna().all()}
+    return compact_metadata_table(metadata_table, field_names, categorical=categorical,
+                                  field_dtypes=complete_field_dtypes,
+                                  path_representation=path_representation)
 
 
 def recursive_itemgetter(data_structure, keys):
@@ -107,30 +332,125 @@ def recursive_itemgetter(data_structure, keys):
     return curr_data_structure
 
 
-def copy_report_files_to_report_dir(metadata_table, root_dir, report_dir):
-    metadata_table['rel_report_dir_path'] = metadata_table.path.str.replace(
-            root_dir + '/', '')
-    for unused_idx, row_ser in metadata_table.iterrows():
-        # print(row_ser.rel_report_dir_path)
-        output_fp = report_dir + '/' + row_ser.rel_report_dir_path
-        Path(output_fp).parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy(row_ser.path, output_fp)
-        # print('also downloading pdf')
-        shutil.copy(row_ser.path.replace('.png', '.pdf'), output_fp.replace('.png', '.pdf'))
+def copy_report_files_to_report_dir(metadata_table, root_dir, report_dir,
+                                    optimize_images: bool = False,
+                                    deduplicate: bool = False,
+                                    storage: Optional[Storage] = None,
+                                    report_storage: Optional[Storage] = None,
+                                    sibling_formats: Sequence[str] = ('pdf',),
+                                    skip_unchanged: bool = False):
+    """Copy files (and existing sibling formats) below root_dir to the same relative path in report_dir
+
+    Siblings (by default the pdf for each figure) are copied if they exist;
+    existence is checked with one directory listing per figure directory,
+    see SiblingResolver.
 
+    Adds the column 'rel_report_dir_path' to the metadata table.
 
-def convert_metadata_table_to_report_json(metadata_table, section_cols):
+    Files are read from storage (default: local filesystem) and written to
+    report_storage (default: LocalStorage rooted at report_dir, keys are
+    paths relative to the report dir), with concurrent transfers, see
+    figure_report.storage. If skip_unchanged, local files already staged
+    with the same size and mtime are not copied again, see copy_many.
+
+    If deduplicate, files are instead stored once per content hash in the
+    AssetStore in report_dir/assets (see figure_report.assets), and
+    'rel_report_dir_path' points to the hashed location. This requires local
+    storages.
+
+    If optimize_images, the staged PNGs and SVGs are losslessly recompressed
+    or minified (see figure_report.optimize) and the ImageOptimizationSummary
+    is returned. This requires a local report_storage.
+    """
+    if optimize_images:
+        if report_storage is None:
+            optimize_dir = report_dir
+        elif isinstance(report_storage, LocalStorage) and report_storage.root:
+            optimize_dir = report_storage.root
+        else:
+            raise ValueError('optimize_images is only supported for a local report_storage '
+                             'with a root directory')
+    paths = get_paths(metadata_table)
+    if deduplicate:
+        if storage is not None or report_storage is not None:
+            raise ValueError('deduplicate is only supported for local storage')
+        asset_store = AssetStore(report_dir)
+        sibling_suffixes = ['.' + fmt for fmt in sibling_formats]
+        stored_paths = {}
+        for path in paths:
+            if path not in stored_paths:
+                stored_paths[path] = asset_store.put(path, sibling_suffixes=sibling_suffixes)
+        metadata_table['rel_report_dir_path'] = paths.map(stored_paths)
+    else:
+        metadata_table['rel_report_dir_path'] = paths.str.replace(
+                root_dir + '/', '')
+        sibling_resolver = SiblingResolver(sibling_formats, storage=storage)
+        sibling_resolver.prefetch(paths)
+        key_pairs = []
+        for path, rel_report_dir_path in zip(paths, metadata_table['rel_report_dir_path']):
+            key_pairs.append((path, rel_report_dir_path))
+            for fmt, sibling in sibling_resolver.resolve(path):
+                if sibling != path:
+                    key_pairs.append((sibling, sibling_path(rel_report_dir_path, fmt)))
+        copy_many(storage if storage is not None else LocalStorage(),
+                  report_storage if report_storage is not None else LocalStorage(root=report_dir),
+                  key_pairs, skip_unchanged=skip_unchanged)
+    if optimize_images:
+        return optimize_report_images(optimize_dir)
+
+
+def convert_metadata_table_to_report_json(metadata_table, section_cols,
+                                          facet_cols: Optional[List[str]] = None,
+                                          max_figures_per_section: Optional[int] = None):
+    """Nest figures in sections according to section_cols
+
+    Args:
+        metadata_table: e.g. from pattern_set_to_metadata_table
+        section_cols: one heading level per column
+        facet_cols: values of these columns are added to each figure as
+            'facets', used for the client-side facet filter of the page
+            (see figure_report.facets)
+        max_figures_per_section: only keep the first rows of each section,
+            before conversion, e.g. for preview builds (see figure_report.preview)
+    """
+    if max_figures_per_section is not None:
+        metadata_table = sample_sections(metadata_table, section_cols,
+                                         max_figures_per_section)
     if 'rel_report_dir_path' in metadata_table:
-        path_column = 'rel_report_dir_path'
+        paths = metadata_table['rel_report_dir_path']
     else:
-        path_column = 'path'
+        paths = get_paths(metadata_table)
     nested_defaultdict = lambda: defaultdict(nested_defaultdict)
     report_config = nested_defaultdict()
-    for unused_idx, row_ser in metadata_table.iterrows():
+    for (unused_idx, row_ser), path in zip(metadata_table.iterrows(), paths):
         section_keys = row_ser.copy().loc[section_cols].dropna()
         section_dict = recursive_itemgetter(report_config, section_keys)
         if not 'figures' in section_dict:
             section_dict['figures'] = []
-        section_dict['figures'].append({'path': row_ser[path_column]})
-    return report_config
+        figure_dict = {'path': path}
+        if facet_cols:
+            facets = row_ser.loc[facet_cols].dropna()
+            # numpy scalars -> python scalars, for json serialization
+            figure_dict['facets'] = {field: value.item() if hasattr(value, 'item') else value
+                                     for field, value in facets.items()}
+        section_dict['figures'].append(figure_dict)
+    # plain dicts can be pickled, e.g. for parallel page generation
+    return _defaultdict_to_dict(report_config)
+
+
+def sample_sections(metadata_table: pd.DataFrame, section_cols: List[str],
+                    max_figures: int) -> pd.DataFrame:
+    """First max_figures rows of each section, in the original row order
+
+    Rows with missing values in the lower section_cols belong to the parent
+    section, as in convert_metadata_table_to_report_json.
+    """
+    return metadata_table.groupby(list(section_cols), sort=False, dropna=False,
+                                  observed=True).head(max_figures)
+
+
+def _defaultdict_to_dict(nested_dict):
+    if isinstance(nested_dict, dict):
+        return {k: _defaultdict_to_dict(v) for k, v in nested_dict.items()}
+    return nested_dict
 
@@ -0,0 +1,49 @@
+"""Preview builds: check the page structure of large reports in seconds
+
+A preview page keeps at most max_figures figures per section (the first ones,
+in config order) and per grid figure, shows Vega specs as links instead of
+embedding them, and carries a banner saying so. Report.generate(preview=n)
+additionally skips reading image sizes, building grid atlases and looking up
+download siblings; the pattern pipeline samples the metadata table before
+conversion and links the original files instead of copying them (see
+convert_metadata_table_to_report_json and the --preview option of the cli).
+"""
+from figure_report.atlas import GRID_STR
+from figure_report.interactive_grid import INTERACTIVE_GRID_STR
+
+# cli preview builds go to '<output_dir>_preview', next to the report
+PREVIEW_DIR_SUFFIX = '_preview'
+
+
+def preview_page_config(page_config: dict, max_figures: int) -> dict:
+    """Copy of page_config with at most max_figures figures per section
+
+    Grid members are truncated in the same way, and Vega json figures are
+    marked with 'embed': False, see EmbeddedPlotFile.
+    """
+    if max_figures < 1:
+        raise ValueError(f'max_figures must be at least 1, got {max_figures}')
+    preview_config = {}
+    for key, value in page_config.items():
+        if key == 'figures':
+            value = [_preview_figure_config(x, max_figures) for x in value[:max_figures]]
+        elif isinstance(value, dict):
+            value = preview_page_config(value, max_figures)
+        preview_config[key] = value
+    return preview_config
+
+
+def _preview_figure_config(figure_config: dict, max_figures: int) -> dict:
+    figure_config = dict(figure_config)
+    for members_key in (GRID_STR, INTERACTIVE_GRID_STR):
+        if members_key in figure_config:
+            figure_config[members_key] = figure_config[members_key][:max_figures]
+    if figure_config.get('path', '').endswith('.json'):
+        figure_config['embed'] = False
+    return figure_config
+
+
+def preview_banner_html(max_figures: int) -> str:
+    return (f'<div class="preview-banner">Preview: at most {max_figures} figure(s) '
+            'per section, Vega plots are not embedded. '
+            'This is not the complete report.</div>')
@@ -1,39 +1,216 @@
+import hashlib
+import json
+import os
 import re
 import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from textwrap import dedent
-from typing import List, Tuple, Optional, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from figure_report.analyze import analyze_report, check_budgets
+from figure_report.atlas import (GRID_STR, DEFAULT_TILE_SIZE, AtlasGrid, AtlasResolver,
+                                 AtlasTile, atlases_available)
+from figure_report.compress import precompress_dir
+from figure_report.offline import REGISTER_SERVICE_WORKER_HTML, install_service_worker
+from figure_report.preview import preview_banner_html, preview_page_config
+from figure_report.facets import FACETS_STR, build_facet_index, facet_filter_html
+from figure_report.interactive_grid import INTERACTIVE_GRID_STR, InteractiveGrid
+from figure_report.dimensions import IMAGE_SIZE_CACHE_NAME, ImageSize, ImageSizeResolver
+from figure_report.siblings import SiblingResolver, DEFAULT_DOWNLOAD_FORMATS
 
 DESCRIPTION_STR = 'description'
 FIGURE_STR = 'figures'
+SHARED_ASSETS = ['tocbot.css', 'viewer.css', 'tocbot.min.js', 'facets.js',
+                 'interactive_grid.js']
+# page name -> page config hash of the last build, used for incremental builds
+BUILD_STATE_NAME = '.figure_report_build.json'
+# number of figure html fragments kept in memory across builds
+FRAGMENT_CACHE_SIZE = 100_000
+# stands in for the figure id in cached fragments, see FigureNode
+FIG_ID_PLACEHOLDER = '__figure_report_fig_id__'
+VEGA_SCRIPTS_HTML = '''\
+<!-- Import Vega 3 & Vega-Lite 2 (does not have to be from CDN) -->
+    <script src="https://cdn.jsdelivr.net/npm/vega@3"></script>
+    <script src="https://cdn.jsdelivr.net/npm/vega-lite@2"></script>
+     <!--Import vega-embed -->
+    <script src="https://cdn.jsdelivr.net/npm/vega-embed@3"></script>'''
 
-print('reloaded')
 
 class Report:
     """Multi-page report"""
     def __init__(self, report_config: dict):
         """Mapping page_name to page_content"""
         self.report_config = report_config
-    def generate(self, output_dir: Union[str, Path]):
+    def generate(self, output_dir: Union[str, Path],
+                 pages: Optional[List[str]] = None,
+                 precompress: bool = False,
+                 n_jobs: int = 1,
+                 download_formats: Optional[Sequence[str]] = DEFAULT_DOWNLOAD_FORMATS,
+                 image_sizes: bool = True,
+                 service_worker: bool = False,
+                 budgets: Optional[Dict[str, float]] = None,
+                 preview: Optional[int] = None):
+        """Write one html file per page, and the shared css/js files
+
+        Args:
+            output_dir: created if necessary
+            pages: only (re)generate these pages, default: all pages
+            precompress: write .gz (and .br, if brotli is installed) siblings
+                for all text assets in output_dir, see figure_report.compress
+            n_jobs: generate pages in this many processes
+            download_formats: candidate formats for the download links of each
+                figure; only formats which exist next to the figure are linked
+                (relative paths are resolved against output_dir), with one
+                directory listing per figure directory, see SiblingResolver.
+                None: always link png, pdf and svg.
+            image_sizes: emit the intrinsic size of each image (read from the
+                file headers in parallel, cached by path, size and mtime in
+                output_dir), so that browsers can reserve space before the
+                images are loaded, see figure_report.dimensions
+
+            service_worker: pages register a service worker which caches the
+                assets of output_dir in the browser and only fetches changed
+                assets on repeat visits, see figure_report.offline
+            budgets: size and cost limits for the generated pages, e.g.
+                {'page_asset_bytes': 200e6}, see figure_report.analyze
+            preview: build preview pages with at most this many figures per
+                section and without Vega embedding, marked with a banner.
+                Image sizes, grid atlases and download siblings are skipped.
+                See figure_report.preview.
+
+        Raises:
+            BudgetExceededError: if the generated pages exceed the budgets
+
+        Grid figures ({'grid': [path, ...]}) are shown as tiles of atlas images,
+        which are (re)built in n_jobs processes if members changed, see
+        figure_report.atlas. Without Pillow, grid members are shown as
+        individual images.
+        """
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
-        for curr_file in ['tocbot.css', 'viewer.css', 'tocbot.min.js']:
-            curr_file_fp = Path(__file__).parent.joinpath(curr_file)
-            shutil.copy(curr_file_fp,
-                        output_dir / curr_file)
-        for page_name, page_config in self.report_config.items():
-            # Pop the ReportPage keyword args BEFORE passing the remaining
-            # config to FigureCollection
-            toc_headings = page_config.pop('toc_headings')
-            autocollapse_depth = page_config.pop('autocollapse_depth')
-            page_html = ReportPage(
-                    figure_collection_html=(FigureCollection(page_config)
-                                            .generate_html()),
-                    toc_headings=toc_headings,
-                    autocollapse_depth=autocollapse_depth,
-            ).expand_all_fields()
-            output_dir.joinpath(page_name + '.html').write_text(page_html)
-
+        copy_shared_assets(output_dir)
+        page_items = [(page_name, page_config)
+                      for page_name, page_config in self.report_config.items()
+                      if pages is None or page_name in pages]
+        if preview is not None:
+            page_items = [(page_name, preview_page_config(page_config, preview))
+                          for page_name, page_config in page_items]
+            download_formats = None
+            image_sizes = False
+        sibling_resolver = (SiblingResolver(download_formats, base_dir=output_dir)
+                            if download_formats is not None else None)
+        size_resolver = None
+        if image_sizes:
+            size_resolver = ImageSizeResolver(
+                    base_dir=output_dir, cache_path=output_dir / IMAGE_SIZE_CACHE_NAME)
+            # read all headers here, so that page workers start with a full cache
+            size_resolver.prefetch(path for unused_name, page_config in page_items
+                                   for path in iter_figure_paths(page_config))
+        atlas_resolver = None
+        if preview is None and atlases_available():
+            atlas_resolver = AtlasResolver(output_dir, n_jobs=n_jobs)
+            atlas_resolver.prefetch(figure_config for unused_name, page_config in page_items
+                                    for figure_config in iter_figure_configs(page_config)
+                                    if GRID_STR in figure_config)
+        if n_jobs > 1 and len(page_items) > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(write_page, [output_dir] * len(page_items),
+                                  *zip(*page_items),
+                                  [sibling_resolver] * len(page_items),
+                                  [size_resolver] * len(page_items),
+                                  [atlas_resolver] * len(page_items),
+                                  [service_worker] * len(page_items),
+                                  [preview] * len(page_items)))
+        else:
+            for page_name, page_config in page_items:
+                write_page(output_dir, page_name, page_config, sibling_resolver,
+                           size_resolver, atlas_resolver, service_worker, preview)
+        if size_resolver is not None:
+            size_resolver.save()
+        if service_worker:
+            install_service_worker(output_dir)
+        if precompress:
+            precompress_dir(output_dir)
+        if budgets is not None:
+            # all pages, not only the regenerated ones, count for report budgets
+            check_budgets(analyze_report(output_dir, existing_pages(output_dir,
+                                                                    self.report_config)),
+                          budgets)
+
+
+def existing_pages(output_dir: Path, report_config: dict) -> List[str]:
+    """Names of the pages of report_config which have been written to output_dir"""
+    return [page_name for page_name in report_config
+            if output_dir.joinpath(page_name + '.html').exists()]
+
+
+def copy_shared_assets(output_dir: Path):
+    for curr_file in SHARED_ASSETS:
+        curr_file_fp = Path(__file__).parent.joinpath(curr_file)
+        # copy2 keeps the mtime, so that precompressed copies stay up to date
+        shutil.copy2(curr_file_fp,
+                     output_dir / curr_file)
+
+
+def page_config_hash(page_config: dict) -> str:
+    return hashlib.sha256(
+            json.dumps(page_config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def iter_figure_configs(page_config: dict):
+    """Yield the config of each figure in a page config"""
+    for key, value in page_config.items():
+        if key == FIGURE_STR:
+            yield from value
+        elif isinstance(value, dict):
+            yield from iter_figure_configs(value)
+
+
+def iter_figure_paths(page_config: dict):
+    """Yield the path of each single-file figure in a page config"""
+    for figure_config in iter_figure_configs(page_config):
+        if 'path' in figure_config:
+            yield figure_config['path']
+
+
+def write_page(output_dir: Path, page_name: str, page_config: dict,
+               sibling_resolver: Optional[SiblingResolver] = None,
+               size_resolver: Optional[ImageSizeResolver] = None,
+               atlas_resolver: Optional[AtlasResolver] = None,
+               service_worker: bool = False,
+               preview: Optional[int] = None):
+    """Write html file for a single page of the report config
+
+    The page is written to a temporary file first and then moved into place,
+    so that concurrent readers and workers never see partial pages.
+
+    With preview (max. figures per section, see Report.generate), the page
+    gets a preview banner and does not load the Vega libraries; the page
+    config is expected to be reduced with preview_page_config already.
+    """
+    # Pop the ReportPage keyword args BEFORE passing the remaining
+    # config to FigureCollection; work on a copy so that the report
+    # can be generated repeatedly
+    page_config = dict(page_config)
+    toc_headings = page_config.pop('toc_headings')
+    autocollapse_depth = page_config.pop('autocollapse_depth')
+    figure_collection = FigureCollection(page_config, sibling_resolver, size_resolver,
+                                         atlas_resolver)
+    page_html = ReportPage(
+            figure_collection_html=figure_collection.generate_html(),
+            toc_headings=toc_headings,
+            autocollapse_depth=autocollapse_depth,
+            facet_html=facet_filter_html(figure_collection.facet_index()),
+            service_worker_html=REGISTER_SERVICE_WORKER_HTML if service_worker else '',
+            vega_scripts_html=VEGA_SCRIPTS_HTML if preview is None else '',
+            preview_html=preview_banner_html(preview) if preview is not None else '',
+    ).expand_all_fields()
+    tmp_path = output_dir.joinpath(f'.{page_name}.html.{uuid.uuid4().hex}.tmp')
+    tmp_path.write_text(page_html)
+    os.replace(tmp_path, output_dir.joinpath(page_name + '.html'))
 
 
 class ReportPage:
@@ -48,13 +225,23 @@ class ReportPage:
     Args:
         figure_box_html: Code for displaying the figures in the main
             body of the page
+        facet_html: facet filter UI, see figure_report.facets
+        service_worker_html: service worker registration, see figure_report.offline
+        vega_scripts_html: script tags loading Vega, Vega-Lite and Vega-Embed
+        preview_html: preview banner, see figure_report.preview
     """
 
     html = Path(__file__).parent.joinpath('report_page_template.html').read_text()
 
     def __init__(self, figure_collection_html: Optional[str]=None,
-                 toc_headings='h1, h2, h3', autocollapse_depth=2):
+                 toc_headings='h1, h2, h3', autocollapse_depth=2,
+                 facet_html='', service_worker_html='',
+                 vega_scripts_html=VEGA_SCRIPTS_HTML, preview_html=''):
         self.figure_box_html = figure_collection_html
+        self.facet_html = facet_html
+        self.service_worker_html = service_worker_html
+        self.vega_scripts_html = vega_scripts_html
+        self.preview_html = preview_html
         self.toc_headings = toc_headings
         self.autocollapse_depth = autocollapse_depth
 
@@ -73,8 +260,10 @@ class ReportPage:
         filled_html = self.html
         for curr_field in fields:
             if curr_field is not None:
+                # function replacement: backslashes in the value are kept as is
+                value = str(getattr(self, curr_field))
                 filled_html = re.sub(rf'\${curr_field}\$',
-                                     getattr(self, curr_field),
+                                     lambda unused_match: value,
                                      filled_html)
             else:
                 raise ValueError('Missing definition for field: ', curr_field)
@@ -88,12 +277,27 @@ class FigureCollection:
             See help for details.
     """
 
-    def __init__(self, figure_config: dict):
+    def __init__(self, figure_config: dict,
+                 sibling_resolver: Optional[SiblingResolver] = None,
+                 size_resolver: Optional[ImageSizeResolver] = None,
+                 atlas_resolver: Optional[AtlasResolver] = None):
         self.figure_config = figure_config
+        # if given, only existing download formats are linked
+        self.sibling_resolver = sibling_resolver
+        # if given, intrinsic image sizes are added to the img tags
+        self.size_resolver = size_resolver
+        # if given, grid figures are shown as atlas tiles
+        self.atlas_resolver = atlas_resolver
         # Used to ensure that there are no duplicate ids
         self.heading_ids = []
+        self._heading_id_set = set()
         # Used to generate unique ids (incremental IDs)
         self.figure_uids = []
+        # Built once from the config, see build_tree
+        self.tree: Optional[List[SectionNode]] = None
+        # see facet_index
+        self._facet_index: Optional[dict] = None
+        self._facet_index_built = False
 
     # Future improvements: more constructors
     # def from_patterns(self):
@@ -112,48 +316,99 @@ class FigureCollection:
         self.figure_uids.append(uid)
         return uid
 
-    def generate_html(self):
+    def build_tree(self) -> List['SectionNode']:
+        """Parse the figure config into a tree of nodes (only once)
+
+        Output formats work on the tree instead of re-parsing the config.
+        """
+        if self.tree is not None:
+            return self.tree
 
-        def parse_dict(html_list_ref: List[str],
-                       section_dict: dict,
-                       outer_headings: List[Tuple[str, int]]):
+        def parse_dict(section_dict: dict,
+                       outer_headings: List[str]) -> List[SectionNode]:
+            sections = []
             for curr_heading, curr_content in section_dict.items():
-                inner_headings = outer_headings + [(curr_heading,
-                                                        len(html_list_ref))]
-                html_list_ref.append(self._gen_html_heading_text_with_id(
-                    inner_headings))
+                inner_headings = outer_headings + [curr_heading]
+                section = SectionNode(heading=curr_heading,
+                                      heading_id=self._gen_heading_id(inner_headings),
+                                      level=len(inner_headings))
                 for curr_key, curr_value in curr_content.items():
                     if curr_key == DESCRIPTION_STR:
-                        html_list_ref.append(f'<p>{curr_value}<p>')
+                        section.children.append(DescriptionNode(curr_value))
                     elif curr_key == FIGURE_STR:
                         for figure_config_dict in curr_value:
-                            html_list_ref.append(
-                                EmbeddedFigure(fig_id=self.generate_fig_uid(),
-                                               config_dict=figure_config_dict).get_html())
+                            section.children.append(
+                                FigureNode(fig_id=self.generate_fig_uid(),
+                                           config=figure_config_dict))
                     else:
-                        parse_dict(html_list_ref,
-                                   {curr_key: curr_value},
-                                   inner_headings)
+                        section.children.extend(
+                            parse_dict({curr_key: curr_value}, inner_headings))
+                sections.append(section)
+            return sections
+
+        self.tree = parse_dict(self.figure_config, outer_headings=[])
+        return self.tree
+
+    def iter_nodes(self):
+        """Yield all nodes in document order"""
+        def iter_section(section):
+            yield section
+            for child in section.children:
+                if isinstance(child, SectionNode):
+                    yield from iter_section(child)
+                else:
+                    yield child
+        for section in self.build_tree():
+            yield from iter_section(section)
 
-        html_list = []
-        parse_dict(html_list, self.figure_config,
-                   outer_headings=[])
-        return '\n'.join(html_list)
-
-    def _gen_html_heading_text_with_id(self, headings):
-
-        heading_id = ('_'.join([x[0] for x in headings])
+    def generate_html(self):
+        nodes = list(self.iter_nodes())
+        figure_nodes = [x for x in nodes if isinstance(x, FigureNode)]
+        file_nodes = [x for x in figure_nodes if 'path' in x.config]
+        if self.sibling_resolver is not None:
+            self.sibling_resolver.prefetch(x.config['path'] for x in file_nodes)
+            for node in file_nodes:
+                node.download_links = tuple(self.sibling_resolver.resolve(node.config['path']))
+        if self.size_resolver is not None:
+            self.size_resolver.prefetch(x.config['path'] for x in file_nodes)
+            for node in file_nodes:
+                node.intrinsic_size = self.size_resolver.get(node.config['path'])
+        if self.atlas_resolver is not None:
+            grid_nodes = [x for x in figure_nodes if GRID_STR in x.config]
+            self.atlas_resolver.prefetch(x.config for x in grid_nodes)
+            for node in grid_nodes:
+                node.atlas_tiles = self.atlas_resolver.get(node.config)
+        if self.facet_index() is None:
+            return '\n'.join(node.get_html() for node in nodes)
+        # the facet filter shows and hides figures by their position
+        html_parts = []
+        figure_position = 0
+        for node in nodes:
+            if isinstance(node, FigureNode):
+                html_parts.append(f'<div data-fig="{figure_position}">{node.get_html()}</div>')
+                figure_position += 1
+            else:
+                html_parts.append(node.get_html())
+        return '\n'.join(html_parts)
+
+    def facet_index(self) -> Optional[dict]:
+        """Facet index over the figures in document order, see build_facet_index"""
+        if not self._facet_index_built:
+            self._facet_index = build_facet_index([node.config.get(FACETS_STR)
+                                                   for node in self.iter_nodes()
+                                                   if isinstance(node, FigureNode)])
+            self._facet_index_built = True
+        return self._facet_index
+
+    def _gen_heading_id(self, headings: List[str]) -> str:
+        heading_id = ('_'.join(headings)
                       .replace(' ', '-'))
-        if heading_id in self.heading_ids:
+        if heading_id in self._heading_id_set:
             raise ValueError('Same hierarchy of headings at two places')
         self.heading_ids.append(heading_id)
+        self._heading_id_set.add(heading_id)
+        return heading_id
 
-        level = len(headings)
-        curr_heading = headings[-1][0]
-        if level <= 6:
-            return f'<h{level} id="{heading_id}">{curr_heading}</h{level}>'
-        else:
-            return f'<strong id="{heading_id}">{curr_heading}</strong>'
 
     # Future improvements: other output formats
     # def as_dataframe(self):
@@ -172,11 +427,100 @@ class FigureCollection:
     # def check_presence_of_all_figures(self):
     #     pass
 
+
+class SectionNode:
+    """Section of the figure tree: a heading and its child nodes
+
+    children are SectionNodes, DescriptionNodes and FigureNodes, in
+    document order. get_html only renders the heading.
+    """
+    __slots__ = ('heading', 'heading_id', 'level', 'children', '_html')
+
+    def __init__(self, heading: str, heading_id: str, level: int):
+        self.heading = heading
+        self.heading_id = heading_id
+        self.level = level
+        self.children = []
+        self._html = None
+
+    def get_html(self) -> str:
+        if self._html is None:
+            if self.level <= 6:
+                self._html = (f'<h{self.level} id="{self.heading_id}">'
+                              f'{self.heading}</h{self.level}>')
+            else:
+                self._html = f'<strong id="{self.heading_id}">{self.heading}</strong>'
+        return self._html
+
+
+class DescriptionNode:
+    """Description text of a section"""
+    __slots__ = ('text', '_html')
+
+    def __init__(self, text: str):
+        self.text = text
+        self._html = None
+
+    def get_html(self) -> str:
+        if self._html is None:
+            self._html = f'<p>{self.text}<p>'
+        return self._html
+
+
+class FigureNode:
+    """Figure of a section, see EmbeddedFigure
+
+    The rendered fragment is cached by the node, and across builds in
+    render_figure_fragment, keyed by the config content (and resolved links,
+    size and tiles) only; the figure id is filled in afterwards. After a
+    small config change, e.g. inserting a figure, which renumbers all later
+    figures, only changed figures are rendered again.
+    """
+    __slots__ = ('fig_id', 'config', 'download_links', 'intrinsic_size', 'atlas_tiles',
+                 '_html')
+
+    def __init__(self, fig_id: str, config: dict):
+        self.fig_id = fig_id
+        self.config = config
+        # set by FigureCollection if a SiblingResolver is used
+        self.download_links: Optional[Tuple[Tuple[str, str], ...]] = None
+        # set by FigureCollection if an ImageSizeResolver is used
+        self.intrinsic_size: Optional[ImageSize] = None
+        # set by FigureCollection for grid figures if an AtlasResolver is used
+        self.atlas_tiles: Optional[Tuple[AtlasTile, ...]] = None
+        self._html = None
+
+    @property
+    def content_key(self) -> str:
+        return json.dumps(self.config, sort_keys=True, default=str)
+
+    def get_html(self) -> str:
+        if self._html is None:
+            self._html = render_figure_fragment(self.content_key, self.download_links,
+                                                self.intrinsic_size, self.atlas_tiles
+                                                ).replace(FIG_ID_PLACEHOLDER, self.fig_id)
+        return self._html
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def render_figure_fragment(config_json: str,
+                           download_links: Optional[Tuple[Tuple[str, str], ...]] = None,
+                           intrinsic_size: Optional[ImageSize] = None,
+                           atlas_tiles: Optional[Tuple[AtlasTile, ...]] = None) -> str:
+    """Figure html with FIG_ID_PLACEHOLDER in place of the figure id"""
+    return EmbeddedFigure(fig_id=FIG_ID_PLACEHOLDER, config_dict=json.loads(config_json),
+                          download_links=download_links,
+                          intrinsic_size=intrinsic_size,
+                          atlas_tiles=atlas_tiles).get_html()
+
+
 class EmbeddedFigure:
     """One Figure entity within the figure collection
 
     Besides simple EmbeddedPlotFiles, this may also include more complex
-    figure objects, such as Grids and InteractiveGrids
+    figure objects: Grids ({'grid': [...]}, see figure_report.atlas) and
+    InteractiveGrids ({'interactive_grid': [...]}, see
+    figure_report.interactive_grid)
 
     Args:
         fig_id: used for referencing the div where the entire figure
@@ -185,13 +529,39 @@ class EmbeddedFigure:
         config_dict: config for figure object, may be single plot,
             or collection of plots
     """
-    def __init__(self, fig_id: str, config_dict: dict):
+    def __init__(self, fig_id: str, config_dict: dict,
+                 download_links: Optional[Sequence[Tuple[str, str]]] = None,
+                 intrinsic_size: Optional[ImageSize] = None,
+                 atlas_tiles: Optional[Sequence[AtlasTile]] = None):
+        """
+        Args:
+            download_links: (format, path) for each download link, e.g. from
+                SiblingResolver.resolve. Default: png, pdf and svg links derived
+                from the path, whether they exist or not.
+            intrinsic_size: see EmbeddedPlotFile
+            atlas_tiles: tiles of a grid figure, from AtlasResolver.get.
+                Default: one img per grid member.
+        """
         self.fig_id = fig_id
         self.config_dict = config_dict
+        self.download_links = download_links
+        self.intrinsic_size = intrinsic_size
+        self.atlas_tiles = atlas_tiles
     def get_html(self):
+        if GRID_STR in self.config_dict:
+            return self._get_grid_html()
+        if INTERACTIVE_GRID_STR in self.config_dict:
+            grid_config = {k: v for k, v in self.config_dict.items() if k != FACETS_STR}
+            return f'<div>{InteractiveGrid(self.fig_id, **grid_config).get_html()}</div>\n'
         # This simplified implementation will be changed
+        plot_file_config = {k: v for k, v in self.config_dict.items() if k != FACETS_STR}
         figure_html = EmbeddedPlotFile(fig_id=self.fig_id,
-                                       **self.config_dict).get_html()
+                                       intrinsic_size=self.intrinsic_size,
+                                       **plot_file_config).get_html()
+        if self.download_links is not None:
+            links_html = ''.join(f'<a href="{path}" download>{fmt}</a>\n'
+                                 for fmt, path in self.download_links)
+            return f'<div>{figure_html}</div>\n<div>\n{links_html}</div>\n'
         pdf_path = self.config_dict['path'].replace('.png', '.pdf')
         svg_path = self.config_dict['path'].replace('.png', '.svg')
         return f'''\
@@ -203,6 +573,19 @@ class EmbeddedFigure:
 </div>
         '''
 
+    def _get_grid_html(self):
+        grid_config = {k: v for k, v in self.config_dict.items() if k != FACETS_STR}
+        member_paths = grid_config.pop(GRID_STR)
+        if self.atlas_tiles is not None:
+            grid_html = AtlasGrid(self.fig_id, self.atlas_tiles, **grid_config).get_html()
+            return f'<div>{grid_html}</div>\n'
+        tile_width = grid_config.get('tile_width', DEFAULT_TILE_SIZE)
+        tile_height = grid_config.get('tile_height', DEFAULT_TILE_SIZE)
+        img_lines = ''.join(f'<a href="{x}"><img src="{x}" loading="lazy" style="max-width:'
+                            f'{tile_width}px;max-height:{tile_height}px"></a>\n'
+                            for x in member_paths)
+        return f'<div id="{self.fig_id}" class="atlas-grid">\n{img_lines}</div>\n'
+
 class EmbeddedPlotFile:
     """Figure containing a single plot file
 
@@ -215,12 +598,19 @@ class EmbeddedPlotFile:
             (potentially consisting of subplots) is contained. This is
             e.g. important for Vega-Embed, which needs a target div
         json_type: currently only 'vega' allowed
+        intrinsic_size: size of the image file, e.g. from ImageSizeResolver.
+            Used for width and height if neither is given, and for the
+            aspect ratio if only one is given.
+        embed: if False, json specs are shown as a link instead of being
+            embedded, e.g. in preview builds
     """
     known_file_types = ['.png', '.jpeg', '.svg', '.json']
     def __init__(self, fig_id, path, title=None, description=None,
                  width=None, height=None,
-                 json_type='vega'):
+                 json_type='vega', intrinsic_size=None, embed=True):
         self.fig_id = fig_id
+        self.embed = embed
+        self.intrinsic_size = intrinsic_size
         self.json_type = json_type
         self.height = height
         self.width = width
@@ -238,6 +628,14 @@ class EmbeddedPlotFile:
         if self.filetype != '.json':
             width_str = f'width={self.width}' if self.width else ''
             height_str = f'height={self.height}' if self.height else ''
+            if self.intrinsic_size is not None:
+                intrinsic_width, intrinsic_height = self.intrinsic_size
+                if not self.width and not self.height:
+                    width_str = f'width={round(intrinsic_width)}'
+                    height_str = f'height={round(intrinsic_height)}'
+                elif not self.width or not self.height:
+                    height_str += (f' style="aspect-ratio: {intrinsic_width:g} / '
+                                   f'{intrinsic_height:g}"')
 
             return dedent(f'''
                 {title_line}
@@ -247,6 +645,12 @@ class EmbeddedPlotFile:
                 {description_line}
                 ''')
         # else: is json, but which type?
+        elif not self.embed:
+            return dedent(f'''
+                {title_line}
+                <p><a href="{self.path}">{self.path}</a> (not embedded)</p>
+                {description_line}
+            ''')
         elif self.json_type == 'vega':
             return dedent(f'''
                 {title_line}
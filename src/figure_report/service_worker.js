@@ -0,0 +1,114 @@
+// Service worker for figure reports, installed by figure_report/offline.py
+//
+// Assets listed in the precache manifest are served from the cache if the
+// cached copy has the current content hash, otherwise they are fetched and
+// cached. The manifest is fetched again on each page load.
+var SCOPE = self.registration.scope;
+var CACHE_NAME = 'figure-report:' + SCOPE;
+var MANIFEST_URL = new URL('precache-manifest.json', SCOPE).href;
+var HASH_HEADER = 'X-Figure-Report-Hash';
+var hashesPromise = null;
+
+function toHashes(manifest) {
+    var hashes = {};
+    Object.keys(manifest.assets).forEach(function (path) {
+        hashes[new URL(path, SCOPE).href] = manifest.assets[path];
+    });
+    return hashes;
+}
+
+function removeStaleEntries(hashes) {
+    return caches.open(CACHE_NAME).then(function (cache) {
+        return cache.keys().then(function (requests) {
+            return Promise.all(requests.filter(function (request) {
+                return request.url !== MANIFEST_URL && !(request.url in hashes);
+            }).map(function (request) {
+                return cache.delete(request);
+            }));
+        });
+    });
+}
+
+function loadHashes() {
+    return fetch(MANIFEST_URL, {cache: 'no-store'}).then(function (response) {
+        if (!response.ok) {
+            throw new Error('manifest not available');
+        }
+        var copy = response.clone();
+        return response.json().then(function (manifest) {
+            var hashes = toHashes(manifest);
+            caches.open(CACHE_NAME).then(function (cache) {
+                return cache.put(MANIFEST_URL, copy);
+            }).then(function () {
+                return removeStaleEntries(hashes);
+            });
+            return hashes;
+        });
+    }).catch(function () {
+        // offline: use the last manifest, and with it the cached assets
+        return caches.open(CACHE_NAME).then(function (cache) {
+            return cache.match(MANIFEST_URL);
+        }).then(function (response) {
+            return response ? response.json().then(toHashes) : {};
+        });
+    });
+}
+
+function fetchAndCache(url, hash, cached) {
+    return fetch(url, {cache: 'no-cache'}).then(function (response) {
+        if (!response.ok) {
+            return response;
+        }
+        var headers = new Headers(response.headers);
+        headers.set(HASH_HEADER, hash);
+        return response.blob().then(function (body) {
+            var stored = new Response(body, {
+                status: response.status, statusText: response.statusText, headers: headers
+            });
+            caches.open(CACHE_NAME).then(function (cache) {
+                return cache.put(url, stored.clone());
+            });
+            return stored;
+        });
+    }).catch(function (error) {
+        if (cached) {
+            return cached;
+        }
+        throw error;
+    });
+}
+
+self.addEventListener('install', function () {
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', function (event) {
+    event.waitUntil(self.clients.claim());
+});
+
+self.addEventListener('fetch', function (event) {
+    var request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    if (request.mode === 'navigate' || hashesPromise === null) {
+        hashesPromise = loadHashes();
+    }
+    var url = new URL(request.url);
+    url.search = '';
+    url.hash = '';
+    event.respondWith(hashesPromise.then(function (hashes) {
+        var hash = hashes[url.href];
+        if (hash === undefined) {
+            return fetch(request);
+        }
+        return caches.open(CACHE_NAME).then(function (cache) {
+            return cache.match(url.href);
+        }).then(function (cached) {
+            if (cached && cached.headers.get(HASH_HEADER) === hash) {
+                return cached;
+            }
+            return fetchAndCache(url.href, hash, cached);
+        });
+    }));
+});
@@ -0,0 +1,270 @@
+"""Sharded report builds by several workers sharing an output directory
+
+Any number of independent workers (processes on one machine, or jobs on
+different cluster nodes with a shared filesystem) call sharded_generate with
+the same report config and output directory. Workers claim pages through lock
+files created with O_CREAT | O_EXCL, write pages atomically, and record each
+finished page with a done marker. The worker which finds all pages done
+claims the merge lock and runs the cheap merge step: shared assets, the build
+state used for incremental builds and optional precompression.
+
+Shard state lives in output_dir/.shard/<build_id>, where build_id is the hash
+of the report config, so that workers of different builds never mix.
+
+Steps which must run only once before the pages are generated, such as
+staging figures into the output directory, are run with run_once: one worker
+runs the step, the others wait for its (json) result.
+
+With stale_after, workers keep the locks they hold alive by touching them,
+wait for the pages claimed by other workers and take over the locks of
+crashed workers, so that the merge runs even if a worker is killed.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from figure_report.analyze import analyze_report, check_budgets
+from figure_report.atlas import AtlasResolver, atlases_available
+from figure_report.compress import precompress_dir
+from figure_report.offline import install_service_worker
+from figure_report.dimensions import IMAGE_SIZE_CACHE_NAME, ImageSizeResolver
+from figure_report.siblings import SiblingResolver, DEFAULT_DOWNLOAD_FORMATS
+from figure_report.report import (BUILD_STATE_NAME, copy_shared_assets,
+                                  page_config_hash, write_page)
+
+# seconds without lock renewal after which the cli takes over a worker's work;
+# held locks are renewed every stale_after / 4 seconds
+DEFAULT_STALE_AFTER = 600.0
+
+
+def _try_create(path: Path, content: str) -> bool:
+    """Atomically create file, return False if it already exists"""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as fout:
+        fout.write(content)
+    return True
+
+
+def _claim(lock_fp: Path, worker_id: str, stale_after: Optional[float]) -> bool:
+    if _try_create(lock_fp, worker_id):
+        return True
+    # locks of crashed workers are broken after stale_after seconds
+    if stale_after is None:
+        return False
+    try:
+        stat = lock_fp.stat()
+    except FileNotFoundError:
+        return _try_create(lock_fp, worker_id)
+    if time.time() - stat.st_mtime <= stale_after:
+        return False
+    # only one of the workers finding the stale lock can rename it away
+    stale_fp = lock_fp.with_name(f'{lock_fp.name}.{uuid.uuid4().hex}.stale')
+    try:
+        os.rename(lock_fp, stale_fp)
+    except FileNotFoundError:
+        return False
+    stale_stat = stale_fp.stat()
+    if (stale_stat.st_ino, stale_stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+        # another worker took over and renewed the lock in the meantime: give
+        # it back. If yet another worker claimed the page meanwhile, the page
+        # is built twice, which is harmless as pages are written atomically.
+        try:
+            os.link(stale_fp, lock_fp)
+        except FileExistsError:
+            pass
+        stale_fp.unlink()
+        return False
+    stale_fp.unlink()
+    return _try_create(lock_fp, worker_id)
+
+
+@contextmanager
+def _keep_alive(lock_fp: Path, stale_after: Optional[float]):
+    """Touch lock_fp regularly while it is held, so that it does not become stale"""
+    if stale_after is None:
+        yield
+        return
+    stop = threading.Event()
+
+    def touch():
+        while not stop.wait(stale_after / 4):
+            try:
+                os.utime(lock_fp)
+            except FileNotFoundError:
+                return
+
+    thread = threading.Thread(target=touch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def get_shard_dir(report_config: dict, output_dir: Union[str, Path]) -> Path:
+    return Path(output_dir) / '.shard' / page_config_hash(report_config)[:16]
+
+
+def run_once(fn: Callable[[], Any], output_dir: Union[str, Path], step_id: str,
+             worker_id: Optional[str] = None, stale_after: Optional[float] = None,
+             poll_interval: float = 1.0) -> Any:
+    """Run fn in only one of the workers sharing output_dir, return its result
+
+    Args:
+        fn: the step, its result must be json serializable
+        output_dir: shared output directory
+        step_id: identifies the step, e.g. a hash of its inputs; all workers
+            must pass the same step_id
+        worker_id: recorded in the lock file, default: hostname:pid
+        stale_after: seconds after which the lock of a step that is not done
+            is considered stale and the step is run again, default: never
+        poll_interval: seconds between checks of the waiting workers
+
+    Returns:
+        the result of fn, from this or another worker
+    """
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    step_dir = Path(output_dir) / '.shard' / 'steps'
+    step_dir.mkdir(parents=True, exist_ok=True)
+    done_fp = step_dir / f'{step_id}.json'
+    while not done_fp.exists():
+        lock_fp = step_dir / f'{step_id}.lock'
+        if _claim(lock_fp, worker_id, stale_after):
+            try:
+                with _keep_alive(lock_fp, stale_after):
+                    result = fn()
+            except BaseException:
+                # let another worker try again
+                lock_fp.unlink()
+                raise
+            tmp_fp = step_dir / f'.{step_id}.{uuid.uuid4().hex}.tmp'
+            tmp_fp.write_text(json.dumps(result))
+            os.replace(tmp_fp, done_fp)
+        else:
+            time.sleep(poll_interval)
+    return json.loads(done_fp.read_text())
+
+
+def sharded_generate(report_config: dict,
+                     output_dir: Union[str, Path],
+                     worker_id: Optional[str] = None,
+                     precompress: bool = False,
+                     stale_after: Optional[float] = None,
+                     download_formats: Optional[Sequence[str]] = DEFAULT_DOWNLOAD_FORMATS,
+                     image_sizes: bool = True,
+                     service_worker: bool = False,
+                     budgets: Optional[Dict[str, float]] = None,
+                     poll_interval: float = 1.0) -> List[str]:
+    """Generate the pages not yet claimed by other workers, merge if all are done
+
+    Args:
+        report_config: the same config for all workers
+        output_dir: shared output directory
+        worker_id: recorded in lock and done files, default: hostname:pid
+        precompress: passed to the merge step, see Report.generate
+        stale_after: seconds after which the lock of a page (or the merge)
+            that is not done is considered stale and may be claimed again.
+            If given, the worker waits until the build is merged, taking over
+            stale locks; otherwise it returns once no page is left to claim,
+            default: never stale
+        download_formats: see Report.generate
+        image_sizes: see Report.generate; the image size cache is shared by
+            all workers
+        service_worker: see Report.generate, installed in the merge step
+        budgets: see Report.generate, checked for all pages in the merge step
+        poll_interval: seconds between checks while waiting for other workers
+
+    Raises:
+        BudgetExceededError: in the merging worker, if the budgets are exceeded
+
+    Returns:
+        names of the pages generated by this worker
+    """
+    output_dir = Path(output_dir)
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    shard_dir = get_shard_dir(report_config, output_dir)
+    lock_dir = shard_dir / 'locks'
+    done_dir = shard_dir / 'done'
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    done_dir.mkdir(parents=True, exist_ok=True)
+    if (shard_dir / 'merged').exists():
+        return []
+
+    sibling_resolver = (SiblingResolver(download_formats, base_dir=output_dir)
+                        if download_formats is not None else None)
+    size_resolver = (ImageSizeResolver(base_dir=output_dir,
+                                       cache_path=output_dir / IMAGE_SIZE_CACHE_NAME)
+                     if image_sizes else None)
+    # workers building the same atlas write identical files atomically
+    atlas_resolver = AtlasResolver(output_dir) if atlases_available() else None
+    generated_pages = []
+    while True:
+        n_generated = len(generated_pages)
+        for page_name, page_config in report_config.items():
+            if (done_dir / page_name).exists():
+                continue
+            lock_fp = lock_dir / page_name
+            if not _claim(lock_fp, worker_id, stale_after):
+                continue
+            with _keep_alive(lock_fp, stale_after):
+                write_page(output_dir, page_name, page_config, sibling_resolver,
+                           size_resolver, atlas_resolver, service_worker)
+            _try_create(done_dir / page_name, worker_id)
+            generated_pages.append(page_name)
+        if size_resolver is not None and len(generated_pages) > n_generated:
+            size_resolver.save()
+
+        if all((done_dir / page_name).exists() for page_name in report_config):
+            merge_lock_fp = shard_dir / 'merge.lock'
+            if _claim(merge_lock_fp, worker_id, stale_after):
+                try:
+                    with _keep_alive(merge_lock_fp, stale_after):
+                        merge_sharded_build(report_config, output_dir,
+                                            precompress=precompress,
+                                            service_worker=service_worker,
+                                            budgets=budgets)
+                except BaseException:
+                    # let another worker merge, unless only the budgets failed
+                    if not (shard_dir / 'merged').exists():
+                        merge_lock_fp.unlink()
+                    raise
+                break
+        if stale_after is None or (shard_dir / 'merged').exists():
+            break
+        time.sleep(poll_interval)
+    return generated_pages
+
+
+def merge_sharded_build(report_config: dict, output_dir: Union[str, Path],
+                        precompress: bool = False, service_worker: bool = False,
+                        budgets: Optional[Dict[str, float]] = None):
+    """Write shared assets and build state once all pages are done
+
+    Raises:
+        BudgetExceededError: if budgets are given and exceeded by the pages
+    """
+    output_dir = Path(output_dir)
+    shard_dir = get_shard_dir(report_config, output_dir)
+    copy_shared_assets(output_dir)
+    page_hashes = {page_name: page_config_hash(page_config)
+                   for page_name, page_config in report_config.items()}
+    output_dir.joinpath(BUILD_STATE_NAME).write_text(json.dumps(page_hashes))
+    if service_worker:
+        install_service_worker(output_dir)
+    if precompress:
+        precompress_dir(output_dir)
+    (shard_dir / 'merged').write_text('')
+    if budgets is not None:
+        check_budgets(analyze_report(output_dir, list(report_config)), budgets)
@@ -0,0 +1,123 @@
+"""Batched discovery of sibling download formats
+
+Figures are usually saved in several formats next to each other
+(fig.png, fig.pdf, fig.svg). Instead of one stat call per candidate sibling,
+SiblingResolver lists each figure directory once, caches the listing, and
+returns only the formats which exist. Listings for many figures can be
+prefetched in parallel.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple, Union
+
+from figure_report.storage import LocalStorage, Storage
+
+DEFAULT_DOWNLOAD_FORMATS = ('png', 'pdf', 'svg')
+
+
+def sibling_path(path: str, fmt: str) -> str:
+    """Path with the suffix replaced by .fmt"""
+    return os.path.splitext(path)[0] + '.' + fmt
+
+
+def is_url(path: str) -> bool:
+    return '://' in path
+
+
+class SiblingResolver:
+    """Find existing sibling formats of figure files with one listing per directory
+
+    Args:
+        formats: candidate formats, in the order in which links are emitted
+        base_dir: relative paths are interpreted relative to this directory,
+            e.g. the report output directory
+        storage: list directories with this Storage instead of os.listdir
+        n_jobs: number of threads for prefetch
+    """
+
+    def __init__(self, formats: Sequence[str] = DEFAULT_DOWNLOAD_FORMATS,
+                 base_dir: Optional[Union[str, os.PathLike]] = None,
+                 storage: Optional[Storage] = None,
+                 n_jobs: int = 8):
+        self.formats = tuple(formats)
+        self.base_dir = str(base_dir) if base_dir is not None else None
+        self.storage = storage
+        self.n_jobs = n_jobs
+        self._listings: Dict[str, FrozenSet[str]] = {}
+
+    def _directory(self, path: str) -> str:
+        directory = os.path.dirname(path)
+        if self.base_dir is not None and not os.path.isabs(path):
+            directory = os.path.join(self.base_dir, directory)
+        return directory or '.'
+
+    def _list(self, directory: str) -> FrozenSet[str]:
+        if isinstance(self.storage, LocalStorage):
+            directory = self.storage._path(directory)
+        elif self.storage is not None:
+            prefix = directory.rstrip('/') + '/'
+            return frozenset(key[len(prefix):] for page in self.storage.list_pages(prefix)
+                             for key in page if '/' not in key[len(prefix):])
+        try:
+            return frozenset(os.listdir(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            return frozenset()
+
+    def listing(self, directory: str) -> FrozenSet[str]:
+        if directory not in self._listings:
+            self._listings[directory] = self._list(directory)
+        return self._listings[directory]
+
+    def prefetch(self, paths: Iterable[str]):
+        """List the directories of all paths in parallel"""
+        directories = {self._directory(x) for x in paths if not is_url(x)}
+        directories = [x for x in directories if x not in self._listings]
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            for directory, listing in zip(directories, executor.map(self._list, directories)):
+                self._listings[directory] = listing
+
+    def refresh(self, path: str):
+        """Update the cached listing for path and its candidate siblings
+
+        For files created after their directory was listed, e.g. figures saved
+        one after another: checks only these files (one exists check each)
+        instead of listing the directory again.
+        """
+        directory = self._directory(path)
+        if directory not in self._listings:
+            # listed on first use
+            return
+        names = set(self._listings[directory])
+        for candidate in [path] + [sibling_path(path, fmt) for fmt in self.formats]:
+            name = os.path.basename(candidate)
+            if self._file_exists(os.path.join(directory, name)):
+                names.add(name)
+            else:
+                names.discard(name)
+        self._listings[directory] = frozenset(names)
+
+    def _file_exists(self, path: str) -> bool:
+        if self.storage is None:
+            return os.path.exists(path)
+        return self.storage.exists(path)
+
+    def invalidate(self, path: Optional[str] = None):
+        """Forget cached listing for the directory of path, or all listings"""
+        if path is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(self._directory(path), None)
+
+    def exists(self, path: str) -> bool:
+        return os.path.basename(path) in self.listing(self._directory(path))
+
+    def resolve(self, path: str) -> List[Tuple[str, str]]:
+        """(format, path) for each candidate format which exists next to path
+
+        URLs can not be listed, for these only the file itself is returned.
+        """
+        if is_url(path):
+            return [(os.path.splitext(path)[1][1:], path)]
+        candidates = [(fmt, sibling_path(path, fmt)) for fmt in self.formats]
+        listing = self.listing(self._directory(path))
+        return [(fmt, x) for fmt, x in candidates if os.path.basename(x) in listing]
@@ -0,0 +1,179 @@
+"""Storage backends for pattern discovery and asset staging
+
+pattern_to_metadata_table, iter_pattern_matches and
+copy_report_files_to_report_dir use the local filesystem by default. They
+accept a Storage instead, so that the same pipeline can target e.g. object
+storage through an adapter. A backend implements paginated listing
+(list_pages), get and put; the base class provides glob-style discovery on
+top of the listing and concurrent transfers through a bounded thread pool,
+which hides per-request latency of remote stores.
+
+Shipped backends: LocalStorage (local filesystem) and InMemoryStorage (tests).
+"""
+import glob
+import os
+import re
+import shutil
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class Storage(ABC):
+    """Base class for storage backends, keys are '/'-separated paths
+
+    Args:
+        max_connections: maximum number of concurrent transfers
+        page_size: number of keys per listing page
+    """
+
+    def __init__(self, max_connections: int = 8, page_size: int = 1000):
+        self.max_connections = max_connections
+        self.page_size = page_size
+
+    @abstractmethod
+    def list_pages(self, prefix: str) -> Iterator[List[str]]:
+        """Yield pages of at most page_size keys starting with prefix"""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        pass
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.get(key)
+        except (KeyError, FileNotFoundError):
+            return False
+        return True
+
+    def glob(self, glob_pattern: str) -> Iterator[str]:
+        """Yield keys matching glob pattern
+
+        Only '*' is supported as wildcard (as used by pattern_to_metadata_table),
+        it does not match across '/'.
+        """
+        prefix = glob_pattern.split('*', 1)[0]
+        regex = re.compile('[^/]*'.join(re.escape(x) for x in glob_pattern.split('*')) + r'\Z')
+        for page in self.list_pages(prefix):
+            yield from (key for key in page if regex.match(key))
+
+    def get_many(self, keys: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+        """Fetch keys concurrently, yield (key, data) in input order"""
+        keys = list(keys)
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            yield from zip(keys, executor.map(self.get, keys))
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]):
+        """Put (key, data) items concurrently"""
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            list(executor.map(lambda item: self.put(*item), items))
+
+
+class LocalStorage(Storage):
+    """Local filesystem; keys are paths, relative to root if given"""
+
+    def __init__(self, root: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        # plain concatenation: absolute keys stay below root
+        return self.root + '/' + key if self.root else key
+
+    def list_pages(self, prefix: str) -> Iterator[List[str]]:
+        start_dir = os.path.dirname(self._path(prefix)) or '.'
+        page = []
+        for curr_dir, unused_dirs, files in os.walk(start_dir):
+            for file_name in files:
+                fp = os.path.join(curr_dir, file_name)
+                key = os.path.relpath(fp, self.root) if self.root else fp
+                if key.startswith(prefix):
+                    page.append(key)
+                    if len(page) == self.page_size:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    def glob(self, glob_pattern: str) -> Iterator[str]:
+        # glob only walks the directories matching the pattern
+        if self.root:
+            yield from (os.path.relpath(x, self.root)
+                        for x in glob.iglob(self._path(glob_pattern)))
+        else:
+            yield from glob.iglob(glob_pattern)
+
+    def get(self, key: str) -> bytes:
+        return Path(self._path(key)).read_bytes()
+
+    def put(self, key: str, data: bytes):
+        fp = Path(self._path(key))
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        fp.write_bytes(data)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def copy_from(self, source: 'LocalStorage', source_key: str, key: str,
+                  skip_unchanged: bool = False):
+        """Copy with file metadata; if skip_unchanged, keep a target with the same size and mtime"""
+        source_fp = source._path(source_key)
+        fp = Path(self._path(key))
+        if skip_unchanged and fp.exists():
+            source_stat, stat = os.stat(source_fp), fp.stat()
+            if (source_stat.st_size, source_stat.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                return
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source_fp, fp)
+
+
+class InMemoryStorage(Storage):
+    """Dict-backed storage for tests"""
+
+    def __init__(self, data: Optional[Dict[str, bytes]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.data = dict(data) if data else {}
+
+    def list_pages(self, prefix: str) -> Iterator[List[str]]:
+        keys = sorted(key for key in self.data if key.startswith(prefix))
+        for start in range(0, len(keys), self.page_size):
+            yield keys[start:start + self.page_size]
+
+    def get(self, key: str) -> bytes:
+        return self.data[key]
+
+    def put(self, key: str, data: bytes):
+        self.data[key] = data
+
+    def exists(self, key: str) -> bool:
+        return key in self.data
+
+
+def copy_many(source: Storage, target: Storage, key_pairs: Iterable[Tuple[str, str]],
+              skip_unchanged: bool = False):
+    """Copy (source_key, target_key) pairs concurrently between storages
+
+    Local to local copies use shutil.copy2, which keeps the mtime, so that
+    with skip_unchanged, targets with the size and mtime of their source are
+    not copied again (e.g. in incremental builds). Everything else streams the
+    data through the bounded connection pools of both storages, in batches of
+    source.page_size files to bound memory usage; skip_unchanged does not
+    apply there.
+    """
+    key_pairs = list(key_pairs)
+    if isinstance(source, LocalStorage) and isinstance(target, LocalStorage):
+        with ThreadPoolExecutor(max_workers=target.max_connections) as executor:
+            list(executor.map(lambda pair: target.copy_from(source, *pair,
+                                                            skip_unchanged=skip_unchanged),
+                              key_pairs))
+        return
+    for start in range(0, len(key_pairs), source.page_size):
+        batch = key_pairs[start:start + source.page_size]
+        fetched = source.get_many(source_key for source_key, unused_target_key in batch)
+        target.put_many((target_key, data) for (unused_key, data), (unused_source_key, target_key)
+                        in zip(fetched, batch))
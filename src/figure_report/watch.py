@@ -0,0 +1,208 @@
+"""Rebuild reports while a pipeline is still writing figures
+
+The watcher monitors the directories behind a set of wildcard patterns,
+using inotify (via the optional inotify_simple package) if available and
+polling otherwise. Bursts of new files are debounced, then the metadata table
+is recomputed and only pages whose config changed are regenerated. Pages
+which this watcher built earlier and which are no longer in the report config
+are removed from the output directory.
+"""
+import glob
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import pandas as pd
+
+from figure_report.patterns import pattern_set_to_metadata_table
+from figure_report.report import Report
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class ReportWatcher:
+    """Regenerate report pages as files matching a set of patterns appear
+
+    Args:
+        pattern_set: list or dict of wildcard patterns, as for
+            pattern_set_to_metadata_table
+        build_report_config: function taking the metadata table and
+            returning the report config (mapping page_name -> page_config),
+            typically using convert_metadata_table_to_report_json
+        output_dir: report output directory
+        names: passed to pattern_set_to_metadata_table
+        wildcard_constraints: passed to pattern_set_to_metadata_table
+        debounce: seconds without new file events before rebuilding
+        poll_interval: seconds between file set checks in polling mode
+        use_inotify: default: use inotify if inotify_simple is installed
+        on_rebuild: optional callback, called with the list of regenerated pages
+    """
+
+    def __init__(self,
+                 pattern_set: Union[List[str], Dict[str, str]],
+                 build_report_config: Callable[[pd.DataFrame], dict],
+                 output_dir: Union[str, Path],
+                 names: Optional[List[str]] = None,
+                 wildcard_constraints: Optional[Dict[str, str]] = None,
+                 debounce: float = 2.0,
+                 poll_interval: float = 5.0,
+                 use_inotify: Optional[bool] = None,
+                 on_rebuild: Optional[Callable[[List[str]], None]] = None):
+        self.pattern_set = pattern_set
+        self.build_report_config = build_report_config
+        self.output_dir = Path(output_dir)
+        self.names = names
+        self.wildcard_constraints = wildcard_constraints
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        if use_inotify is None:
+            use_inotify = inotify_simple is not None
+        elif use_inotify and inotify_simple is None:
+            raise ImportError('use_inotify=True requires the inotify_simple package')
+        self.use_inotify = use_inotify
+        self.on_rebuild = on_rebuild
+        # snapshot of the last build: matched files per pattern, serialized page configs
+        self.file_sets: Dict[str, frozenset] = {}
+        self.page_config_jsons: Dict[str, str] = {}
+
+    @property
+    def patterns(self) -> List[str]:
+        if isinstance(self.pattern_set, dict):
+            return list(self.pattern_set.values())
+        return list(self.pattern_set)
+
+    def get_file_sets(self) -> Dict[str, frozenset]:
+        return {pattern: frozenset(glob.glob(re.sub(r'{(.+?)}', r'*', pattern)))
+                for pattern in self.patterns}
+
+    def get_watch_dirs(self) -> List[str]:
+        """Existing directories in which matching files or their directories may appear
+
+        For each pattern, these are the deepest existing directory above the
+        first wildcard and the directories matching the leading parts of the
+        pattern's directory, e.g. 'data', 'data/*' and 'data/*/plots' for
+        'data/{sample}/plots/{plot}.png'. Unrelated directories are not watched.
+        """
+        watch_dirs = set()
+        for pattern in self.patterns:
+            fixed_dir = Path(pattern.split('{', 1)[0] + 'x').parent
+            n_fixed_parts = len(fixed_dir.parts)
+            while not fixed_dir.exists():
+                fixed_dir = fixed_dir.parent
+            watch_dirs.add(str(fixed_dir))
+            dir_parts = Path(re.sub(r'{(.+?)}', r'*', pattern)).parent.parts
+            for n_parts in range(n_fixed_parts + 1, len(dir_parts) + 1):
+                watch_dirs.update(x for x in glob.glob(str(Path(*dir_parts[:n_parts])))
+                                  if os.path.isdir(x))
+        return sorted(watch_dirs)
+
+    def rebuild(self) -> List[str]:
+        """Regenerate pages whose config changed since the last rebuild
+
+        Pages built by an earlier rebuild which are no longer in the report
+        config are deleted.
+
+        Returns:
+            names of the regenerated pages
+        """
+        file_sets = self.get_file_sets()
+        if file_sets == self.file_sets:
+            return []
+        self.file_sets = file_sets
+
+        # patterns without any matching file yet are skipped, they would
+        # raise in pattern_to_metadata_table
+        if isinstance(self.pattern_set, dict):
+            pattern_set = {k: v for k, v in self.pattern_set.items() if file_sets[v]}
+        else:
+            pattern_set = [x for x in self.pattern_set if file_sets[x]]
+        if pattern_set:
+            metadata_table = pattern_set_to_metadata_table(
+                    pattern_set, names=self.names,
+                    wildcard_constraints=self.wildcard_constraints)
+            report_config = self.build_report_config(metadata_table)
+        else:
+            report_config = {}
+
+        page_config_jsons = {page_name: json.dumps(page_config, sort_keys=True, default=str)
+                             for page_name, page_config in report_config.items()}
+        changed_pages = [page_name for page_name, page_json in page_config_jsons.items()
+                         if self.page_config_jsons.get(page_name) != page_json]
+        if changed_pages:
+            Report(report_config).generate(self.output_dir, pages=changed_pages)
+        for page_name in set(self.page_config_jsons) - set(page_config_jsons):
+            for suffix in ['.html', '.html.gz', '.html.br']:
+                self.output_dir.joinpath(page_name + suffix).unlink(missing_ok=True)
+        self.page_config_jsons = page_config_jsons
+        if self.on_rebuild is not None:
+            self.on_rebuild(changed_pages)
+        return changed_pages
+
+    def watch(self, max_rebuilds: Optional[int] = None):
+        """Rebuild once, then block and rebuild after each debounced burst of changes
+
+        Args:
+            max_rebuilds: stop after this many rebuilds with changed pages,
+                default: run until interrupted
+        """
+        # watches are registered before the first rebuild, so that files
+        # created during the rebuild trigger the next one
+        if self.use_inotify:
+            wait_for_changes = self._inotify_waiter()
+        else:
+            wait_for_changes = self._polling_waiter
+        n_rebuilds = 0
+        if self.rebuild():
+            n_rebuilds += 1
+        while max_rebuilds is None or n_rebuilds < max_rebuilds:
+            wait_for_changes()
+            if self.rebuild():
+                n_rebuilds += 1
+
+    def _polling_waiter(self):
+        """Return after file sets changed and were stable for debounce seconds"""
+        while self.get_file_sets() == self.file_sets:
+            time.sleep(self.poll_interval)
+        file_sets = self.get_file_sets()
+        while True:
+            time.sleep(self.debounce)
+            new_file_sets = self.get_file_sets()
+            if new_file_sets == file_sets:
+                return
+            file_sets = new_file_sets
+
+    def _inotify_waiter(self) -> Callable[[], None]:
+        """Register watches, return function waiting for debounced events"""
+        inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        watch_flags = (flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO
+                       | flags.DELETE | flags.MOVED_FROM)
+
+        def add_watches():
+            # adding a watch for an already watched directory is a no-op
+            for watch_dir in self.get_watch_dirs():
+                inotify.add_watch(watch_dir, watch_flags)
+
+        add_watches()
+
+        def read_events(timeout=None):
+            events = inotify.read(timeout=timeout)
+            # watch matching directories created since, e.g. for a new sample
+            if any(event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO)
+                   for event in events):
+                add_watches()
+            return events
+
+        def wait_for_changes():
+            # block until the first event, then until no events for debounce seconds
+            read_events()
+            while read_events(timeout=int(self.debounce * 1000)):
+                pass
+
+        return wait_for_changes
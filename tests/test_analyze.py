@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import pytest
+
+from figure_report.analyze import BudgetExceededError, analyze_report
+from figure_report.cli import main
+from figure_report.report import Report
+from figure_report.shard import sharded_generate
+
+
+REPORT_CONFIG = {'page': {'large': {'figures': [{'path': 'figs/big.png'}]},
+                          'small': {'figures': [{'path': 'figs/small.png'},
+                                                {'path': 'spec.vg.json'}]},
+                          'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+
+
+@pytest.fixture
+def report_dir(tmpdir):
+    Path(tmpdir, 'figs').mkdir()
+    Path(tmpdir, 'figs', 'big.png').write_bytes(b'x' * 50000)
+    Path(tmpdir, 'figs', 'big.pdf').write_bytes(b'x' * 20000)
+    Path(tmpdir, 'figs', 'small.png').write_bytes(b'x' * 100)
+    Report(REPORT_CONFIG).generate(tmpdir)
+    return str(tmpdir)
+
+
+def test_analyze_report_sections(report_dir):
+    analysis = analyze_report(report_dir)
+    page, = analysis.pages
+    sections = {x.name: x for x in page.sections}
+    assert sections['large'].assets == {'figs/big.png': 50000}
+    assert sections['large'].linked == {'figs/big.png': 50000, 'figs/big.pdf': 20000}
+    assert sections['small'].n_vega_specs == 1
+    assert 'spec.vg.json' in sections['small'].assets
+    # shared css/js are loaded before the first heading
+    assert 'viewer.css' in page.assets
+    assert analysis.largest_assets(1) == [('figs/big.png', 50000)]
+    assert 'figs/big.png' in analysis.summary()
+
+
+def test_budgets(report_dir, capsys):
+    with pytest.raises(BudgetExceededError, match=r'page / large: bytes of assets loaded per'):
+        Report(REPORT_CONFIG).generate(report_dir, budgets={'section_asset_bytes': 40000})
+    analysis = analyze_report(report_dir)
+    assert analysis.budget_violations({'asset_bytes': 40000, 'page_vega_specs': 1}) == [
+        'figs/big.png: bytes of a single asset is 50.0 kB, budget 40.0 kB (asset_bytes)']
+    with pytest.raises(ValueError, match='Unknown budget keys'):
+        analysis.budget_violations({'page_bytes': 1})
+
+    assert main(['analyze', report_dir, '--budget', 'page_tables=0']) is None
+    assert main(['analyze', report_dir, '--budget', 'asset_bytes=40000']) == 1
+    assert '1 budget(s) exceeded' in capsys.readouterr().out
+    for bad_budget in ['page_bytes=1', 'asset_bytes=big']:
+        with pytest.raises(SystemExit):
+            main(['analyze', report_dir, '--budget', bad_budget])
+
+
+def test_report_budget_counts_pages_which_were_not_regenerated(report_dir):
+    Path(report_dir, 'figs', 'other.png').write_bytes(b'x' * 50000)
+    report_config = {**REPORT_CONFIG,
+                     'other': {'s': {'figures': [{'path': 'figs/other.png'}]},
+                               'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    # the regenerated page alone is within the budget
+    with pytest.raises(BudgetExceededError, match=r'report: '):
+        Report(report_config).generate(report_dir, pages=['other'],
+                                       budgets={'report_bytes': 100000})
+
+
+def test_sharded_build_checks_budgets(tmpdir):
+    Path(tmpdir, 'figs').mkdir()
+    Path(tmpdir, 'figs', 'big.png').write_bytes(b'x' * 50000)
+    with pytest.raises(BudgetExceededError):
+        sharded_generate(REPORT_CONFIG, tmpdir, budgets={'asset_bytes': 40000})
@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pandas as pd
+
+from figure_report.assets import AssetStore
+from figure_report.dimensions import IMAGE_SIZE_CACHE_NAME
+from figure_report.patterns import copy_report_files_to_report_dir
+from figure_report.report import Report
+
+
+def test_deduplicated_staging_and_gc(tmpdir):
+    root = Path(tmpdir) / 'figures'
+    report_dir = Path(tmpdir) / 'report'
+    for sample in ['a', 'b', 'c']:
+        (root / sample).mkdir(parents=True)
+        (root / sample / 'qc.png').write_bytes(b'empty plot' if sample != 'c' else b'plot c')
+        (root / sample / 'qc.pdf').write_bytes(b'empty pdf' if sample != 'c' else b'pdf c')
+    metadata_table = pd.DataFrame({'path': [str(root / x / 'qc.png') for x in 'abc']})
+
+    copy_report_files_to_report_dir(metadata_table, str(root), str(report_dir),
+                                    deduplicate=True)
+    rel_paths = metadata_table['rel_report_dir_path']
+    assert rel_paths[0] == rel_paths[1] != rel_paths[2]
+    assert (report_dir / rel_paths[0]).read_bytes() == b'empty plot'
+    assert (report_dir / rel_paths[0].replace('.png', '.pdf')).read_bytes() == b'empty pdf'
+    assert len(list((report_dir / 'assets').glob('*/*'))) == 4
+
+    (report_dir / 'page.html').write_text(f'<img src="{rel_paths[2]}">')
+    removed = AssetStore(report_dir).gc()
+    assert sorted(fp.name for fp in removed) == sorted(
+            [Path(rel_paths[0]).name, Path(rel_paths[0]).with_suffix('.pdf').name])
+    assert (report_dir / rel_paths[2]).exists()
+
+
+def test_gc_ignores_hidden_build_state(tmpdir):
+    root = Path(tmpdir) / 'figures'
+    report_dir = Path(tmpdir) / 'report'
+    for sample in ['a', 'b']:
+        (root / sample).mkdir(parents=True)
+        (root / sample / 'qc.png').write_bytes(sample.encode())
+    metadata_table = pd.DataFrame({'path': [str(root / x / 'qc.png') for x in 'ab']})
+    copy_report_files_to_report_dir(metadata_table, str(root), str(report_dir),
+                                    deduplicate=True)
+    rel_paths = list(metadata_table['rel_report_dir_path'])
+
+    def page_config(paths):
+        return {'page': {'qc': {'figures': [{'path': x} for x in paths]},
+                         'toc_headings': 'h1', 'autocollapse_depth': 2}}
+    # the default build caches image sizes by path in a hidden json file
+    Report(page_config(rel_paths)).generate(report_dir)
+    assert Path(report_dir, IMAGE_SIZE_CACHE_NAME).exists()
+    Report(page_config(rel_paths[:1])).generate(report_dir)
+    removed = AssetStore(report_dir).gc(dry_run=True)
+    assert [fp.name for fp in removed] == [Path(rel_paths[1]).name]
@@ -0,0 +1,42 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from figure_report.atlas import ATLAS_DIR, gc_atlases
+from figure_report.report import Report
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_grid_figure_uses_atlas_and_rebuilds_only_on_change(tmpdir):
+    colors = ['red', 'green', 'blue']
+    for i, color in enumerate(colors):
+        Image.new('RGB', (40, 20), color).save(Path(tmpdir) / f'{i}.png')
+    report_config = {'page': {'qc': {'figures': [{'grid': ['0.png', '1.png', '2.png'],
+                                                  'tile_width': 20, 'tile_height': 20}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir)
+    atlas_fp, = Path(tmpdir, ATLAS_DIR).iterdir()
+    page_html = Path(tmpdir, 'page.html').read_text()
+    tiles = re.findall(r'<a href="(\d)\.png".*?background-position:-(\d+)px -(\d+)px', page_html)
+    assert tiles == [('0', '0', '0'), ('1', '20', '0'), ('2', '40', '0')]
+    assert f'background-image:url("{ATLAS_DIR}/{atlas_fp.name}")' in page_html
+    with Image.open(atlas_fp) as atlas:
+        assert atlas.size == (60, 20)
+        # 40x20 images are scaled to 20x10 and centered in their cell
+        assert atlas.getpixel((25, 10))[:3] == (0, 128, 0)
+        assert atlas.getpixel((25, 2))[3] == 0
+
+    atlas_mtime = atlas_fp.stat().st_mtime_ns
+    Report(report_config).generate(tmpdir)
+    assert atlas_fp.stat().st_mtime_ns == atlas_mtime
+
+    Image.new('RGB', (40, 20), 'white').save(Path(tmpdir) / '1.png')
+    Report(report_config).generate(tmpdir)
+    assert len(list(Path(tmpdir, ATLAS_DIR).iterdir())) == 2
+
+    stale_atlas_fp, = [x for x in Path(tmpdir, ATLAS_DIR).iterdir() if x.name not in
+                       Path(tmpdir, 'page.html').read_text()]
+    assert gc_atlases(tmpdir) == [stale_atlas_fp]
+    assert len(list(Path(tmpdir, ATLAS_DIR).iterdir())) == 1
@@ -0,0 +1,56 @@
+import json
+import os
+from pathlib import Path
+
+from figure_report.cli import main
+
+
+def test_build_incremental_and_dry_run(tmpdir, capsys):
+    root = Path(tmpdir) / 'figures'
+    for rel_path in ['a/pca.png', 'a/qc.png', 'b/pca.png']:
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text('')
+    output_dir = Path(tmpdir) / 'report'
+    config = {'output_dir': str(output_dir),
+              'patterns': [str(root) + '/{sample}/{plot}.png'],
+              'pages': {'A': {'query': {'sample': 'a'}, 'section_cols': ['plot']},
+                        'B': {'query': {'sample': 'b'}, 'section_cols': ['plot']}}}
+    config_fp = Path(tmpdir) / 'config.json'
+    config_fp.write_text(json.dumps(config))
+
+    main(['build', str(config_fp), '--dry-run'])
+    assert 'would build A (2 figures)' in capsys.readouterr().out
+    assert not output_dir.exists()
+
+    main(['build', str(config_fp), '-j', '2'])
+    assert (output_dir / 'A.html').exists() and (output_dir / 'B.html').exists()
+
+    (root / 'b/qc.png').write_text('')
+    main(['build', str(config_fp), '--incremental'])
+    assert 'Built 1 of 2 pages' in capsys.readouterr().out
+    assert 'qc.png' in (output_dir / 'B.html').read_text()
+
+
+def test_incremental_build_stages_changed_figures_only(tmpdir, capsys):
+    root = Path(tmpdir) / 'figures'
+    for rel_path in ['a/pca.png', 'b/pca.png']:
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text('old')
+    output_dir = Path(tmpdir) / 'report'
+    config = {'output_dir': str(output_dir), 'root_dir': str(root),
+              'patterns': [str(root) + '/{sample}/{plot}.png'],
+              'pages': {'A': {'section_cols': ['sample', 'plot']}}}
+    config_fp = Path(tmpdir) / 'config.json'
+    config_fp.write_text(json.dumps(config))
+    main(['build', str(config_fp)])
+    assert 'reloaded' not in capsys.readouterr().out
+
+    # mark the staged copy, keeping its size and mtime: it must not be copied again
+    staged_fp = output_dir / 'a/pca.png'
+    stat = staged_fp.stat()
+    staged_fp.write_text('new')
+    os.utime(staged_fp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    (root / 'b/pca.png').write_text('changed')
+    main(['build', str(config_fp), '--incremental'])
+    assert staged_fp.read_text() == 'new'
+    assert (output_dir / 'b/pca.png').read_text() == 'changed'
@@ -0,0 +1,60 @@
+import struct
+from pathlib import Path
+
+from figure_report.dimensions import ImageSize, ImageSizeResolver, read_image_size
+from figure_report.report import Report
+from tests.test_optimize import make_png
+
+
+def make_jpeg_header(width, height):
+    """SOI, an APP0 segment with padding bytes and a progressive SOF2 segment"""
+    app0 = b'JFIF\x00' + b'\xff' * 20
+    return (b'\xff\xd8'
+            + b'\xff\xe0' + struct.pack('>H', len(app0) + 2) + app0
+            + b'\xff\xff\xc2' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00')
+
+
+def test_read_image_size(tmpdir):
+    tmpdir = Path(tmpdir)
+    tmpdir.joinpath('a.png').write_bytes(make_png(width=30, height=20))
+    tmpdir.joinpath('a.jpeg').write_bytes(make_jpeg_header(640, 480))
+    tmpdir.joinpath('a.svg').write_text(
+            '<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg"\n'
+            ' width="432pt" height="288pt" viewBox="0 0 432 288"></svg>')
+    tmpdir.joinpath('b.svg').write_text('<svg viewBox="0 0 100 50" width="200"></svg>')
+    tmpdir.joinpath('c.svg').write_text('<svg width="100%" height="100%"></svg>')
+    assert read_image_size(tmpdir / 'a.png') == ImageSize(30, 20)
+    assert read_image_size(tmpdir / 'a.jpeg') == ImageSize(640, 480)
+    assert read_image_size(tmpdir / 'a.svg') == ImageSize(576, 384)
+    assert read_image_size(tmpdir / 'b.svg') == ImageSize(200, 100)
+    assert read_image_size(tmpdir / 'c.svg') is None
+    assert read_image_size(tmpdir / 'missing.png') is None
+
+
+def test_image_size_resolver_cache(tmpdir):
+    tmpdir = Path(tmpdir)
+    png_fp = tmpdir / 'a.png'
+    png_fp.write_bytes(make_png(width=30, height=20))
+    resolver = ImageSizeResolver(base_dir=tmpdir, cache_path=tmpdir / 'cache.json')
+    resolver.prefetch(['a.png', 'missing.png', 'https://example.com/a.png'])
+    assert resolver.get('a.png') == ImageSize(30, 20)
+    assert resolver.get('https://example.com/a.png') is None
+    resolver.save()
+
+    # a changed file is read again, even with a cache loaded from disk
+    png_fp.write_bytes(make_png(width=40, height=10))
+    assert ImageSizeResolver(base_dir=tmpdir,
+                             cache_path=tmpdir / 'cache.json').get('a.png') == ImageSize(40, 10)
+
+
+def test_report_emits_intrinsic_sizes(tmpdir):
+    Path(tmpdir).joinpath('a.png').write_bytes(make_png(width=30, height=20))
+    report_config = {'page': {'section': {'figures': [{'path': 'a.png'},
+                                                      {'path': 'a.png', 'width': 60},
+                                                      {'path': 'missing.png'}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir)
+    img_tags = [x for x in Path(tmpdir, 'page.html').read_text().splitlines() if '<img' in x]
+    assert 'width=30 height=20>' in img_tags[0]
+    assert 'width=60  style="aspect-ratio: 30 / 20">' in img_tags[1]
+    assert 'width' not in img_tags[2]
@@ -0,0 +1,56 @@
+import base64
+import json
+import re
+from pathlib import Path
+
+import pandas as pd
+
+from figure_report.facets import build_facet_index
+from figure_report.patterns import convert_metadata_table_to_report_json
+from figure_report.report import Report
+
+
+def decode_bitset(b64, n_figures):
+    data = base64.b64decode(b64)
+    return [i for i in range(n_figures) if data[i >> 3] >> (i & 7) & 1]
+
+
+def test_build_facet_index():
+    index = build_facet_index([{'sample': 'b', 'rep': 10}, {'sample': 'a', 'rep': 2},
+                               None, {'sample': 'b'}])
+    assert index['n_figures'] == 4
+    sample_facet, rep_facet = index['facets']
+    assert sample_facet['values'] == ['a', 'b'] and sample_facet['counts'] == [1, 2]
+    assert [decode_bitset(x, 4) for x in sample_facet['bitsets']] == [[1], [0, 3]]
+    # numbers are sorted numerically
+    assert rep_facet['values'] == ['2', '10']
+    assert build_facet_index([None, {}]) is None
+
+
+def test_report_with_facet_filter(tmpdir):
+    metadata_table = pd.DataFrame({'path': ['a/pca.png', 'a/qc.png', 'b/pca.png'],
+                                   'sample': pd.Categorical(['a', 'a', 'b']),
+                                   'plot': ['pca', 'qc', 'pca']})
+    page_config = convert_metadata_table_to_report_json(metadata_table, ['sample'],
+                                                        facet_cols=['plot'])
+    assert page_config['a']['figures'][1] == {'path': 'a/qc.png', 'facets': {'plot': 'qc'}}
+    Report({'page': {**page_config, 'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+           ).generate(tmpdir)
+    page_html = Path(tmpdir, 'page.html').read_text()
+    assert re.findall(r'data-fig="(\d+)"', page_html) == ['0', '1', '2']
+    index_json = re.search(r'<script type="application/json" id="facet-index">(.*?)</script>',
+                           page_html).group(1)
+    plot_facet, = json.loads(index_json)['facets']
+    assert [decode_bitset(x, 3) for x in plot_facet['bitsets']] == [[0, 2], [1]]
+    assert Path(tmpdir, 'facets.js').exists()
+    # the filter comes before the figures, so its script must wait for them
+    assert page_html.index('facets.js') < page_html.index('data-fig="0"')
+    assert '<script src="./facets.js" defer></script>' in page_html
+    assert 'DOMContentLoaded' in Path(tmpdir, 'facets.js').read_text()
+
+
+def test_report_without_facets_has_no_filter(tmpdir):
+    Report({'page': {'s': {'figures': [{'path': 'a.png'}]},
+                     'toc_headings': 'h1', 'autocollapse_depth': '2'}}).generate(tmpdir)
+    page_html = Path(tmpdir, 'page.html').read_text()
+    assert 'facet-index' not in page_html and 'data-fig' not in page_html
@@ -0,0 +1,148 @@
+import re
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from figure_report import html_report
+from figure_report.html_report import HtmlReport, incremental_counter
+
+
+class FakeHandle:
+    def __init__(self):
+        self.updates = []
+
+    def update(self, obj):
+        self.updates.append(obj.data)
+
+
+def test_live_display_sends_only_new_elements(tmpdir, monkeypatch):
+    displayed = []
+    handle = FakeHandle()
+
+    def fake_display(obj, display_id=None):
+        displayed.append(obj)
+        return handle if display_id else None
+
+    monkeypatch.setattr(html_report, 'display', fake_display)
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    report.h1('before')
+    report.live_display()
+    assert 'before' in displayed[0].data
+
+    report.h1('first')
+    report.text('second')
+    assert len(handle.updates) == 2
+    assert 'first' in handle.updates[0] and 'second' not in handle.updates[0]
+    assert 'second' in handle.updates[1] and 'first' not in handle.updates[1]
+
+
+def test_slots_are_filled_out_of_order_from_threads(tmpdir):
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    report.h1('start')
+    slots = [report.reserve() for unused_i in range(20)]
+    report.h1('end')
+
+    def fill(i):
+        slots[i].h2(f'section {i}')
+        slots[i].text(f'text {i}')
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(fill, reversed(range(20))))
+
+    html = report.html_code
+    positions = [html.index(f'section {i}<') for i in range(20)]
+    assert html.index('start') < positions[0] and positions == sorted(positions)
+    assert positions[-1] < html.index('end')
+    heading_ids = re.findall(r'<h\d id=(\d+)>', html)
+    assert len(set(heading_ids)) == len(heading_ids) == 22
+
+
+def test_incremental_counter_is_thread_safe():
+    counter = incremental_counter()
+    with ThreadPoolExecutor(8) as executor:
+        values = list(executor.map(lambda unused: counter(), range(10000)))
+    assert sorted(values) == list(range(10000))
+
+
+def test_image_links_siblings_saved_after_earlier_images(tmpdir):
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    for name in ['a', 'b']:
+        Path(tmpdir, f'{name}.png').write_text('')
+        Path(tmpdir, f'{name}.pdf').write_text('')
+        report.image(str(Path(tmpdir, f'{name}.png')), link_fn=report.link_fn)
+    html = report.html_code
+    assert 'a.pdf' in html and 'b.pdf' in html
+
+
+def test_live_display_snapshots_full_body(tmpdir, monkeypatch):
+    handles = []
+
+    def fake_display(obj, display_id=None):
+        handles.append(FakeHandle())
+        return handles[-1]
+
+    monkeypatch.setattr(html_report, 'display', fake_display)
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    report.live_snapshot_interval = 0
+    report.h1('before')
+    report.live_display()
+    container_handle, js_handle = handles
+    slot = report.reserve()
+    report.h1('first')
+    slot.text('in slot')
+    # the container output holds everything, the increment is not replayed
+    assert 'first' in container_handle.updates[-1]
+    assert re.search(r'<div id="[\w-]+-slot0"><br>in slot<br></div>',
+                     container_handle.updates[-1])
+    assert js_handle.updates[-1] == ''
+
+    # by default, the container is only replaced on request
+    report.live_snapshot_interval = None
+    n_snapshots = len(container_handle.updates)
+    report.h1('second')
+    assert len(container_handle.updates) == n_snapshots
+    report.snapshot()
+    assert 'second' in container_handle.updates[-1]
+
+
+def test_slots_reserved_before_live_display_are_streamed(tmpdir, monkeypatch):
+    displayed = []
+    handle = FakeHandle()
+
+    def fake_display(obj, display_id=None):
+        displayed.append(obj)
+        return handle
+
+    monkeypatch.setattr(html_report, 'display', fake_display)
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    slot = report.reserve()
+    report.live_display()
+    slot.text('late')
+    slot_div_id, = re.findall(r'<div id="([\w-]+-slot\d+)">', displayed[0].data)
+    assert slot_div_id in handle.updates[-1] and 'late' in handle.updates[-1]
+
+
+def test_figure_closes_only_its_own_figure(tmpdir):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    own_fig = plt.figure()
+    other_fig = plt.figure()
+    report.figure(own_fig)
+    assert not plt.fignum_exists(own_fig.number)
+    assert plt.fignum_exists(other_fig.number)
+    plt.close(other_fig)
+
+
+def test_image_does_not_list_directory_again(tmpdir, monkeypatch):
+    report = HtmlReport(str(tmpdir) + '/report.html', link_fn=None)
+    listed = []
+    list_dir = report.sibling_resolver._list
+    monkeypatch.setattr(report.sibling_resolver, '_list',
+                        lambda directory: listed.append(directory) or list_dir(directory))
+    for name in ['a', 'b', 'c']:
+        Path(tmpdir, f'{name}.png').write_text('')
+        Path(tmpdir, f'{name}.svg').write_text('')
+        report.image(str(Path(tmpdir, f'{name}.png')), link_fn=report.link_fn)
+    assert len(listed) == 1
+    assert all(f'{name}.svg' in report.html_code for name in 'abc')
@@ -0,0 +1,32 @@
+import json
+import re
+from pathlib import Path
+
+from figure_report.interactive_grid import encode_panels
+from figure_report.report import Report
+
+
+def test_encode_panels():
+    encoded = encode_panels([{'path': 'regions/chr2_10.png', 'chrom': 'chr2', 'start': 10},
+                             {'path': 'regions/chr1_9.png', 'chrom': 'chr1', 'start': 9},
+                             'regions/other.png'])
+    assert encoded['prefix'] == 'regions/'
+    assert encoded['paths'] == ['chr2_10.png', 'chr1_9.png', 'other.png']
+    chrom, start = encoded['fields']
+    assert chrom == {'name': 'chrom', 'values': ['chr1', 'chr2'], 'codes': [1, 0, -1]}
+    assert start == {'name': 'start', 'values': [9, 10], 'codes': [1, 0, -1]}
+
+
+def test_report_with_interactive_grid(tmpdir):
+    panels = [{'path': f'regions/{i}.png', 'region': i} for i in range(2000)]
+    report_config = {'page': {'s': {'figures': [{'interactive_grid': panels,
+                                                 'panel_width': 100, 'title': 'Regions'}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir)
+    page_html = Path(tmpdir, 'page.html').read_text()
+    assert 'data-panel-width="100" data-panel-height="200"' in page_html
+    panels_json = re.search(r'<script type="application/json">(.*?)</script>', page_html).group(1)
+    assert len(json.loads(panels_json)['paths']) == 2000
+    # panels are only created client-side
+    assert '<img' not in page_html
+    assert Path(tmpdir, 'interactive_grid.js').exists()
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from figure_report.metadata_index import MetadataIndex, Prefix
+
+
+def test_metadata_index_queries_match_boolean_selection():
+    rng = np.random.default_rng(0)
+    n = 2000
+    metadata_table = pd.DataFrame({
+        'path': [f'p{i}.png' for i in range(n)],
+        'sample': rng.choice(['hsc_1', 'hsc_2', 'mpp_1', 'cmp_1'], n),
+        'plot': pd.Categorical(rng.choice(['pca', 'qc', 'heatmap'], n)),
+        'rep': rng.integers(1, 4, n),
+    })
+    index = MetadataIndex(metadata_table)
+
+    pd.testing.assert_frame_equal(
+            index.query(sample='mpp_1', rep=2),
+            metadata_table.loc[(metadata_table['sample'] == 'mpp_1') & (metadata_table['rep'] == 2)])
+    pd.testing.assert_frame_equal(
+            index.query(sample=Prefix('hsc'), plot={'pca', 'qc'}),
+            metadata_table.loc[metadata_table['sample'].str.startswith('hsc')
+                               & metadata_table['plot'].isin(['pca', 'qc'])])
+    assert index.query(sample='unknown').empty
+
+    report_json = index.to_report_json(['plot'], sample='cmp_1', rep=[1])
+    n_figures = sum(len(section['figures']) for section in report_json.values())
+    assert n_figures == ((metadata_table['sample'] == 'cmp_1') & (metadata_table['rep'] == 1)).sum()
@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+from figure_report.html_report import HtmlReport
+from figure_report.offline import PRECACHE_MANIFEST_NAME, SERVICE_WORKER_NAME
+from figure_report.report import Report
+
+
+def read_manifest(output_dir):
+    return json.loads(Path(output_dir, PRECACHE_MANIFEST_NAME).read_text())['assets']
+
+
+def test_report_service_worker_manifest(tmpdir):
+    Path(tmpdir, 'figs').mkdir()
+    Path(tmpdir, 'figs', 'a.png').write_bytes(b'a')
+    report_config = {'page': {'s': {'figures': [{'path': 'figs/a.png'}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir, service_worker=True, precompress=True)
+    assert Path(tmpdir, SERVICE_WORKER_NAME).exists()
+    assert "register('./sw.js')" in Path(tmpdir, 'page.html').read_text()
+    assets = read_manifest(tmpdir)
+    assert {'page.html', 'viewer.css', 'figs/a.png'} <= set(assets)
+    assert not any(x.endswith('.gz') or x.startswith('.') for x in assets)
+
+    Path(tmpdir, 'figs', 'a.png').write_bytes(b'changed')
+    Report(report_config).generate(tmpdir, service_worker=True)
+    new_assets = read_manifest(tmpdir)
+    assert {x for x in assets if assets[x] != new_assets[x]} == {'figs/a.png'}
+
+
+def test_html_report_service_worker_manifest_is_shared(tmpdir):
+    for name in ['a', 'b']:
+        report = HtmlReport(f'{tmpdir}/{name}.html', link_fn=None)
+        report.h1(name)
+        Path(report.files_dir, 'img.png').write_bytes(name.encode())
+        report.save(service_worker=True)
+    assert "register('./sw.js')" in Path(tmpdir, 'a.html').read_text()
+    assert {'a.html', 'b.html', 'a_img/img.png', 'b_img/img.png',
+            'tocbot.min.js'} <= set(read_manifest(tmpdir))
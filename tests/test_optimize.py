@@ -0,0 +1,58 @@
+import struct
+import zlib
+from pathlib import Path
+
+from figure_report.optimize import optimize_report_images, minify_svg
+
+
+def make_png(width=64, height=64):
+    """Grayscale PNG with stored (uncompressed) image data and a text chunk"""
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data
+                + struct.pack('>I', zlib.crc32(chunk_type + data)))
+    raw = b''.join(b'\x00' + bytes(x % 4 for x in range(width)) for unused_y in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'tEXt', b'Software\x00matplotlib')
+            + chunk(b'IDAT', zlib.compress(raw, 0))
+            + chunk(b'IEND', b''))
+
+
+def test_optimize_report_images_is_lossless_and_cached(tmpdir):
+    png_fp = Path(tmpdir) / 'a/fig.png'
+    png_fp.parent.mkdir()
+    png_data = make_png()
+    png_fp.write_bytes(png_data)
+
+    summary = optimize_report_images(tmpdir, n_jobs=1)
+    assert summary.n_optimized == 1 and summary.bytes_saved > 0
+    optimized = png_fp.read_bytes()
+    assert b'tEXt' not in optimized
+    idat = lambda data: zlib.decompress(data[data.index(b'IDAT') + 4:data.index(b'IEND') - 8])
+    assert idat(optimized) == idat(png_data)
+
+    # already optimized file and re-staged original are served from the cache
+    assert optimize_report_images(tmpdir, n_jobs=1).bytes_saved == 0
+    png_fp.write_bytes(png_data)
+    assert optimize_report_images(tmpdir, n_jobs=1).bytes_saved == summary.bytes_saved
+    assert png_fp.read_bytes() == optimized
+
+
+def test_minify_svg():
+    svg = b'<svg>\n  <!-- comment -->\n  <path d="M 0.123456 10.5 L -0.00001 3"/>\n</svg>\n'
+    assert minify_svg(svg) == b'<svg><path d="M 0.123 10.5 L 0 3"/></svg>'
+    # text and transforms are kept exactly
+    svg = (b'<svg>\n<g transform="scale(0.015625)"><path id="g1" d="M 1.234567 0"/></g>\n'
+           b'<text x="1.00001">p = 0.000123456</text>\n</svg>')
+    assert minify_svg(svg) == (b'<svg><g transform="scale(0.015625)"><path id="g1" '
+                               b'd="M 1.235 0"/></g><text x="1">p = 0.000123456</text></svg>')
+
+
+def test_minify_svg_keeps_whitespace_in_text():
+    # svg.fonttype 'none': words in separate tspans, separated by whitespace
+    svg = (b'<svg>\n  <g>\n    <text><tspan>p</tspan> <tspan>value</tspan></text>\n  </g>\n'
+           b'  <text>a</text>\n</svg>\n')
+    assert minify_svg(svg) == (b'<svg><g><text><tspan>p</tspan> <tspan>value</tspan></text>'
+                               b'</g><text>a</text></svg>')
+    svg = b'<svg xml:space="preserve">\n  <g>\n    <text>a</text>\n  </g>\n</svg>\n'
+    assert minify_svg(svg) == svg.strip()
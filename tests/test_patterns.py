@@ -0,0 +1,129 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from figure_report.patterns import (pattern_to_metadata_table, get_paths,
+                                     pattern_set_to_metadata_table,
+                                     iter_pattern_matches, sel_expand, iter_sel_expand,
+                                     sel_expand_to_metadata_table,
+                                     copy_report_files_to_report_dir)
+from figure_report.storage import InMemoryStorage, Storage
+
+
+def create_files(root: Path, rel_paths):
+    for rel_path in rel_paths:
+        fp = root / rel_path
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        fp.write_text('')
+
+
+def test_pattern_to_metadata_table_categorical_split_paths(tmpdir):
+    root = Path(tmpdir)
+    create_files(root, [f'{sample}/{plot}_{rep}.png'
+                        for sample in ['a', 'b'] for plot in ['pca', 'qc'] for rep in [1, 2]])
+    pattern = str(root) + '/{sample}/{plot}_{rep}.png'
+
+    metadata_table = pattern_to_metadata_table(
+            pattern, categorical=True, field_dtypes={'rep': int},
+            path_representation='split')
+
+    assert list(metadata_table.columns) == ['dirname', 'basename', 'sample', 'plot', 'rep']
+    assert isinstance(metadata_table['sample'].dtype, pd.CategoricalDtype)
+    assert isinstance(metadata_table['dirname'].dtype, pd.CategoricalDtype)
+    assert metadata_table['rep'].dtype == int
+    full_table = pattern_to_metadata_table(pattern)
+    assert sorted(get_paths(metadata_table)) == sorted(full_table['path'])
+
+    pattern_set_table = pattern_set_to_metadata_table(
+            {'p': pattern}, names=['pattern'], categorical=True, field_dtypes={'rep': int})
+    assert isinstance(pattern_set_table['sample'].dtype, pd.CategoricalDtype)
+    assert pattern_set_table['rep'].dtype == int
+
+
+def test_iter_pattern_matches_yields_chunks(tmpdir):
+    root = Path(tmpdir)
+    create_files(root, [f'{sample}/{plot}.png' for sample in 'abcde' for plot in ['pca', 'qc']])
+    pattern = str(root) + '/{sample}/{plot}.png'
+
+    chunks = list(iter_pattern_matches(pattern, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    records = [record for chunk in chunks for record in chunk]
+    expected = pattern_to_metadata_table(pattern)
+    assert (sorted(tuple(record.values()) for record in records)
+            == sorted(expected.itertuples(index=False, name=None)))
+
+    df_chunks = list(iter_pattern_matches(pattern, chunk_size=4, as_dataframe=True))
+    assert list(df_chunks[0].columns) == ['path', 'sample', 'plot']
+
+
+def test_sel_expand_to_metadata_table_keeps_existing_paths(tmpdir):
+    root = Path(tmpdir)
+    create_files(root, ['a/rep1.png', 'a/rep2.png', 'b/rep1.png'])
+    template = str(root) + '/{sample}/rep{rep}.png'
+
+    assert sel_expand(template, sample='a', rep=1) == str(root) + '/a/rep1.png'
+    # numpy scalars, e.g. from a DataFrame row, are single values
+    assert sel_expand(template, sample=np.str_('a'), rep=np.int64(1)) == str(root) + '/a/rep1.png'
+    assert list(iter_sel_expand(template, sample='b', rep=np.int64(1))) == [
+        ({'sample': 'b', 'rep': 1}, str(root) + '/b/rep1.png')]
+    metadata_table = sel_expand_to_metadata_table(template, sample=['a', 'b', 'c'], rep=[1, 2])
+    assert list(metadata_table.columns) == ['path', 'sample', 'rep']
+    assert (list(metadata_table.itertuples(index=False, name=None))
+            == [(str(root) + '/a/rep1.png', 'a', 1),
+                (str(root) + '/a/rep2.png', 'a', 2),
+                (str(root) + '/b/rep1.png', 'b', 1)])
+
+
+def test_pattern_discovery_and_staging_with_in_memory_storage():
+    storage = InMemoryStorage({f'data/{sample}/{plot}.{suffix}': sample.encode()
+                               for sample in 'ab' for plot in ['pca', 'qc']
+                               for suffix in ['png', 'pdf']}, page_size=3)
+    storage.put('data/a/nested/pca.png', b'')
+    report_storage = InMemoryStorage()
+
+    metadata_table = pattern_to_metadata_table('data/{sample}/{plot}.png', storage=storage)
+    assert len(metadata_table) == 4
+    copy_report_files_to_report_dir(metadata_table, 'data', 'report',
+                                    storage=storage, report_storage=report_storage)
+    assert sorted(report_storage.data) == sorted(
+            key[len('data/'):] for key in storage.data if 'nested' not in key)
+    # the staged files are not local, so they can not be optimized
+    with pytest.raises(ValueError, match='optimize_images'):
+        copy_report_files_to_report_dir(metadata_table, 'data', 'report', optimize_images=True,
+                                        storage=storage, report_storage=report_storage)
+
+
+def test_staging_skips_missing_siblings(tmpdir):
+    root = Path(tmpdir) / 'data'
+    for sample in 'ab':
+        (root / sample).mkdir(parents=True)
+        (root / sample / 'pca.png').write_bytes(b'')
+    (root / 'a' / 'pca.pdf').write_bytes(b'')
+    report_dir = Path(tmpdir) / 'report'
+    metadata_table = pattern_to_metadata_table(str(root) + '/{sample}/pca.png')
+    copy_report_files_to_report_dir(metadata_table, str(root), str(report_dir))
+    assert sorted(str(x.relative_to(report_dir)) for x in report_dir.rglob('*.*')) == [
+        'a/pca.pdf', 'a/pca.png', 'b/pca.png']
+
+
+def test_deduplicated_staging_copies_requested_sibling_formats(tmpdir):
+    root = Path(tmpdir) / 'data'
+    root.mkdir()
+    for suffix in ['.png', '.pdf', '.svg', '.eps']:
+        (root / ('pca' + suffix)).write_bytes(suffix.encode())
+    report_dir = Path(tmpdir) / 'report'
+    metadata_table = pattern_to_metadata_table(str(root) + '/{plot}.png')
+    copy_report_files_to_report_dir(metadata_table, str(root), str(report_dir),
+                                    deduplicate=True, sibling_formats=['eps'])
+    assert sorted(x.suffix for x in (report_dir / 'assets').rglob('*.*')) == ['.eps', '.png']
+
+
+def test_storage_backends_must_implement_abstract_methods():
+    class ListOnlyStorage(Storage):
+        def list_pages(self, prefix):
+            yield []
+
+    with pytest.raises(TypeError):
+        ListOnlyStorage()
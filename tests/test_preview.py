@@ -0,0 +1,67 @@
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from figure_report.cli import main
+from figure_report.patterns import sample_sections
+from figure_report.preview import preview_page_config
+from figure_report.report import Report
+
+
+def test_preview_page_config_samples_sections_and_grids():
+    page_config = {'A': {'figures': [{'path': 'a1.png'}, {'path': 'a2.json'},
+                                     {'path': 'a3.png'}],
+                         'B': {'figures': [{'grid': ['b1.png', 'b2.png', 'b3.png']}]}},
+                   'toc_headings': 'h1, h2'}
+    preview_config = preview_page_config(page_config, 2)
+    assert preview_config == {'A': {'figures': [{'path': 'a1.png'},
+                                                {'path': 'a2.json', 'embed': False}],
+                                    'B': {'figures': [{'grid': ['b1.png', 'b2.png']}]}},
+                              'toc_headings': 'h1, h2'}
+    assert len(page_config['A']['figures']) == 3
+
+
+def test_sample_sections_keeps_first_rows_per_section():
+    metadata_table = pd.DataFrame({'sample': ['a', 'a', 'b', 'a', 'b', None],
+                                   'plot': ['x', 'x', 'x', 'x', 'y', 'z']})
+    sampled = sample_sections(metadata_table, ['sample', 'plot'], 2)
+    assert list(sampled.index) == [0, 1, 2, 4, 5]
+
+
+def test_report_generate_preview(tmpdir):
+    output_dir = Path(tmpdir)
+    report_config = {'page': {
+        'toc_headings': 'h1', 'autocollapse_depth': 1,
+        'Section': {'figures': [{'path': 'spec.json'}, {'path': 'a.png'}, {'path': 'b.png'}]},
+    }}
+    Report(report_config).generate(output_dir, preview=2)
+    html = (output_dir / 'page.html').read_text()
+    assert 'class="preview-banner"' in html
+    assert 'vegaEmbed' not in html and 'cdn.jsdelivr.net/npm/vega' not in html
+    assert '<a href="spec.json">' in html
+    assert 'a.png' in html and 'b.png' not in html
+
+    Report(report_config).generate(output_dir)
+    html = (output_dir / 'page.html').read_text()
+    assert 'preview-banner' not in html and 'vegaEmbed' in html and 'b.png' in html
+
+
+def test_cli_preview_links_original_files(tmpdir, capsys):
+    root = Path(tmpdir) / 'figures'
+    for rel_path in ['a/pca.png', 'a/qc.png', 'b/pca.png']:
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text('')
+    output_dir = Path(tmpdir) / 'report'
+    config = {'output_dir': str(output_dir),
+              'patterns': [str(root) + '/{sample}/{plot}.png'],
+              'root_dir': str(root),
+              'pages': {'All': {'section_cols': ['sample']}}}
+    config_fp = Path(tmpdir) / 'config.json'
+    config_fp.write_text(json.dumps(config))
+
+    main(['build', str(config_fp), '--preview', '1'])
+    assert not output_dir.exists()
+    html = (Path(tmpdir) / 'report_preview' / 'All.html').read_text()
+    assert str(root / 'a/pca.png') in html and str(root / 'b/pca.png') in html
+    assert 'qc.png' not in html
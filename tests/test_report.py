@@ -1,6 +1,12 @@
+import gzip
 import re
 import subprocess
-from figure_report.report import (Report, ReportPage)
+from pathlib import Path
+
+from figure_report import atlas
+from figure_report.compress import precompress_dir
+from figure_report.report import (Report, ReportPage, FigureCollection, SectionNode,
+                                  DescriptionNode, FigureNode, render_figure_fragment)
 
 def test_report_page_fields_are_all_filled():
     kwargs = dict(figure_collection_html='FILLED')
@@ -125,3 +131,65 @@ def test_figure_box_create_html(tmpdir):
     # Path('/home/stephen/temp/test.html').write_text(page_html)
 
 
+
+
+def test_report_generate_precompress(tmpdir):
+    report_config = {'page': {'section': {'figures': [{'path': 'fig.svg'}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir, precompress=True)
+    page_fp = Path(tmpdir) / 'page.html'
+    gz_fp = Path(tmpdir) / 'page.html.gz'
+    assert gzip.decompress(gz_fp.read_bytes()) == page_fp.read_bytes()
+    assert (Path(tmpdir) / 'viewer.css.gz').exists()
+
+    gz_mtime = gz_fp.stat().st_mtime_ns
+    assert not precompress_dir(tmpdir)
+    assert gz_fp.stat().st_mtime_ns == gz_mtime
+
+
+def test_figure_tree_reuses_cached_fragments():
+    page_config = {'a': {'description': 'text',
+                         'figures': [{'path': 'a.png'}, {'path': 'b.png'}],
+                         'b': {'figures': [{'path': 'c.png'}]}}}
+    figure_collection = FigureCollection(page_config)
+    assert [type(node) for node in figure_collection.iter_nodes()] == [
+        SectionNode, DescriptionNode, FigureNode, FigureNode, SectionNode, FigureNode]
+    html = figure_collection.generate_html()
+    assert '<h2 id="a_b">b</h2>' in html
+
+    page_config['a']['b']['figures'][0]['title'] = 'changed'
+    misses_before = render_figure_fragment.cache_info().misses
+    FigureCollection(page_config).generate_html()
+    assert render_figure_fragment.cache_info().misses == misses_before + 1
+
+    # inserting a figure renumbers the later figures, without rendering them again
+    page_config = {'a': {'figures': [{'path': 'a.png'}, {'path': 'spec.json'}]}}
+    assert 'vegaEmbed(\'#fig2\'' in FigureCollection(page_config).generate_html()
+    page_config['a']['figures'].insert(0, {'path': 'new.png'})
+    misses_before = render_figure_fragment.cache_info().misses
+    html = FigureCollection(page_config).generate_html()
+    assert render_figure_fragment.cache_info().misses == misses_before + 1
+    assert '<div id="fig3"></div>' in html and 'vegaEmbed(\'#fig3\'' in html
+
+
+def test_download_links_only_for_existing_formats(tmpdir):
+    Path(tmpdir, 'figs').mkdir()
+    for name in ['a.png', 'a.pdf', 'b.png']:
+        Path(tmpdir, 'figs', name).write_bytes(b'')
+    report_config = {'page': {'section': {'figures': [{'path': 'figs/a.png'},
+                                                      {'path': 'figs/b.png'}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir)
+    page_html = Path(tmpdir, 'page.html').read_text()
+    assert 'href="figs/a.pdf"' in page_html
+    assert 'figs/b.pdf' not in page_html
+    assert 'svg' not in re.findall(r'href="figs/[ab]\.(\w+)"', page_html)
+
+
+def test_grid_figure_without_pillow_uses_img_tags(tmpdir, monkeypatch):
+    monkeypatch.setattr(atlas, 'Image', None)
+    report_config = {'page': {'qc': {'figures': [{'grid': ['0.png', '1.png']}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': '2'}}
+    Report(report_config).generate(tmpdir)
+    page_html = Path(tmpdir, 'page.html').read_text()
+    assert '<img src="0.png"' in page_html and '<img src="1.png"' in page_html
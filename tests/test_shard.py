@@ -0,0 +1,85 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from pathlib import Path
+
+from figure_report.report import BUILD_STATE_NAME
+from figure_report.shard import _claim, get_shard_dir, run_once, sharded_generate
+
+REPORT_CONFIG = {f'page{i}': {'section': {'figures': [{'path': f'fig{i}.png'}]},
+                              'toc_headings': 'h1', 'autocollapse_depth': 2}
+                 for i in range(12)}
+
+
+def run_worker(args):
+    output_dir, worker_id = args
+    return sharded_generate(REPORT_CONFIG, output_dir, worker_id=worker_id)
+
+
+def test_sharded_generate_with_several_processes(tmpdir):
+    with Pool(3) as pool:
+        generated_pages = pool.map(run_worker, [(str(tmpdir), f'w{i}') for i in range(3)])
+
+    all_pages = [page for pages in generated_pages for page in pages]
+    assert sorted(all_pages) == sorted(REPORT_CONFIG)
+    for page_name in REPORT_CONFIG:
+        assert (Path(tmpdir) / f'{page_name}.html').exists()
+    assert (Path(tmpdir) / 'viewer.css').exists()
+    assert set(json.loads((Path(tmpdir) / BUILD_STATE_NAME).read_text())) == set(REPORT_CONFIG)
+    assert (get_shard_dir(REPORT_CONFIG, tmpdir) / 'merged').exists()
+    # late workers find the build finished
+    assert run_worker((str(tmpdir), 'late')) == []
+
+
+def stage_once(args):
+    output_dir, worker_id = args
+
+    def stage():
+        Path(output_dir, f'staged_by_{worker_id}').write_text('')
+        return {'staged_by': worker_id}
+    return run_once(stage, output_dir, 'staging-test', worker_id=worker_id,
+                    poll_interval=0.01)['staged_by']
+
+
+def test_run_once_runs_step_in_one_worker(tmpdir):
+    with Pool(4) as pool:
+        results = pool.map(stage_once, [(str(tmpdir), f'w{i}') for i in range(4)])
+    assert len(set(results)) == 1
+    assert len(list(Path(tmpdir).glob('staged_by_*'))) == 1
+
+
+def test_stale_lock_is_taken_over_by_one_worker(tmpdir):
+    lock_fp = Path(tmpdir) / 'page.lock'
+    for unused_round in range(20):
+        lock_fp.write_text('crashed')
+        os.utime(lock_fp, (time.time() - 100, time.time() - 100))
+        with ThreadPoolExecutor(8) as executor:
+            claimed = list(executor.map(lambda i: _claim(lock_fp, f'w{i}', stale_after=10),
+                                        range(8)))
+        assert sum(claimed) == 1
+        assert lock_fp.read_text() == f'w{claimed.index(True)}'
+
+
+def test_pages_of_crashed_worker_are_built_and_merged(tmpdir):
+    shard_dir = get_shard_dir(REPORT_CONFIG, tmpdir)
+    (shard_dir / 'locks').mkdir(parents=True)
+    # a worker just claimed page0 and was killed, the lock is not renewed
+    (shard_dir / 'locks' / 'page0').write_text('crashed')
+
+    pages = sharded_generate(REPORT_CONFIG, tmpdir, worker_id='w0', stale_after=0.5,
+                             poll_interval=0.01)
+    assert sorted(pages) == sorted(REPORT_CONFIG)
+    assert (shard_dir / 'merged').exists()
+
+
+def test_run_once_keeps_lock_alive(tmpdir):
+    lock_fp = Path(tmpdir) / '.shard' / 'steps' / 'slow.lock'
+
+    def slow_step():
+        lock_mtime = lock_fp.stat().st_mtime
+        time.sleep(0.5)
+        return lock_fp.stat().st_mtime > lock_mtime
+
+    assert run_once(slow_step, tmpdir, 'slow', stale_after=0.2)
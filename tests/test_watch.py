@@ -0,0 +1,108 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from figure_report import watch
+from figure_report.patterns import convert_metadata_table_to_report_json
+from figure_report.watch import ReportWatcher
+
+
+def build_report_config(metadata_table):
+    return {sample: {**convert_metadata_table_to_report_json(group_df, ['plot']),
+                     'toc_headings': 'h1, h2', 'autocollapse_depth': '2'}
+            for sample, group_df in metadata_table.groupby('sample')}
+
+
+def test_report_watcher_regenerates_changed_pages_only(tmpdir):
+    root = Path(tmpdir) / 'figures'
+    output_dir = Path(tmpdir) / 'report'
+    watcher = ReportWatcher([str(root) + '/{sample}/{plot}.png'], build_report_config,
+                            output_dir, use_inotify=False)
+    assert watcher.get_watch_dirs() == [str(tmpdir)]
+    assert watcher.rebuild() == []
+
+    for rel_path in ['a/pca.png', 'b/pca.png']:
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text('')
+    assert sorted(watcher.rebuild()) == ['a', 'b']
+    assert (output_dir / 'a.html').exists()
+
+    (root / 'b/qc.png').write_text('')
+    assert watcher.rebuild() == ['b']
+    assert 'qc.png' in (output_dir / 'b.html').read_text()
+    assert watcher.rebuild() == []
+
+
+def test_report_watcher_removes_pages_no_longer_in_config(tmpdir):
+    root = Path(tmpdir) / 'figures'
+    output_dir = Path(tmpdir) / 'report'
+    for rel_path in ['a/pca.png', 'b/pca.png']:
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text('')
+    watcher = ReportWatcher([str(root) + '/{sample}/{plot}.png'], build_report_config,
+                            output_dir, use_inotify=False)
+    assert sorted(watcher.rebuild()) == ['a', 'b']
+
+    (root / 'b/pca.png').unlink()
+    assert watcher.rebuild() == []
+    assert (output_dir / 'a.html').exists() and not (output_dir / 'b.html').exists()
+
+
+def test_report_watcher_registers_watches_before_first_rebuild(tmpdir, monkeypatch):
+    calls = []
+
+    class FakeINotify:
+        def add_watch(self, path, flags):
+            calls.append('add_watch')
+
+        def read(self, timeout=None):
+            return []
+
+    fake_inotify_simple = SimpleNamespace(
+            INotify=FakeINotify,
+            flags=SimpleNamespace(CREATE=1, CLOSE_WRITE=2, MOVED_TO=4, DELETE=8, MOVED_FROM=16,
+                                  ISDIR=32))
+    monkeypatch.setattr(watch, 'inotify_simple', fake_inotify_simple)
+    watcher = ReportWatcher([str(tmpdir) + '/{sample}/{plot}.png'], build_report_config,
+                            Path(tmpdir) / 'report', use_inotify=True)
+    monkeypatch.setattr(watcher, 'rebuild', lambda: calls.append('rebuild') or ['page'])
+    watcher.watch(max_rebuilds=1)
+    assert calls[:2] == ['add_watch', 'rebuild']
+
+
+def test_report_watcher_watches_only_pattern_directories(tmpdir):
+    root = Path(tmpdir) / 'figures'
+    for rel_dir in ['a/plots/raw', 'b/plots', 'b/logs', 'c']:
+        (root / rel_dir).mkdir(parents=True)
+    watcher = ReportWatcher([str(root) + '/{sample}/plots/{plot}.png'], build_report_config,
+                            Path(tmpdir) / 'report', use_inotify=False)
+    assert watcher.get_watch_dirs() == [
+        str(root), *(str(root / x) for x in ['a', 'a/plots', 'b', 'b/plots', 'c'])]
+
+
+def test_report_watcher_watches_new_sample_directories(tmpdir, monkeypatch):
+    root = Path(tmpdir) / 'figures'
+    root.mkdir()
+    watched = []
+    # a directory for a new sample is created (CREATE | ISDIR), then no more events
+    events = [[SimpleNamespace(mask=1 | 32)], []]
+
+    class FakeINotify:
+        def add_watch(self, path, flags):
+            watched.append(path)
+
+        def read(self, timeout=None):
+            if len(events) == 2:
+                (root / 'a').mkdir()
+            return events.pop(0)
+
+    fake_inotify_simple = SimpleNamespace(
+            INotify=FakeINotify,
+            flags=SimpleNamespace(CREATE=1, CLOSE_WRITE=2, MOVED_TO=4, DELETE=8, MOVED_FROM=16,
+                                  ISDIR=32))
+    monkeypatch.setattr(watch, 'inotify_simple', fake_inotify_simple)
+    watcher = ReportWatcher([str(root) + '/{sample}/{plot}.png'], build_report_config,
+                            Path(tmpdir) / 'report', use_inotify=True)
+    wait_for_changes = watcher._inotify_waiter()
+    assert watched == [str(root)]
+    wait_for_changes()
+    assert watched == [str(root), str(root), str(root / 'a')]